@@ -0,0 +1,84 @@
+"""Compare the import rewrite engines on a source tree
+
+    python -m benchmarks.bench_import_rewrite --path /tmp/airflow-master \
+        --replace flask_appbuilder flask_appbuilder_1 --replace pendulum pendulum_1
+
+The tree is copied once per engine and rewritten by each of them. The
+elapsed time of every engine is reported together with the files
+whose output differs between the engines.
+"""
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from nixpkgs_pytools.import_rewrite import ENGINES, find_python_files, rename_modules
+
+
+def run_benchmark(path, module_mapper, jobs=1, engines=ENGINES):
+    # type: (str, List[Tuple[str, str]], int, List[str]) -> Dict
+    tempdir = tempfile.mkdtemp()
+    try:
+        elapsed = {}
+        changed = {}
+        for engine in engines:
+            directory = os.path.join(tempdir, engine)
+            shutil.copytree(path, directory, symlinks=True)
+            start = time.perf_counter()
+            changed[engine] = rename_modules(directory, module_mapper, jobs, engine)
+            elapsed[engine] = time.perf_counter() - start
+
+        reference = engines[0]
+        differences = sorted(
+            filename
+            for filename in find_python_files(path)
+            for engine in engines[1:]
+            if not filecmp.cmp(
+                os.path.join(tempdir, reference, filename), os.path.join(tempdir, engine, filename), shallow=False
+            )
+        )
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    return {
+        "files": len(list(find_python_files(path))),
+        "changed": {engine: len(files) for engine, files in changed.items()},
+        "elapsed": elapsed,
+        "speedup": {engine: elapsed[reference] / elapsed[engine] if elapsed[engine] else 0.0 for engine in engines},
+        "differences": differences,
+    }
+
+
+def print_summary(summary):
+    print("{files} python files".format(files=summary["files"]))
+    print("{:<8}{:>10}{:>10}{:>10}".format("engine", "changed", "s", "speedup"))
+    for engine, elapsed in summary["elapsed"].items():
+        print("{:<8}{:>10}{:>10.2f}{:>9.1f}x".format(
+            engine, summary["changed"][engine], elapsed, summary["speedup"][engine]))
+    for filename in summary["differences"]:
+        print("DIFFERS  {filename}".format(filename=filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the import rewrite engines on a source tree")
+    parser.add_argument("--path", required=True, help="source tree to rewrite, it is not modified")
+    parser.add_argument("--replace", nargs=2, action="append", required=True, help="module import to replace")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes of each engine")
+    parser.add_argument("--json", help="write the summary as json to this file")
+    args = parser.parse_args()
+
+    summary = run_benchmark(args.path, args.replace, args.jobs)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if summary["differences"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Benchmark the python-package-init pipeline against recorded fixtures
+
+    python -m benchmarks.record --fixtures /tmp/fixtures
+    python -m benchmarks.bench_package_init --fixtures /tmp/fixtures
+
+Each package of the corpus goes through the same stages as
+`python_package_init.initialize_package` with every stage timed
+separately. The pypi responses are replayed from a local server and
+the cache is disabled, so runs are reproducible and offline.
+"""
+import argparse
+import collections
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from nixpkgs_pytools.dependency import determine_dependencies_from_directory, sanitize_dependencies
+from nixpkgs_pytools.download import download_package_json, extract_package, stream_to_file
+from nixpkgs_pytools.format import (
+    format_description,
+    format_homepage,
+    format_normalized_package_name,
+)
+from nixpkgs_pytools.http_client import set_default_client
+from nixpkgs_pytools.license import classify_license
+from nixpkgs_pytools.output import write_nix_file
+from nixpkgs_pytools.python_package_init import determine_check_phase, metadata_to_nix
+from nixpkgs_pytools.sandbox import SetupSandbox, set_default_sandbox
+from nixpkgs_pytools.utils import determine_filename_extension
+
+from .fixtures import FixtureServer, json_filename, read_corpus
+from .record import DEFAULT_CORPUS
+
+
+STAGES = ["metadata", "download", "unpack", "dependencies", "format", "render", "write"]
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.timings = collections.OrderedDict()
+
+    def __call__(self, stage):
+        self._stage = stage
+        return self
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.timings[self._stage] = time.perf_counter() - self._start
+
+
+def run_package(package_name, directory, client):
+    # type: (str, str, HTTPClient) -> Dict[str, float]
+    """Run the stages of initialize_package for one package returning the seconds of each stage"""
+    timer = StageTimer()
+    with timer("metadata"):
+        package_json = download_package_json(package_name, client=client)
+        version = package_json["info"]["version"]
+        release = next(
+            release for release in package_json["releases"][version] if release["packagetype"] == "sdist"
+        )
+
+    with tempfile.TemporaryDirectory(dir=directory) as tempdir:
+        archive_filename = os.path.join(tempdir, os.path.basename(release["url"]))
+        with timer("download"):
+            stream_to_file(client, release["url"], archive_filename, release["digests"]["sha256"])
+
+        with timer("unpack"):
+            extracted_directory = extract_package(archive_filename, tempdir)
+
+        with timer("dependencies"):
+            source, dependencies = determine_dependencies_from_directory(
+                os.path.join(tempdir, extracted_directory)
+            )
+            dependencies = sanitize_dependencies(dependencies)
+
+    with timer("format"):
+        info = package_json["info"]
+        license_match = classify_license(info)
+        metadata = {
+            "pname": format_normalized_package_name(info["name"]),
+            "downloadname": info["name"],
+            "version": version,
+            "python_version": info["requires_python"],
+            "sha256": release["digests"]["sha256"],
+            "url": release["url"],
+            "extension": determine_filename_extension(release["filename"], info["name"], version),
+            "description": format_description(info["summary"]),
+            # the homepage is not part of the fixtures
+            "homepage": format_homepage(info["home_page"], probe=False),
+            "maintainer": "benchmark",
+            "resolved_license": license_match.license if license_match else None,
+            "license_confidence": license_match.confidence if license_match else None,
+            "license": info["license"],
+        }
+        metadata.update(dependencies)
+        metadata["checkPhase"] = determine_check_phase(metadata)
+
+    with timer("render"):
+        content = metadata_to_nix(metadata)
+
+    with timer("write"):
+        write_nix_file(content, os.path.join(directory, metadata["pname"], "default.nix"), force=True)
+
+    return timer.timings
+
+
+def percentile(values, q):
+    # type: (List[float], float) -> float
+    """Nearest-rank percentile of values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(values)))
+    return values[max(rank - 1, 0)]
+
+
+def peak_rss():
+    # type: () -> Dict[str, int]
+    """Peak resident set size in bytes of this process and its (sandbox) children"""
+    if resource is None:
+        return {}
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def summarize(results, elapsed):
+    # type: (Dict[str, Union[Dict[str, float], str]], float) -> Dict
+    timings = [timings for timings in results.values() if isinstance(timings, dict)]
+    stages = collections.OrderedDict()
+    for stage in STAGES + ["total"]:
+        if stage == "total":
+            values = [sum(t.values()) for t in timings]
+        else:
+            values = [t[stage] for t in timings if stage in t]
+        stages[stage] = {
+            "total": sum(values),
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+        }
+
+    return {
+        "packages": len(results),
+        "failures": {name: error for name, error in results.items() if not isinstance(error, dict)},
+        "elapsed": elapsed,
+        "throughput": len(timings) / elapsed if elapsed else 0.0,
+        "stages": stages,
+        "peak_rss": peak_rss(),
+    }
+
+
+def print_summary(summary):
+    print(
+        "{packages} packages ({failures} failed) in {elapsed:.2f}s, {throughput:.2f} packages/s".format(
+            packages=summary["packages"],
+            failures=len(summary["failures"]),
+            elapsed=summary["elapsed"],
+            throughput=summary["throughput"],
+        )
+    )
+    print("{:<14}{:>10}{:>10}{:>10}{:>10}".format("stage", "total s", "mean ms", "p50 ms", "p95 ms"))
+    for stage, statistics in summary["stages"].items():
+        print(
+            "{:<14}{:>10.2f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                stage,
+                statistics["total"],
+                statistics["mean"] * 1000,
+                statistics["p50"] * 1000,
+                statistics["p95"] * 1000,
+            )
+        )
+    for process, rss in sorted(summary["peak_rss"].items()):
+        print("peak rss ({process}): {rss:.1f} MiB".format(process=process, rss=rss / 1024.0 ** 2))
+    for package_name, error in sorted(summary["failures"].items()):
+        print("FAILED  {package_name}: {error}".format(package_name=package_name, error=error))
+
+
+def run_benchmark(package_names, fixture_directory, output_directory, sandbox=True, repeat=1):
+    # type: (List[str], str, str, bool, int) -> Dict
+    results = collections.OrderedDict()
+    with FixtureServer(fixture_directory) as server:
+        client = server.client()
+        set_default_client(client)
+        setup_sandbox = SetupSandbox(workers=1) if sandbox else None
+        set_default_sandbox(setup_sandbox)
+        start = time.perf_counter()
+        try:
+            for iteration in range(repeat):
+                for package_name in package_names:
+                    key = package_name if repeat == 1 else "{}#{}".format(package_name, iteration)
+                    try:
+                        results[key] = run_package(package_name, output_directory, client)
+                    except Exception as e:
+                        results[key] = "{name}: {e}".format(name=type(e).__name__, e=e)
+        finally:
+            elapsed = time.perf_counter() - start
+            set_default_sandbox(None)
+            set_default_client(None)
+            if setup_sandbox is not None:
+                setup_sandbox.close()
+    return summarize(results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark python-package-init against recorded fixtures")
+    parser.add_argument("--fixtures", required=True, help="directory of fixtures written by benchmarks.record")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="file with a package name per line")
+    parser.add_argument("-n", "--limit", type=int, help="only benchmark the first n packages")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times to run the corpus")
+    parser.add_argument("--no-sandbox", action="store_true", help="Mock setup.py in this process")
+    parser.add_argument("--output", help="directory for the generated derivations (temporary by default)")
+    parser.add_argument("--json", help="write the summary as json to this file")
+    args = parser.parse_args()
+
+    package_names = [
+        package_name for package_name in read_corpus(args.corpus)
+        if os.path.isfile(json_filename(args.fixtures, package_name))
+    ][:args.limit]
+    if not package_names:
+        parser.error("no recorded packages in {fixtures}, run benchmarks.record first".format(fixtures=args.fixtures))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        summary = run_benchmark(
+            package_names, args.fixtures, args.output or tempdir, not args.no_sandbox, args.repeat
+        )
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
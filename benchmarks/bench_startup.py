@@ -0,0 +1,147 @@
+"""Time the startup of the command line tools
+
+    python -m benchmarks.bench_startup --runs 10 --budget-ms 250
+
+The `main()` of every command line tool runs in a fresh interpreter
+with `python -X importtime` on arguments that do no work: a lookup of
+a package that is not in an empty offline cache or a tree without
+python files. The median wall time of each run is reported together
+with its slowest imports. Heavy optional dependencies are only needed
+by runs that use them and must not be imported by these runs, the
+benchmark fails when one of them is.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ENTRY_POINTS = [
+    "nixpkgs_pytools.python_package_init",
+    "nixpkgs_pytools.batch",
+    "nixpkgs_pytools.update",
+    "nixpkgs_pytools.import_rewrite",
+]
+
+# command line tools and arguments on which they do no work, {directory} is an empty directory
+COMMANDS = {
+    "nixpkgs_pytools.python_package_init": [
+        "missing-package", "--offline", "--cache-dir", "{directory}", "--stdout",
+    ],
+    "nixpkgs_pytools.batch": [
+        "missing-package", "--offline", "--cache-dir", "{directory}", "--directory", "{directory}",
+    ],
+    "nixpkgs_pytools.update": ["{directory}", "--cache-dir", "{directory}"],
+    "nixpkgs_pytools.import_rewrite": ["--path", "{directory}", "--replace", "numpy", "mynumpy"],
+}
+
+RUN_MAIN = """
+import sys
+sys.argv = {argv!r}
+from {module} import main
+try:
+    main()
+except (Exception, SystemExit):
+    pass
+"""
+
+# imported on first use only
+LAZY_MODULES = ["jinja2", "rope", "unittest.mock", "mock", "distutils", "xmlrpc.client", "cProfile"]
+
+
+def import_times(module, arguments=None):
+    # type: (str, Optional[List[str]]) -> Dict[str, Tuple[int, int]]
+    """(self, cumulative) microseconds of every module imported by `module`
+
+    With `arguments` the `main()` of the module runs with them.
+    """
+    code = "import {module}".format(module=module)
+    if arguments is not None:
+        code = RUN_MAIN.format(argv=[module] + arguments, module=module)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        if not self_time.strip().isdigit():
+            # header
+            continue
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+def eager_lazy_modules(times):
+    # type: (Dict[str, Tuple[int, int]]) -> List[str]
+    """Lazy modules that were imported at startup"""
+    return sorted(
+        name for name in times
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)
+    )
+
+
+def command_times(module):
+    # type: (str) -> Dict[str, Tuple[int, int]]
+    """import_times of running the `main()` of `module` on COMMANDS"""
+    directory = tempfile.mkdtemp()
+    try:
+        return import_times(module, [argument.format(directory=directory) for argument in COMMANDS[module]])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_benchmark(modules=ENTRY_POINTS, runs=5, slowest=5):
+    # type: (List[str], int, int) -> Dict
+    summary = {}
+    for module in modules:
+        totals = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            times = command_times(module)
+            totals.append((time.perf_counter() - start) * 1000)
+        own = {name: value for name, value in times.items() if name != module}
+        summary[module] = {
+            "ms": statistics.median(totals),
+            "slowest": sorted(own, key=lambda name: own[name][1], reverse=True)[:slowest],
+            "eager": eager_lazy_modules(times),
+        }
+    return summary
+
+
+def print_summary(summary):
+    print("{:<40}{:>10}".format("module", "ms"))
+    for module, result in summary.items():
+        print("{:<40}{:>10.1f}".format(module, result["ms"]))
+        print("    slowest imports: {slowest}".format(slowest=" ".join(result["slowest"])))
+        for name in result["eager"]:
+            print("    EAGER {name}".format(name=name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the startup of the command line tools")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module, the median is reported")
+    parser.add_argument("--budget-ms", type=float, help="fail when a command takes longer")
+    parser.add_argument("--json", help="write the summary as json to this file")
+    args = parser.parse_args()
+
+    summary = run_benchmark(runs=args.runs)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    over_budget = args.budget_ms is not None and any(result["ms"] > args.budget_ms for result in summary.values())
+    if over_budget or any(result["eager"] for result in summary.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Record pypi responses and replay them from a local stand-in server
+
+Layout of a fixture directory::
+
+   json/<normalized-package-name>.json   pypi json api response
+   files/packages/...                    sdists at their files.pythonhosted.org path
+
+Recorded json responses only keep the release of the recorded sdist
+so fixtures stay small and the benchmarked version never changes.
+"""
+import json
+import os
+import shutil
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from nixpkgs_pytools.download import download_package_json, stream_to_file
+from nixpkgs_pytools.format import format_normalized_package_name
+from nixpkgs_pytools.http_client import HostRewriteTransport, HTTPClient
+
+
+PYPI_URL = "https://pypi.org"
+FILES_URL = "https://files.pythonhosted.org"
+
+
+def read_corpus(filename):
+    # type: (str) -> List[str]
+    with open(filename) as f:
+        return [
+            line.strip() for line in f if line.strip() and not line.strip().startswith("#")
+        ]
+
+
+def json_filename(fixture_directory, package_name):
+    normalized_package_name = format_normalized_package_name(package_name)
+    return os.path.join(fixture_directory, "json", normalized_package_name + ".json")
+
+
+def sdist_filename(fixture_directory, url):
+    return os.path.join(fixture_directory, "files", *urlsplit(url).path.lstrip("/").split("/"))
+
+
+def record_package(package_name, fixture_directory, client):
+    # type: (str, str, HTTPClient) -> str
+    """Record the pypi json and sdist of the latest release of a package
+
+    Returns the recorded version.
+    """
+    package_json = download_package_json(package_name, client=client)
+    version = package_json["info"]["version"]
+    for release in package_json["releases"].get(version, []):
+        if release["packagetype"] == "sdist":
+            break
+    else:
+        raise ValueError(
+            "no source distribution (sdist) found for {package_name}:{version}".format(
+                package_name=package_name, version=version
+            )
+        )
+
+    filename = sdist_filename(fixture_directory, release["url"])
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    stream_to_file(client, release["url"], filename, release["digests"]["sha256"])
+
+    package_json["releases"] = {version: [release]}
+    package_json["urls"] = [release]
+    filename = json_filename(fixture_directory, package_name)
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, "w") as f:
+        json.dump(package_json, f)
+    return version
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        fixture_directory = self.server.fixture_directory
+        if len(parts) == 3 and parts[0] == "pypi" and parts[2] == "json":
+            filename = json_filename(fixture_directory, parts[1])
+        elif parts[0] == "packages" and ".." not in parts:
+            filename = os.path.join(fixture_directory, "files", *parts)
+        else:
+            filename = None
+
+        if filename is None or not os.path.isfile(filename):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(os.path.getsize(filename)))
+        self.end_headers()
+        with open(filename, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+
+class FixtureServer(object):
+    """Local stand-in for pypi.org and files.pythonhosted.org
+
+    Serves the json and sdists recorded in `fixture_directory` on a
+    random local port. `client()` returns an HTTP client sending the
+    requests for pypi to the server.
+    """
+
+    def __init__(self, fixture_directory):
+        self.fixture_directory = fixture_directory
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+        self._server.fixture_directory = fixture_directory
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{host}:{port}".format(host=host, port=port)
+
+    def client(self):
+        # type: () -> HTTPClient
+        transport = HostRewriteTransport({PYPI_URL: self.url, FILES_URL: self.url})
+        return HTTPClient(transport, retries=0)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,45 @@
+"""Record the pypi json and sdists of the benchmark corpus
+
+    python -m benchmarks.record --fixtures /tmp/fixtures
+
+Only this step accesses the network, the benchmark replays the
+recorded fixtures.
+"""
+import argparse
+import os
+import sys
+
+from nixpkgs_pytools.http_client import HTTPClient
+
+from .fixtures import json_filename, read_corpus, record_package
+
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.txt")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record pypi fixtures for the benchmarks")
+    parser.add_argument("--fixtures", required=True, help="directory to record the fixtures into")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="file with a package name per line")
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Record packages which were already recorded"
+    )
+    args = parser.parse_args()
+
+    client = HTTPClient()
+    failures = 0
+    for package_name in read_corpus(args.corpus):
+        if os.path.isfile(json_filename(args.fixtures, package_name)) and not args.force:
+            continue
+        try:
+            version = record_package(package_name, args.fixtures, client)
+        except Exception as e:
+            failures += 1
+            print("FAILED  {package_name}: {e}".format(package_name=package_name, e=e))
+        else:
+            print("OK      {package_name}=={version}".format(package_name=package_name, version=version))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import argparse
+import collections
+import concurrent.futures
+import os
+import re
+import sys
+import threading
+
+from .cache import add_cache_arguments, cache_from_arguments, get_default_cache, set_default_cache
+from .closure import resolve_closure
+from .dependency import add_dependency_arguments, set_python_version, set_scan_imports
+from .download import download_package_json
+from .format import set_probe_homepages
+from .http_client import add_http_arguments, client_from_arguments, set_default_client
+from .sandbox import add_sandbox_arguments, sandbox_from_arguments, set_default_sandbox
+from .nixpkgs_index import NixpkgsIndex, get_default_nixpkgs_index, nixpkgs_index_from_arguments, set_default_nixpkgs_index
+from .output import NixpkgsTransaction, write_nix_file
+from .python_package_init import metadata_to_nix, package_json_to_metadata
+from .template import (
+    add_template_arguments,
+    environment_arguments_from_arguments,
+    set_default_environment_arguments,
+)
+from .tracing import add_trace_arguments, profile, set_default_tracer, span, tracer_from_arguments
+
+
+PACKAGE_SPEC_REGEX = re.compile(
+    r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:==\s*([A-Za-z0-9._+!-]+))?\s*$"
+)
+
+PackageResult = collections.namedtuple(
+    "PackageResult", ["package_name", "version", "filename", "error"]
+)
+
+
+def main():
+    args = cli(sys.argv[1:])
+    set_default_cache(cache_from_arguments(args))
+    set_default_environment_arguments(*environment_arguments_from_arguments(args, get_default_cache()))
+    set_default_client(client_from_arguments(args))
+    set_scan_imports(args.scan_imports)
+    set_python_version(args.python_version)
+    set_probe_homepages(not args.no_homepage_probe)
+    set_default_nixpkgs_index(nixpkgs_index_from_arguments(args, get_default_cache()))
+    sandbox = sandbox_from_arguments(args, workers=args.jobs)
+    set_default_sandbox(sandbox)
+    tracer = tracer_from_arguments(args)
+    set_default_tracer(tracer)
+    packages = args.packages
+
+    try:
+        if args.closure:
+            results = initialize_closure(
+                packages, args.nixpkgs_root, args.jobs, args.force, args.diff
+            )
+        else:
+            results = initialize_packages(
+                packages, args.directory, args.jobs, args.force, args.nixpkgs_root, args.diff
+            )
+    finally:
+        if sandbox is not None:
+            sandbox.close()
+        if tracer is not None and tracer.filename:
+            tracer.write()
+    print_report(results)
+    if any(result.error for result in results):
+        sys.exit(1)
+
+
+def cli(arguments):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "packages",
+        nargs="*",
+        help="pypi package names optionally pinned to a version with <package>==<version>",
+    )
+    parser.add_argument(
+        "-r", "--requirements", help="requirements-style file of packages to initialize"
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=".",
+        help="directory to write <package-name>/default.nix derivations to",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=8,
+        help="number of packages to process concurrently",
+    )
+    parser.add_argument("--nixpkgs-root", help="Root directory of nixpkgs")
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Force creation of files, overwriting when they already exist",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="Print the diff of all changes made to the nixpkgs checkout",
+    )
+    parser.add_argument(
+        "--closure",
+        action="store_true",
+        help="Also create derivations for all dependencies missing from nixpkgs, requires --nixpkgs-root",
+    )
+    add_cache_arguments(parser)
+    add_http_arguments(parser)
+    add_sandbox_arguments(parser)
+    add_dependency_arguments(parser)
+    add_template_arguments(parser)
+    add_trace_arguments(parser)
+    args = parser.parse_args(arguments)
+    if not args.packages and not args.requirements:
+        parser.error("no packages specified, provide package names or --requirements")
+    if args.closure and not args.nixpkgs_root:
+        parser.error("--closure requires --nixpkgs-root")
+    try:
+        args.packages = [parse_package_spec(package) for package in args.packages]
+        if args.requirements:
+            args.packages.extend(read_requirements_file(args.requirements))
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    return args
+
+
+def parse_package_spec(spec):
+    # type: (str) -> Tuple[str, Optional[str]]
+    """Parse "<package>" or "<package>==<version>" into (package, version)
+
+    Other version specifiers are rejected rather than ignored since
+    only an exact version can be initialized.
+    """
+    match = PACKAGE_SPEC_REGEX.match(spec.strip())
+    if match is None:
+        raise ValueError('unable to parse package "{spec}", expected <package> or <package>==<version>'.format(spec=spec))
+    return match.group(1), match.group(2)
+
+
+def read_requirements_file(filename):
+    # type: (str) -> List[Tuple[str, Optional[str]]]
+    """Read packages from a requirements-style file
+
+    Comments, blank lines and pip options (lines starting with "-")
+    are ignored.
+    """
+    packages = []
+    with open(filename) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line or line.startswith("-"):
+                continue
+            try:
+                packages.append(parse_package_spec(line))
+            except ValueError as e:
+                raise ValueError("{filename}:{lineno}: {error}".format(filename=filename, lineno=lineno, error=e))
+    return packages
+
+
+def initialize_packages(packages, directory=".", jobs=8, force=False, nixpkgs_root=None, show_diff=False):
+    """Create a derivation for each (package, version) in packages
+
+    Fetching pypi metadata and determining package metadata (sdist
+    download, unpacking and dependency detection) are separate stages
+    each running on at most `jobs` threads. At most 2 * `jobs`
+    packages are in flight at once. Rendering and writing happens in
+    the calling thread as packages complete so that writes to a
+    nixpkgs checkout never race each other. Packages written to a
+    nixpkgs checkout are staged and committed all at once in the end,
+    if the commit fails none of them are written.
+    """
+    transaction = NixpkgsTransaction(nixpkgs_root, force) if nixpkgs_root is not None else None
+
+    in_flight = threading.BoundedSemaphore(2 * jobs)
+
+    def fetch(package_name, version):
+        in_flight.acquire()
+        try:
+            return download_package_json(package_name, version=version)
+        except Exception:
+            in_flight.release()
+            raise
+
+    def determine_metadata(fetch_future, package_name, version):
+        package_json = fetch_future.result()
+        try:
+            with profile(package_name), span("package", package=package_name):
+                return package_json_to_metadata(package_json, package_name, version)
+        finally:
+            in_flight.release()
+
+    results = [None] * len(packages)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as fetch_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as metadata_executor:
+        futures = {}
+        for index, (package_name, version) in enumerate(packages):
+            fetch_future = fetch_executor.submit(fetch, package_name, version)
+            metadata_future = metadata_executor.submit(
+                determine_metadata, fetch_future, package_name, version
+            )
+            futures[metadata_future] = index
+
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            package_name, version = packages[index]
+            try:
+                metadata = future.result()
+                content = metadata_to_nix(metadata)
+                filename = write_package(content, metadata, directory, force, transaction)
+                results[index] = PackageResult(package_name, metadata["version"], filename, None)
+            except Exception as e:
+                results[index] = PackageResult(package_name, version, None, str(e))
+
+    if transaction is not None:
+        results = commit_transaction(transaction, results, show_diff)
+    return results
+
+
+def initialize_closure(packages, nixpkgs_root, jobs=8, force=False, show_diff=False):
+    """Create derivations for packages and their dependencies missing from nixpkgs
+
+    Derivations are added to nixpkgs in topological order of the
+    dependency closure in a single transaction.
+    """
+    transaction = NixpkgsTransaction(nixpkgs_root, force)
+    index = get_default_nixpkgs_index() or NixpkgsIndex(nixpkgs_root)
+    closure = resolve_closure(
+        packages, package_json_to_metadata, lambda name: name in index, jobs
+    )
+
+    results = []
+    for package in closure:
+        if package.error:
+            results.append(PackageResult(package.package_name, package.version, None, package.error))
+            continue
+        try:
+            content = metadata_to_nix(package.metadata)
+            filename = write_package(content, package.metadata, None, force, transaction)
+            results.append(PackageResult(package.package_name, package.version, filename, None))
+        except Exception as e:
+            results.append(PackageResult(package.package_name, package.version, None, str(e)))
+    return commit_transaction(transaction, results, show_diff)
+
+
+def commit_transaction(transaction, results, show_diff=False):
+    """Commit the transaction, marking all written packages failed when it fails"""
+    try:
+        diff = transaction.commit()
+        if show_diff:
+            print(diff, end="")
+    except Exception as e:
+        results = [
+            result if result.error else result._replace(error=str(e)) for result in results
+        ]
+    return results
+
+
+def write_package(content, metadata, directory, force=False, transaction=None):
+    if transaction is not None:
+        return transaction.add(content, metadata["pname"])
+
+    filename = os.path.join(directory, metadata["pname"], "default.nix")
+    write_nix_file(content, filename, force)
+    return filename
+
+
+def print_report(results):
+    for result in results:
+        if result.error:
+            print('FAILED  {package_name}: {error}'.format(package_name=result.package_name, error=result.error))
+        else:
+            print('OK      {package_name} {version} -> {filename}'.format(
+                package_name=result.package_name, version=result.version, filename=result.filename))
+
+    failed = sum(1 for result in results if result.error)
+    print("{succeeded} succeeded, {failed} failed".format(succeeded=len(results) - failed, failed=failed))
+
+
+if __name__ == "__main__":
+    main()
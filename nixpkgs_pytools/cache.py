@@ -0,0 +1,488 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from .format import format_normalized_package_name
+from .http_client import DEFAULT_TIMEOUT
+from .utils import TEMPORARY_PREFIX, atomic_move, atomic_write, temporary_file
+
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # 2 GiB
+
+# fraction of max_size freed by an eviction
+EVICTION_HEADROOM = 0.1
+
+# temporary files written to this recently are downloads in progress
+IN_PROGRESS_MAX_AGE = DEFAULT_TIMEOUT
+
+# directories of evicted entries, the others are in use while running
+EVICTED_DIRECTORIES = ["json", "sdist", "imports", "metadata", "hosts", "serials", "rewrites"]
+
+_default_cache = None
+
+
+def default_cache_directory():
+    # type: () -> str
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "nixpkgs-pytools")
+
+
+def get_default_cache():
+    # type: () -> Optional[Cache]
+    return _default_cache
+
+
+def set_default_cache(cache):
+    # type: (Optional[Cache]) -> None
+    global _default_cache
+    _default_cache = cache
+
+
+def add_cache_arguments(parser):
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_directory(),
+        help="directory to cache pypi metadata and sdists",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE,
+        help="maximum size of the cache in bytes, least recently used entries are evicted",
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        type=int,
+        default=0,
+        help="seconds cached pypi metadata is used without revalidating with pypi",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not cache pypi metadata and sdists"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Regenerate package metadata even when it is cached",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached pypi metadata and sdists, never access the network",
+    )
+
+
+def cache_from_arguments(args):
+    # type: (argparse.Namespace) -> Optional[Cache]
+    if args.no_cache:
+        if args.offline:
+            raise ValueError("--offline requires the cache, it cannot be combined with --no-cache")
+        return None
+    return Cache(args.cache_dir, args.cache_max_size, args.cache_max_age, args.offline, args.refresh)
+
+
+def sha256_file(filename):
+    # type: (str) -> str
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Cache(object):
+    """Persistent cache of pypi metadata and sdist archives
+
+    Layout of the cache directory::
+
+       json/<normalized-package-name>.json          pypi json api response
+       json/<normalized-package-name>.headers.json  ETag and Last-Modified
+       json/<normalized-package-name>/<version>.json  pypi json api response of a release
+       sdist/<sha256[:2]>/<sha256>/<filename>       sdist archive
+       imports/<version>/<sha256[:2]>/<sha256>.json  imports of a python file
+       metadata/<normalized-package-name>/<version>-<sha256>-<key>.json
+                                                    metadata of a package
+       hosts/<host>.json                            whether a host supports https
+       serials/<key>.json                           pypi changelog serial of an update sweep
+       rewrites/<key>/<sha256[:2]>/<sha256>.py      python file after renaming its imports
+       rewrites/<key>/<sha256[:2]>/<sha256>.unchanged  python file without renamed imports
+       rewrites/<key>/trees/<sha256>.json           size and mtime of the rewritten files of a tree
+       nixpkgs/<sha256>.sqlite                      attribute index of a nixpkgs checkout
+       nixpkgs/<sha256>.json                        attribute offsets of a python-packages.nix
+       templates/                                   compiled jinja2 templates
+
+    sdists and python files are content addressed by their sha256
+    digest so they never need revalidation. Every read touches the entry's mtime which is
+    used to evict the least recently used entries once the cache grows
+    beyond `max_size` bytes. `nixpkgs/` and `templates/` are kept open
+    while in use and are small, they are never evicted. In `offline` mode missing entries are an
+    error instead of a network request. With `refresh` cached package
+    metadata is ignored and regenerated.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE, max_age=0, offline=False, refresh=False):
+        self.directory = directory or default_cache_directory()
+        self.max_size = max_size
+        self.max_age = max_age
+        self.offline = offline
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        # size of the entries, None until they are first listed by evict
+        self._size = None
+
+    def _json_filenames(self, package_name):
+        normalized_package_name = format_normalized_package_name(package_name)
+        directory = os.path.join(self.directory, "json")
+        return (
+            os.path.join(directory, normalized_package_name + ".json"),
+            os.path.join(directory, normalized_package_name + ".headers.json"),
+        )
+
+    def get_package_json(self, package_name):
+        # type: (str) -> Optional[Tuple[bytes, Dict[str, str], float]]
+        """Return the cached (content, headers, age in seconds) of a package"""
+        content_filename, headers_filename = self._json_filenames(package_name)
+        try:
+            with open(content_filename, "rb") as f:
+                content = f.read()
+            with open(headers_filename) as f:
+                headers = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        age = _touch(headers_filename) - headers.get("stored", 0)
+        _touch(content_filename)
+        return content, headers, age
+
+    def put_package_json(self, package_name, content, etag=None, last_modified=None):
+        # type: (str, bytes, Optional[str], Optional[str]) -> None
+        content_filename, headers_filename = self._json_filenames(package_name)
+        self._write(content_filename, content)
+        self.revalidated_package_json(package_name, etag, last_modified)
+        self.evict()
+
+    def revalidated_package_json(self, package_name, etag=None, last_modified=None):
+        # type: (str, Optional[str], Optional[str]) -> None
+        """Mark the cached package json as fresh after pypi confirmed it is unchanged"""
+        _, headers_filename = self._json_filenames(package_name)
+        headers = {"etag": etag, "last_modified": last_modified, "stored": time.time()}
+        self._write(headers_filename, json.dumps(headers).encode())
+
+    def _release_json_filename(self, package_name, version):
+        return os.path.join(
+            self.directory, "json", format_normalized_package_name(package_name), version + ".json"
+        )
+
+    def get_release_json(self, package_name, version):
+        # type: (str, str) -> Optional[bytes]
+        filename = self._release_json_filename(package_name, version)
+        try:
+            with open(filename, "rb") as f:
+                content = f.read()
+        except (IOError, OSError):
+            return None
+        _touch(filename)
+        return content
+
+    def put_release_json(self, package_name, version, content):
+        # type: (str, str, bytes) -> None
+        self._write(self._release_json_filename(package_name, version), content)
+        self.evict()
+
+    def get_changelog_serial(self, key):
+        # type: (str) -> Optional[Dict]
+        """State of the sweep `key` stored by `put_changelog_serial`"""
+        try:
+            with open(os.path.join(self.directory, "serials", key + ".json")) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put_changelog_serial(self, key, serial, pending=()):
+        # type: (str, int, Iterable[str]) -> None
+        """Remember the pypi changelog serial a sweep started at
+
+        `pending` are packages which have to be checked by the next
+        sweep even when they did not change.
+        """
+        state = {"serial": serial, "pending": sorted(pending)}
+        self._write(os.path.join(self.directory, "serials", key + ".json"), json.dumps(state).encode())
+
+    def sdist_filename(self, sha256, filename):
+        # type: (str, str) -> str
+        return os.path.join(self.directory, "sdist", sha256[:2], sha256, os.path.basename(filename))
+
+    def get_sdist(self, sha256, filename):
+        # type: (str, str) -> Optional[str]
+        """Return the path of the cached sdist or None if not cached"""
+        cached_filename = self.sdist_filename(sha256, filename)
+        if not os.path.isfile(cached_filename):
+            return None
+        _touch(cached_filename)
+        return cached_filename
+
+    def temporary_sdist_filename(self, sha256, filename):
+        # type: (str, str) -> str
+        """Temporary file next to the cached sdist to download into
+
+        Moving it into place with `put_sdist` is then a rename instead
+        of a copy.
+        """
+        fd, temporary_filename = temporary_file(self.sdist_filename(sha256, filename))
+        os.close(fd)
+        return temporary_filename
+
+    def put_sdist(self, sha256, filename, source_filename, verify=True):
+        # type: (str, str, str, bool) -> str
+        """Move a downloaded sdist into the cache
+
+        The sha256 of the file is verified unless `verify` is False
+        because the caller already hashed it while downloading.
+        """
+        actual_sha256 = sha256_file(source_filename) if verify else sha256
+        if actual_sha256 != sha256:
+            raise ValueError(
+                "sha256 mismatch for {filename}: expected {sha256} got {actual_sha256}".format(
+                    filename=filename, sha256=sha256, actual_sha256=actual_sha256
+                )
+            )
+
+        cached_filename = self.sdist_filename(sha256, filename)
+        atomic_move(source_filename, cached_filename)
+        self._stored(os.path.getsize(cached_filename))
+        self.evict()
+        return cached_filename
+
+    def _imports_filename(self, sha256, version):
+        return os.path.join(self.directory, "imports", str(version), sha256[:2], sha256 + ".json")
+
+    def get_imports(self, sha256, version):
+        # type: (str, int) -> Optional[Dict[str, List[str]]]
+        """Return the cached imports of the python file with digest `sha256`
+
+        `version` is the version of the import scanner which produced
+        the imports so changes to the scanner invalidate the entries.
+        """
+        filename = self._imports_filename(sha256, version)
+        try:
+            with open(filename) as f:
+                imports = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        _touch(filename)
+        return imports
+
+    def put_imports(self, sha256, version, imports):
+        # type: (str, int, Dict[str, List[str]]) -> None
+        """Store the imports of a python file
+
+        Does not evict entries since a package has many python files,
+        call `evict` once all of them are stored.
+        """
+        self._write(self._imports_filename(sha256, version), json.dumps(imports).encode())
+
+    def _metadata_filename(self, package_name, version, sha256, key):
+        return os.path.join(
+            self.directory,
+            "metadata",
+            format_normalized_package_name(package_name),
+            "{version}-{sha256}-{key}.json".format(version=version, sha256=sha256, key=key),
+        )
+
+    def get_metadata(self, package_name, version, sha256, key):
+        # type: (str, str, str, str) -> Optional[Dict]
+        """Return the cached metadata of a package release
+
+        `sha256` is the digest of the sdist and `key` identifies
+        everything else the metadata depends on (e.g. the version of
+        nixpkgs-pytools and the command line options).
+        """
+        if self.refresh:
+            return None
+        filename = self._metadata_filename(package_name, version, sha256, key)
+        try:
+            with open(filename) as f:
+                metadata = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        _touch(filename)
+        return metadata
+
+    def put_metadata(self, package_name, version, sha256, key, metadata):
+        # type: (str, str, str, str, Dict) -> None
+        self._write(
+            self._metadata_filename(package_name, version, sha256, key), json.dumps(metadata).encode()
+        )
+        self.evict()
+
+    def invalidate_metadata(self, package_name=None):
+        # type: (Optional[str]) -> None
+        """Remove the cached metadata of a package or of all packages"""
+        directory = os.path.join(self.directory, "metadata")
+        if package_name is not None:
+            directory = os.path.join(directory, format_normalized_package_name(package_name))
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def _rewrite_filename(self, key, sha256):
+        return os.path.join(self.directory, "rewrites", key, sha256[:2], sha256)
+
+    def get_rewrite(self, key, sha256):
+        # type: (str, str) -> Optional[Tuple[bool, Optional[bytes]]]
+        """(changed, content) of the python file with digest `sha256` after renaming imports
+
+        `key` identifies the renames and the engine. `content` is None
+        when the file does not change.
+        """
+        filename = self._rewrite_filename(key, sha256)
+        if os.path.exists(filename + ".unchanged"):
+            _touch(filename + ".unchanged")
+            return False, None
+        try:
+            with open(filename + ".py", "rb") as f:
+                content = f.read()
+        except (IOError, OSError):
+            return None
+        _touch(filename + ".py")
+        return True, content
+
+    def put_rewrite(self, key, sha256, content):
+        # type: (str, str, Optional[bytes]) -> None
+        """Store the result of renaming imports, None when the file did not change
+
+        Does not evict entries, call `evict` once all files are stored.
+        """
+        if content is None:
+            self._write(self._rewrite_filename(key, sha256) + ".unchanged", b"")
+        else:
+            self._write(self._rewrite_filename(key, sha256) + ".py", content)
+
+    def _rewrite_state_filename(self, key, directory):
+        tree = hashlib.sha256(os.path.abspath(directory).encode()).hexdigest()
+        return os.path.join(self.directory, "rewrites", key, "trees", tree + ".json")
+
+    def get_rewrite_state(self, key, directory):
+        # type: (str, str) -> Dict[str, List[int]]
+        """Relative path -> [size, mtime_ns] of the files of `directory` that need no rewrite"""
+        try:
+            with open(self._rewrite_state_filename(key, directory)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def put_rewrite_state(self, key, directory, state):
+        # type: (str, str, Dict[str, List[int]]) -> None
+        self._write(self._rewrite_state_filename(key, directory), json.dumps(state).encode())
+        self.evict()
+
+    def _host_filename(self, host):
+        return os.path.join(self.directory, "hosts", host.replace(":", "_") + ".json")
+
+    def get_https_host(self, host, max_age):
+        # type: (str, float) -> Optional[Tuple[bool, float]]
+        """Return (supports https, time probed) unless older than max_age seconds"""
+        try:
+            with open(self._host_filename(host)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if time.time() - entry["stored"] >= max_age:
+            return None
+        return entry["https"], entry["stored"]
+
+    def put_https_host(self, host, supported):
+        # type: (str, bool) -> None
+        entry = {"https": supported, "stored": time.time()}
+        self._write(self._host_filename(host), json.dumps(entry).encode())
+
+    def size(self):
+        # type: () -> int
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        for directory in EVICTED_DIRECTORIES:
+            for root, directories, filenames in os.walk(os.path.join(self.directory, directory)):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    try:
+                        status = os.stat(path)
+                    except OSError:
+                        continue
+                    yield status.st_mtime, path, status.st_size
+
+    def _write(self, filename, content):
+        atomic_write(filename, content)
+        self._stored(len(content))
+
+    def _stored(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+
+    def evict(self):
+        # type: () -> None
+        """Remove least recently used entries once the cache exceeds max_size
+
+        The entries are only listed on the first call and when the
+        entries stored since then may exceed max_size, so calling it
+        after every write is cheap. Eviction frees EVICTION_HEADROOM of
+        max_size to keep the next listing far away. Entries stored by
+        other processes are only noticed by the next listing. Downloads
+        in progress (temporary files written to within
+        IN_PROGRESS_MAX_AGE) are never evicted.
+        """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+            now = time.time()
+            entries = sorted(self._entries())
+            total_size = sum(size for _, _, size in entries)
+            target_size = self.max_size * (1 - EVICTION_HEADROOM) if total_size > self.max_size else total_size
+            for mtime, path, size in entries:
+                if total_size <= target_size:
+                    break
+                if _in_progress(path, mtime, now):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total_size -= size
+
+                directory = os.path.dirname(path)
+                if os.path.basename(os.path.dirname(os.path.dirname(directory))) == "sdist" \
+                        and not _has_download_in_progress(directory, now):
+                    shutil.rmtree(directory, ignore_errors=True)
+            self._size = total_size
+
+
+def _in_progress(path, mtime, now):
+    return os.path.basename(path).startswith(TEMPORARY_PREFIX) and now - mtime < IN_PROGRESS_MAX_AGE
+
+
+def _has_download_in_progress(directory, now):
+    try:
+        filenames = os.listdir(directory)
+    except OSError:
+        return False
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        if _in_progress(path, mtime, now):
+            return True
+    return False
+
+
+def _touch(filename):
+    now = time.time()
+    try:
+        os.utime(filename, (now, now))
+    except OSError:
+        pass
+    return now
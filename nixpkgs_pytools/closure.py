@@ -0,0 +1,117 @@
+"""Dependency closure of pypi packages missing from nixpkgs
+
+Starting from the requested packages the dependency graph is walked
+breadth-first. Every dependency is looked up in nixpkgs and only the
+missing ones are added to a deduplicating worklist that is processed
+by concurrent workers. Version constraints of dependencies are not
+resolved, the latest release of each dependency is used.
+"""
+import collections
+import concurrent.futures
+import heapq
+import logging
+
+from .download import download_package_json
+from .format import format_normalized_package_name
+
+log = logging.getLogger("closure")
+
+# inputs followed when walking the dependency graph
+CLOSURE_INPUTS = ["buildInputs", "propagatedBuildInputs"]
+
+ClosurePackage = collections.namedtuple(
+    "ClosurePackage", ["package_name", "version", "metadata", "dependencies", "error"]
+)
+
+
+def resolve_closure(packages, package_to_metadata, exists, jobs=8, check_inputs=False):
+    # type: (List[Tuple[str, Optional[str]]], Callable, Callable[[str], bool], int, bool) -> List[ClosurePackage]
+    """Determine the metadata of packages and all their missing dependencies
+
+    `package_to_metadata(package_json, package_name, version)`
+    determines the metadata of a package and `exists(name)` whether
+    nixpkgs already has a package. The requested packages are always
+    included. Returns the packages topologically ordered with
+    dependencies before their dependents. Packages that failed have
+    `error` set and their dependencies are not followed.
+    """
+    inputs = CLOSURE_INPUTS + (["checkInputs"] if check_inputs else [])
+
+    def determine(package_name, version):
+        package_json = download_package_json(package_name, version=version)
+        return package_to_metadata(package_json, package_name, version)
+
+    seen = set()
+    order = []  # discovery order, breadth-first
+    resolved = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+
+        def schedule(package_name, version):
+            name = format_normalized_package_name(package_name)
+            if name in seen:
+                return
+            seen.add(name)
+            order.append(name)
+            futures[executor.submit(determine, package_name, version)] = (name, package_name, version)
+
+        for package_name, version in packages:
+            schedule(package_name, version)
+
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, package_name, version = futures.pop(future)
+                try:
+                    metadata = future.result()
+                except Exception as e:
+                    resolved[name] = ClosurePackage(package_name, version, None, [], str(e))
+                    continue
+
+                dependencies = []
+                for key in inputs:
+                    for dependency in metadata.get(key, []):
+                        dependency = format_normalized_package_name(dependency)
+                        if dependency == name or dependency in dependencies:
+                            continue
+                        if dependency not in seen and exists(dependency):
+                            log.info("{dependency} of {name} exists in nixpkgs".format(dependency=dependency, name=name))
+                            continue
+                        dependencies.append(dependency)
+                        schedule(dependency, None)
+                resolved[name] = ClosurePackage(package_name, metadata["version"], metadata, dependencies, None)
+
+    return [resolved[name] for name in topological_order(order, resolved)]
+
+
+def topological_order(names, packages):
+    # type: (List[str], Dict[str, ClosurePackage]) -> List[str]
+    """Order names so that dependencies come before their dependents
+
+    Ties are broken by the order of `names`. Packages in a dependency
+    cycle are appended in the order of `names`.
+    """
+    position = {name: i for i, name in enumerate(names)}
+    remaining = {name: {d for d in packages[name].dependencies if d in position} for name in names}
+    dependents = collections.defaultdict(list)
+    for name, dependencies in remaining.items():
+        for dependency in dependencies:
+            dependents[dependency].append(name)
+
+    ready = [position[name] for name in names if not remaining[name]]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        name = names[heapq.heappop(ready)]
+        ordered.append(name)
+        for dependent in dependents[name]:
+            remaining[dependent].discard(name)
+            if not remaining[dependent]:
+                heapq.heappush(ready, position[dependent])
+
+    if len(ordered) < len(names):
+        done = set(ordered)
+        cycle = [name for name in names if name not in done]
+        log.warning("dependency cycle between {names}".format(names=", ".join(cycle)))
+        ordered.extend(cycle)
+    return ordered
@@ -2,19 +2,78 @@ import re
 import sys
 import os
 import tempfile
-import ast
-import glob
 import logging
+import threading
 
 log = logging.getLogger('dependencies')
 
-try:
-    from unittest import mock
-except ImportError:
-    import mock
-
 from .download import download_package
 from .format import format_normalized_package_name
+from .import_scanner import distribution_name, local_modules, scan_imports
+from .nixpkgs_index import get_default_nixpkgs_index
+from .metadata_files import (
+    dependencies_from_requires_dist,
+    determine_dependencies_from_pkg_info,
+    determine_dependencies_from_pyproject,
+    determine_dependencies_from_setup_cfg,
+)
+from .requirement import (
+    DEFAULT_PYTHON_VERSION,
+    TEST_EXTRAS,
+    InvalidRequirement,
+    evaluate_marker,
+    marker_environment,
+    marker_extras,
+    parse_requirement,
+)
+from .sandbox import get_default_sandbox
+from .static_setup import determine_dependencies_from_static_setup
+from .tracing import span, traced
+
+# name of a requirement that is not a valid PEP 508 dependency specifier
+REQUIREMENT_NAME_REGEX = re.compile(r"\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)")
+
+# mocking setup.py changes the working directory and sys.path which
+# are global to the process so only one package may be mocked at a time
+_mock_setup_lock = threading.Lock()
+
+_scan_imports = False
+_python_version = DEFAULT_PYTHON_VERSION
+
+
+def get_scan_imports():
+    # type: () -> bool
+    return _scan_imports
+
+
+def set_scan_imports(scan_imports):
+    # type: (bool) -> None
+    global _scan_imports
+    _scan_imports = scan_imports
+
+
+def get_python_version():
+    # type: () -> str
+    return _python_version
+
+
+def set_python_version(python_version):
+    # type: (str) -> None
+    global _python_version
+    _python_version = python_version
+
+
+def add_dependency_arguments(parser):
+    parser.add_argument(
+        "--scan-imports",
+        action="store_true",
+        help="Determine dependencies from the imports of the package when mocking setup.py fails",
+    )
+    parser.add_argument(
+        "--python-version",
+        default=DEFAULT_PYTHON_VERSION,
+        help="python version environment markers of requirements are evaluated for (default the running python)",
+    )
 
 
 # https://docs.python.org/3/library/index.html
@@ -261,18 +320,16 @@ STDLIB_MODULES = {
 }
 
 
-def determine_package_dependencies(package_json, url):
+def determine_package_dependencies(package_json, url, sha256=None):
     try:
         with tempfile.TemporaryDirectory() as tempdir:
-            extracted_directory = download_package(url, tempdir)
+            extracted_directory = download_package(url, tempdir, sha256)
             package_directory = os.path.join(tempdir, extracted_directory)
 
-            ## should wait since a lot of false positives
-            # determine_dependencies_from_python_ast(package_directory)
-
-            dependencies = determine_dependencies_from_mock_setup(package_directory)
+            source, dependencies = determine_dependencies_from_directory(package_directory)
     except Exception as e:
         log.info("unable to determine package depenencies via unpacking setup.py, using pypi api instead")
+        source = "pypi"
         dependencies = {
             "extraInputs": [],
             "buildInputs": [],
@@ -282,22 +339,68 @@ def determine_package_dependencies(package_json, url):
 
         # default to using metadata is setup mock failed
         if package_json["info"]["requires_dist"]:
-            extraInputs = []
-            propagatedBuildInputs = []
-            for package in package_json["info"]["requires_dist"]:
-                if re.search("extra\s*==\s*", package):
-                    extraInputs.append(package)
-                else:
-                    propagatedBuildInputs.append(package)
-            dependencies["extraInputs"] = extraInputs
-            dependencies["propagatedBuildInputs"] = propagatedBuildInputs
-
-    return sanitize_dependencies(dependencies)
+            dependencies = dependencies_from_requires_dist(package_json["info"]["requires_dist"])
+
+    log.info("dependencies determined from {source}".format(source=source))
+    dependencies = sanitize_dependencies(dependencies)
+    dependencies["dependencySource"] = source
+    return dependencies
+
+
+def determine_dependencies_from_directory(directory):
+    # type: (str) -> Tuple[str, Dict[str, List[str]]]
+    """Try each of DEPENDENCY_SOURCES in order until one determines the dependencies
+
+    Declarative metadata is cheap to read and checked first. Mocking
+    setup.py, which executes code, is the last resort. Returns the
+    name of the source and the dependencies.
+    """
+    for source, determine_dependencies in dependency_sources():
+        try:
+            with span("dependencies from " + source):
+                dependencies = determine_dependencies(directory)
+        except Exception as e:
+            log.info("unable to determine dependencies from {source}: {e}".format(source=source, e=e))
+            continue
+        if dependencies is not None:
+            return source, dependencies
+    raise ValueError("unable to determine dependencies of {directory}".format(directory=directory))
+
+
+def dependency_sources():
+    # type: () -> List[Tuple[str, Callable[[str], Optional[Dict[str, List[str]]]]]]
+    sources = list(DEPENDENCY_SOURCES)
+    if _scan_imports:
+        # imports have false positives, only used when setup.py cannot be mocked
+        sources.append(("imports", determine_dependencies_from_python_ast))
+    return sources
+
 
 def ensure_list(e):
-    return e if type(e) == list else [e]
+    return list(e) if isinstance(e, (list, tuple, set)) else [e]
 
 def determine_dependencies_from_mock_setup(directory):
+    sandbox = get_default_sandbox()
+    if sandbox is None:
+        with _mock_setup_lock:
+            return _determine_dependencies_from_mock_setup(directory)
+
+    try:
+        return sandbox.determine_dependencies(directory)
+    except ValueError as e:
+        log.warning(
+            'mocking setup.py::setup(...) failed thus dependency information is likely incomplete: "{e}"'.format(e=e)
+        )
+        raise
+
+
+def _determine_dependencies_from_mock_setup(directory):
+    # mock is only needed as the last resort, importing it is slow
+    try:
+        from unittest import mock
+    except ImportError:
+        import mock
+
     try:
         current_directory = os.getcwd()
         os.chdir(directory)
@@ -312,15 +415,18 @@ def determine_dependencies_from_mock_setup(directory):
         else:
             mock_path = "distutils.core.setup"
 
+        setup_globals = {
+            "__name__": "__main__",
+            "__file__": os.path.join(directory, "setup.py"),
+        }
         with mock.patch(mock_path) as mock_setup:
-            exec(setup_contents)
+            exec(compile(setup_contents, "setup.py", "exec"), setup_globals)
 
         args, kwargs = mock_setup.call_args
     except Exception as e:
-        print(
-            "mocking setup.py::setup(...) failed thus dependency information is likely incomplete"
+        log.warning(
+            'mocking setup.py::setup(...) failed thus dependency information is likely incomplete: "{e}"'.format(e=e)
         )
-        print('mocking error: "{e}"'.format(e=e))
         raise e
     finally:
         sys.path = sys.path[1:]
@@ -332,7 +438,7 @@ def determine_dependencies_from_mock_setup(directory):
             for p in v:
                 extraInputs.append("{p} # {k}".format(p=p, k=k))
         else:
-            extraInputs.append("{p} # {k}".format(p=p, k=k))
+            extraInputs.append("{p} # {k}".format(p=v, k=k))
     return {
         "extraInputs": extraInputs,
         "buildInputs": ensure_list(kwargs.get("setup_requires", [])),
@@ -341,109 +447,130 @@ def determine_dependencies_from_mock_setup(directory):
     }
 
 
-class ImportVisitor(ast.NodeVisitor):
-    def __init__(self):
-        self.imports = set()
+def _determine_dependencies_from_static_setup(directory):
+    return determine_dependencies_from_static_setup(directory, get_python_version())
 
-    def visit_Import(self, node):
-        for name in node.names:
-            namespace = tuple(name.name.split("."))
-            self.imports.add(namespace[0])
 
-    def visit_ImportFrom(self, node):
-        if node.module is None:  # relative import
-            return
-
-        partial_namespace = tuple(node.module.split("."))
-        self.imports.add(partial_namespace[0])
+# ordered from cheapest and most reliable to executing setup.py
+DEPENDENCY_SOURCES = [
+    ("pyproject.toml", determine_dependencies_from_pyproject),
+    ("setup.cfg", determine_dependencies_from_setup_cfg),
+    ("setup.py", _determine_dependencies_from_static_setup),
+    ("PKG-INFO", determine_dependencies_from_pkg_info),
+    ("setup.py (mocked)", determine_dependencies_from_mock_setup),
+]
 
 
 def determine_dependencies_from_python_ast(directory):
+    # type: (str) -> Dict[str, List[str]]
+    """Dependencies from the imports of the python files of a package
+
+    Imports of setup.py are build inputs, of test files check inputs
+    and of documentation and optional imports extra inputs. Standard
+    library and modules of the package itself are ignored.
+    """
+    imports_by_filename = scan_imports(directory)
+    ignored = STDLIB_MODULES | set(getattr(sys, "stdlib_module_names", ())) | {"__future__"}
+    ignored = ignored | local_modules(directory, list(imports_by_filename))
+
     dependencies = {
         "extraInputs": set(),
         "buildInputs": set(),
         "checkInputs": set(),
         "propagatedBuildInputs": set(),
     }
-
-    filenames = list(
-        glob.glob(os.path.join(directory, "**", "*.py"), recursive=True)
-    ) + list(glob.glob(os.path.join(directory, "*.py"), recursive=True))
-    for filename in filenames:
-        try:
-            with open(filename) as f:
-                tree = ast.parse(f.read())
-        except SyntaxError:
-            continue
-
-        import_visitor = ImportVisitor()
-        import_visitor.visit(tree)
-
-        namespaces = import_visitor.imports - STDLIB_MODULES
-
-        if "setup.py" in filename:
-            dependencies["buildInputs"] = dependencies["buildInputs"] | namespaces
-        elif "test" in filename:
-            dependencies["checkInputs"] = dependencies["buildInputs"] | namespaces
-        elif "doc" in filename:
-            dependencies["extraInputs"] = dependencies["extraInputs"] | namespaces
+    optional = set()
+    for filename, imports in imports_by_filename.items():
+        namespaces = set(imports["imports"]) - ignored
+        optional |= set(imports["optional"]) - ignored
+
+        parts = filename.split(os.sep)
+        if filename == "setup.py":
+            dependencies["buildInputs"] |= namespaces
+        elif (
+            parts[-1] == "conftest.py"
+            or parts[-1].startswith("test_")
+            or parts[-1].endswith("_test.py")
+            or any(part in {"test", "tests", "testing"} for part in parts[:-1])
+        ):
+            dependencies["checkInputs"] |= namespaces
+        elif len(parts) > 1 and parts[0] in {"doc", "docs", "examples"}:
+            dependencies["extraInputs"] |= namespaces
         else:
-            dependencies["propagatedBuildInputs"] = (
-                dependencies["propagatedBuildInputs"] | namespaces
-            )
-
-    dependencies["buildInputs"] = (
-        dependencies["buildInputs"] - dependencies["propagatedBuildInputs"]
-    )
-    dependencies["checkInputs"] = (
-        dependencies["checkInputs"] - dependencies["propagatedBuildInputs"]
-    )
-
-    import pprint
-
-    pprint.pprint(dependencies)
+            dependencies["propagatedBuildInputs"] |= namespaces
 
+    propagated = dependencies["propagatedBuildInputs"]
+    extras = (dependencies["extraInputs"] | optional) - propagated
+    return {
+        "extraInputs": ["{p} # optional".format(p=distribution_name(name)) for name in sorted(extras)],
+        "buildInputs": [distribution_name(name) for name in sorted(dependencies["buildInputs"] - propagated)],
+        "checkInputs": [distribution_name(name) for name in sorted(dependencies["checkInputs"] - propagated)],
+        "propagatedBuildInputs": [distribution_name(name) for name in sorted(propagated)],
+    }
 
-def sanitize_dependencies(packages):
-    def sanitize_dependency(package):
-        has_condition = None
 
-        match = re.search("[><=;]", package)
-        if match:
-            has_condition = True
+@traced("sanitize dependencies")
+def sanitize_dependencies(packages, python_version=None):
+    """Reduce requirements to the nixpkgs attributes of their packages
 
-        match = re.search(
-            "^([A-Za-z][A-Za-z\-_0-9]+)", format_normalized_package_name(package)
-        )
-        return match.group(1), has_condition
-
-    packageConditions = []
-    buildInputs = []
-    checkInputs = []
-    propagatedBuildInputs = []
-
-    for package in packages["buildInputs"]:
-        sanitized_name, has_condition = sanitize_dependency(package)
-        if has_condition:
-            packageConditions.append(package)
-        buildInputs.append(sanitized_name)
-
-    for package in packages["checkInputs"]:
-        sanitized_name, has_condition = sanitize_dependency(package)
-        if has_condition:
-            packageConditions.append(package)
-        checkInputs.append(sanitized_name)
-
-    for package in packages["propagatedBuildInputs"]:
-        sanitized_name, has_condition = sanitize_dependency(package)
-        if has_condition:
-            packageConditions.append(package)
-        propagatedBuildInputs.append(sanitized_name)
+    Requirements whose environment marker does not hold for the target
+    `python_version` are dropped, ones only required by an extra are
+    moved to extraInputs (checkInputs for test extras) and ones with a
+    version specifier are listed in packageConditions. Requirements
+    that cannot be parsed are listed in packageConditions as well and
+    kept as inputs when their name can be read.
+    """
+    environment = marker_environment(python_version or get_python_version())
+    nixpkgs_index = get_default_nixpkgs_index()
 
-    return {
-        "packageConditions": packageConditions,
-        "extraInputs": packages["extraInputs"],
-        "buildInputs": buildInputs,
-        "checkInputs": checkInputs,
-        "propagatedBuildInputs": propagatedBuildInputs,
+    dependencies = {
+        "packageConditions": [],
+        "extraInputs": list(packages["extraInputs"]),
+        "buildInputs": [],
+        "checkInputs": [],
+        "propagatedBuildInputs": [],
     }
+
+    def add(key, name):
+        # use the nixpkgs attribute when it differs from the pypi name
+        if nixpkgs_index is not None:
+            name = nixpkgs_index.attribute(name) or name
+        if name not in dependencies[key]:
+            dependencies[key].append(name)
+
+    for key in ("buildInputs", "checkInputs", "propagatedBuildInputs"):
+        for package in packages[key]:
+            try:
+                requirement = parse_requirement(package)
+            except InvalidRequirement as e:
+                # keep the input and leave the requirement to be handled by hand
+                log.warning(str(e))
+                dependencies["packageConditions"].append(package)
+                name = REQUIREMENT_NAME_REGEX.match(package)
+                if name is not None:
+                    add(key, format_normalized_package_name(name.group(1)))
+                continue
+
+            extras = marker_extras(requirement.marker)
+            condition = requirement.specifier is not None
+            if requirement.marker is not None:
+                # the extra clauses hold when installing the extra, the rest is evaluated for the target python
+                environments = [dict(environment, extra=extra) for extra in extras] or [environment]
+                try:
+                    required = any(evaluate_marker(requirement.marker, env) for env in environments)
+                except InvalidRequirement as e:
+                    log.warning(str(e))
+                    required = condition = True
+                if not required:
+                    log.info("{package} is not required for python {version}".format(package=package, version=environment["python_full_version"]))
+                    continue
+            if extras and not TEST_EXTRAS.intersection(extras):
+                dependencies["extraInputs"].append(
+                    "{p} # {k}".format(p=package.split(";", 1)[0].strip(), k=", ".join(extras))
+                )
+                continue
+
+            if condition:
+                dependencies["packageConditions"].append(package)
+            add("checkInputs" if extras else key, requirement.name)
+    return dependencies
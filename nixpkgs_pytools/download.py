@@ -1,20 +1,73 @@
-import urllib
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
-
+import fnmatch
+import functools
+import hashlib
 import shutil
 import os
 import json
+import posixpath
+import re
+import tarfile
+import zipfile
+
+from .cache import get_default_cache
+from .format import format_normalized_package_name
+from .http_client import HTTPError, get_default_client
+from .requirement import compare_versions
+from .tracing import traced
+
+
+PYPI_URL = "https://pypi.org"
+PYPI_XMLRPC_URL = PYPI_URL + "/pypi"
+SIMPLE_JSON_CONTENT_TYPE = "application/vnd.pypi.simple.v1+json"
+PRERELEASE_REGEX = re.compile(r"(a|b|c|rc|alpha|beta|pre|preview|dev)\d*", re.IGNORECASE)
+
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_EXTRACTED_SIZE = 256 * 1024 ** 2  # 256 MiB
+MAX_ROOT_FILE_SIZE = 1024 ** 2  # 1 MiB
+INSPECTED_FILE_PATTERNS = (
+    "*.py",
+    "setup.cfg",
+    "pyproject.toml",
+    "PKG-INFO",
+    "requirements*.txt",
+)
+
+
+@traced("fetch metadata", "package_name")
+def download_package_json(package_name, cache=None, client=None, version=None):
+    """pypi json api document of a package
 
+    With a `version` only the document of that release is fetched
+    which is much smaller for packages with many releases. It has the
+    same layout but `releases` only contains `version`.
+    """
+    client = client or get_default_client()
+    if cache is None:
+        cache = get_default_cache()
+    if version is not None:
+        return download_release_json(package_name, version, cache, client)
 
-def download_package_json(package_name):
-    url = "https://pypi.org/pypi/{package_name}/json".format(package_name=package_name)
+    cached = None
+    request_headers = {}
+    if cache is not None:
+        cached = cache.get_package_json(package_name)
+        if cached is None and cache.offline:
+            raise ValueError('package "{package_name}" is not cached and offline mode is enabled'.format(package_name=package_name))
+        elif cached is not None:
+            content, headers, age = cached
+            if cache.offline or age < cache.max_age:
+                return json.loads(content.decode())
+            if headers.get("etag"):
+                request_headers["If-None-Match"] = headers["etag"]
+            if headers.get("last_modified"):
+                request_headers["If-Modified-Since"] = headers["last_modified"]
+
+    url = "{pypi}/pypi/{package_name}/json".format(pypi=PYPI_URL, package_name=package_name)
     try:
-        response = urlopen(url)
-        return json.loads(response.read().decode())
-    except urllib.error.HTTPError as e:
+        response = client.get(url, headers=request_headers)
+        content = response.read()
+    except HTTPError as e:
         if e.code == 404:
             raise ValueError('package "{package_name}" does not exist on pypi'.format(package_name=package_name))
         else:
@@ -22,22 +75,261 @@ def download_package_json(package_name):
                 'error fetching pypi package "{package_name}" information'.format(package_name=package_name)
             )
 
+    if response.status == 304 and cached is not None:
+        content, headers, _ = cached
+        cache.revalidated_package_json(package_name, headers.get("etag"), headers.get("last_modified"))
+        return json.loads(content.decode())
+
+    if cache is not None:
+        cache.put_package_json(
+            package_name, content, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        )
+    return json.loads(content.decode())
+
+
+def download_release_json(package_name, version, cache=None, client=None):
+    """pypi json api document of a single release
+
+    Releases never change once uploaded so cached documents are used
+    without revalidation.
+    """
+    client = client or get_default_client()
+    if cache is None:
+        cache = get_default_cache()
+
+    content = cache.get_release_json(package_name, version) if cache is not None else None
+    if content is None:
+        if cache is not None and cache.offline:
+            raise ValueError('package "{package_name}" version "{version}" is not cached and offline mode is enabled'.format(
+                package_name=package_name, version=version))
+        url = "{pypi}/pypi/{package_name}/{version}/json".format(pypi=PYPI_URL, package_name=package_name, version=version)
+        try:
+            with client.get(url) as response:
+                content = response.read()
+        except HTTPError as e:
+            if e.code == 404:
+                raise ValueError('package "{package_name}" version "{version}" does not exist on pypi'.format(
+                    package_name=package_name, version=version))
+            raise ValueError(
+                'error fetching pypi package "{package_name}" information'.format(package_name=package_name)
+            )
+        if cache is not None:
+            cache.put_release_json(package_name, version, content)
+
+    release_json = json.loads(content.decode())
+    return {"info": release_json["info"], "releases": {version: release_json["urls"]}}
+
+
+@traced("fetch index", "package_name")
+def download_simple_json(package_name, client=None):
+    # type: (str, Optional[HTTPClient]) -> Dict
+    """PEP 691 json simple index of a package, the files of all releases without metadata"""
+    client = client or get_default_client()
+    url = "{pypi}/simple/{package_name}/".format(pypi=PYPI_URL, package_name=package_name)
+    try:
+        with client.get(url, headers={"Accept": SIMPLE_JSON_CONTENT_TYPE}) as response:
+            return json.loads(response.read().decode())
+    except HTTPError as e:
+        if e.code == 404:
+            raise ValueError('package "{package_name}" does not exist on pypi'.format(package_name=package_name))
+        raise ValueError('error fetching pypi package "{package_name}" index'.format(package_name=package_name))
+
+
+def latest_sdist(simple_json, package_name):
+    # type: (Dict, str) -> Tuple[str, Dict]
+    """(version, release) of the newest stable sdist in a simple index
+
+    The release has the keys of the releases of the pypi json api
+    that are used to generate derivations.
+    """
+    name_pattern = "[-_.]+".join(re.escape(part) for part in re.split("[-_.]+", package_name))
+    sdist_regex = re.compile(r"^{name}-(.+?)\.(tar\.gz|zip|tar\.bz2|tar\.xz|tgz)$".format(name=name_pattern), re.IGNORECASE)
+
+    sdists = {}
+    for file in simple_json.get("files", []):
+        match = sdist_regex.match(file["filename"])
+        if match is None or file.get("yanked") or "sha256" not in file.get("hashes", {}):
+            continue
+        version = match.group(1)
+        if PRERELEASE_REGEX.search(version):
+            continue
+        sdists[version] = {
+            "filename": file["filename"],
+            "packagetype": "sdist",
+            "url": file["url"],
+            "digests": {"sha256": file["hashes"]["sha256"]},
+        }
+    if not sdists:
+        raise ValueError("no source distribution (sdist) found for {package_name}".format(package_name=package_name))
+
+    latest = max(sdists, key=functools.cmp_to_key(
+        lambda a, b: -1 if compare_versions(a, "<", b) else (1 if compare_versions(a, ">", b) else 0)
+    ))
+    return latest, sdists[latest]
+
+
+def pypi_last_serial():
+    # type: () -> int
+    """Serial of the latest change to any package on pypi"""
+    return _pypi_xmlrpc().changelog_last_serial()
+
+
+def changed_packages_since(serial):
+    # type: (int) -> Tuple[Set[str], int]
+    """Normalized names of packages changed on pypi after `serial` and the latest serial"""
+    changes = _pypi_xmlrpc().changelog_since_serial(serial)
+    names = {format_normalized_package_name(change[0]) for change in changes}
+    return names, max([change[4] for change in changes] + [serial])
+
+
+def download_package(
+    url, directory, sha256=None, cache=None, client=None, max_extracted_size=DEFAULT_MAX_EXTRACTED_SIZE
+):
+    """Download and extract the files needed to inspect an sdist
+
+    The archive is streamed to disk in chunks while its sha256 is
+    computed and compared with `sha256`. Only the files selected by
+    `is_inspected_file` are extracted into `directory`. Returns the
+    name of the top-level directory of the sdist.
+    """
+    client = client or get_default_client()
+    if cache is None:
+        cache = get_default_cache()
+    use_cache = cache is not None and sha256 is not None
+
+    archive_filename = None
+    if use_cache:
+        archive_filename = cache.get_sdist(sha256, url)
+        if archive_filename is None and cache.offline:
+            raise ValueError("sdist {url} is not cached and offline mode is enabled".format(url=url))
+
+    if archive_filename is None:
+        if use_cache:
+            archive_filename = cache.temporary_sdist_filename(sha256, url)
+        else:
+            archive_filename = os.path.join(directory, os.path.basename(url))
+
+        try:
+            stream_to_file(client, url, archive_filename, sha256)
+        except Exception:
+            if os.path.exists(archive_filename):
+                os.remove(archive_filename)
+            raise
+
+        if use_cache:
+            archive_filename = cache.put_sdist(sha256, url, archive_filename, verify=False)
+
+    return extract_package(archive_filename, directory, max_extracted_size=max_extracted_size)
+
+
+def _pypi_xmlrpc():
+    # only incremental update sweeps use the xml-rpc api
+    try:
+        import xmlrpc.client as xmlrpc_client
+    except ImportError:
+        import xmlrpclib as xmlrpc_client
+    return xmlrpc_client.ServerProxy(PYPI_XMLRPC_URL)
+
+
+@traced("download", "url")
+def stream_to_file(client, url, filename, sha256=None, chunk_size=CHUNK_SIZE):
+    # type: (HTTPClient, str, str, Optional[str], int) -> str
+    """Write the response body of `url` to `filename` chunk by chunk
+
+    Returns the sha256 of the body and raises ValueError if it does not
+    match the expected `sha256`.
+    """
+    digest = hashlib.sha256()
+    with client.get(url) as response:
+        with open(filename, "wb") as f:
+            for chunk in response.iter_content(chunk_size):
+                digest.update(chunk)
+                f.write(chunk)
+
+    actual_sha256 = digest.hexdigest()
+    if sha256 is not None and actual_sha256 != sha256:
+        raise ValueError(
+            "sha256 mismatch for {url}: expected {sha256} got {actual_sha256}".format(
+                url=url, sha256=sha256, actual_sha256=actual_sha256
+            )
+        )
+    return actual_sha256
+
+
+def is_inspected_file(path, size):
+    # type: (str, int) -> bool
+    """Whether an sdist member is needed to determine dependencies
+
+    Python files and packaging metadata anywhere in the sdist plus
+    small files in the project root which setup.py commonly reads
+    (README, VERSION, ...). Data files deeper in the tree are skipped.
+    """
+    parts = path.split("/")
+    basename = parts[-1]
+    if any(fnmatch.fnmatch(basename, pattern) for pattern in INSPECTED_FILE_PATTERNS):
+        return True
+    if any(part.endswith(".egg-info") or part.startswith("requirements") for part in parts[1:-1]):
+        return True
+    return len(parts) <= 2 and size <= MAX_ROOT_FILE_SIZE
+
+
+@traced("unpack")
+def extract_package(archive_filename, directory, is_needed=is_inspected_file, max_extracted_size=DEFAULT_MAX_EXTRACTED_SIZE):
+    # type: (str, str, Callable[[str, int], bool], int) -> str
+    """Extract the members of an sdist archive selected by `is_needed`
+
+    Members are read one at a time so memory use is bounded by the
+    largest extracted member. Raises ValueError when members would
+    escape `directory` or more than `max_extracted_size` bytes would be
+    extracted.
+    """
+    if zipfile.is_zipfile(archive_filename):
+        archive = zipfile.ZipFile(archive_filename)
+        members = (
+            (info.filename, info.file_size, info.is_dir(), lambda info=info: archive.open(info))
+            for info in archive.infolist()
+        )
+    else:
+        try:
+            archive = tarfile.open(archive_filename, "r:*")
+        except tarfile.TarError:
+            raise ValueError("unsupported sdist archive format: {filename}".format(filename=archive_filename))
+        members = (
+            (info.name, info.size, info.isdir(), lambda info=info: archive.extractfile(info))
+            for info in archive
+            if info.isfile() or info.isdir()
+        )
 
-def download_package(url, directory):
-    base_filename = os.path.join(directory, os.path.basename(url))
+    top_level_directories = set()
+    extracted_size = 0
+    with archive:
+        for name, size, is_directory, open_member in members:
+            path = posixpath.normpath(name)
+            if path.startswith("/") or path == ".." or path.startswith("../"):
+                raise ValueError("sdist member {name} is outside of the archive".format(name=name))
+            if path == ".":
+                continue
+            top_level_directories.add(path.split("/")[0])
+            if is_directory or not is_needed(path, size):
+                continue
 
-    with urlopen(url) as response:
-        with open(base_filename, "wb") as f:
-            f.write(response.read())
+            extracted_size += size
+            if extracted_size > max_extracted_size:
+                raise ValueError(
+                    "extracting {filename} exceeds limit of {max_extracted_size} bytes".format(
+                        filename=archive_filename, max_extracted_size=max_extracted_size
+                    )
+                )
 
-    previous_directory_state = set(os.listdir(directory))
-    shutil.unpack_archive(base_filename, directory)
-    current_directory_state = set(os.listdir(directory))
+            filename = os.path.join(directory, *path.split("/"))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open_member() as source, open(filename, "wb") as destination:
+                shutil.copyfileobj(source, destination, CHUNK_SIZE)
 
-    changed_filenames = current_directory_state - previous_directory_state
-    if len(changed_filenames) > 1:
+    if len(top_level_directories) != 1:
         raise ValueError(
-            "expected that extracting sdist archive only produces one directory: {changed_filenames}".format(changed_filenames=changed_filenames)
+            "expected that extracting sdist archive only produces one directory: {changed_filenames}".format(changed_filenames=top_level_directories)
         )
 
-    return list(changed_filenames)[0]
+    return top_level_directories.pop()
@@ -1,10 +1,27 @@
+import concurrent.futures
+import re
+import string
+import threading
+import time
+
 try:
-    from urllib.request import urlopen
+    from urllib.parse import urlsplit
 except ImportError:
-    from urllib import urlopen
+    from urlparse import urlsplit
 
-import re
-import string
+from .http_client import HTTPError, get_default_client
+from .tracing import traced
+
+
+PROBE_TIMEOUT = 5
+PROBE_WORKERS = 8
+HOMEPAGE_PROBE_TTL = 7 * 24 * 3600
+
+_probe_homepages = True
+_probe_executor = None
+# host -> (supports https, time probed)
+_https_hosts = {}
+_https_hosts_lock = threading.Lock()
 
 
 def format_normalized_package_name(package_name):
@@ -16,27 +33,162 @@ def format_normalized_package_name(package_name):
 def format_description(description):
     # type: (str) -> str
     """Normalize whitespace, remove punctuation, and capitalize first letter"""
-    if len(description) == 0:
+    if not description:
         return ""
 
     description = re.sub("\s+", description.strip(string.punctuation), " ")
     return description[0].upper() + description[1:]
 
 
-def format_homepage(homepage):
-    # type: (str) -> str
-    """Use https url if possible"""
-    if homepage is None:
+def get_probe_homepages():
+    # type: () -> bool
+    return _probe_homepages
+
+
+def set_probe_homepages(probe_homepages):
+    # type: (bool) -> None
+    global _probe_homepages
+    _probe_homepages = probe_homepages
+
+
+def format_homepage(homepage, probe=True, cache=None):
+    # type: (str, bool, Optional[Cache]) -> str
+    """Use https url if possible
+
+    Whether a host supports https is determined with a HEAD request
+    and cached per host for HOMEPAGE_PROBE_TTL seconds, in `cache` if
+    given. When `probe` is False the homepage is never requested, http
+    urls of hosts not in the cache are rewritten to https.
+    """
+    if homepage is None or not re.match("https?://", homepage):
         return ""
     if re.match("https://", homepage):
         return homepage
 
-    https_homepage = homepage.replace("http://", "https://")
+    https_homepage = "https://" + homepage[len("http://"):]
+    host = urlsplit(homepage).netloc.lower()
+    supported = _cached_https_host(host, cache)
+    if supported is None:
+        if not probe:
+            return https_homepage
+        supported = _probe_https(https_homepage)
+        _store_https_host(host, supported, cache)
+    return https_homepage if supported else homepage
+
+
+def format_homepage_async(homepage, probe=True, cache=None):
+    # type: (str, bool, Optional[Cache]) -> concurrent.futures.Future
+    """`format_homepage` in the background, e.g. while the sdist downloads"""
+    global _probe_executor
+    with _https_hosts_lock:
+        if _probe_executor is None:
+            _probe_executor = concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+    return _probe_executor.submit(format_homepage, homepage, probe, cache)
+
+
+@traced("probe homepage")
+def _probe_https(url):
     try:
-        response = urlopen(https_homepage)
-        return https_homepage
-    except:
-        return ""
+        get_default_client().head(url, timeout=PROBE_TIMEOUT, retries=0).close()
+    except HTTPError:
+        # the host answered over https, only not with a success
+        return True
+    except Exception:
+        return False
+    return True
+
+
+def _cached_https_host(host, cache):
+    with _https_hosts_lock:
+        if host in _https_hosts:
+            supported, stored = _https_hosts[host]
+            if time.time() - stored < HOMEPAGE_PROBE_TTL:
+                return supported
+
+    if cache is None:
+        return None
+    cached = cache.get_https_host(host, HOMEPAGE_PROBE_TTL)
+    if cached is not None:
+        with _https_hosts_lock:
+            _https_hosts[host] = cached
+        return cached[0]
+    return None
+
+
+def _store_https_host(host, supported, cache):
+    with _https_hosts_lock:
+        _https_hosts[host] = (supported, time.time())
+    if cache is not None:
+        cache.put_https_host(host, supported)
+
+
+CASE_SENSITIVE_LICENSE_NIX_MAP = {
+    "3-clause BSD": "bsd3",
+    "AGPL": "agpl3",
+    "Apache": "asl20",
+    "Apache 2": "asl20",
+    "Apache2": "asl20",
+    "Apache-2": "asl20",
+    "Apache 2.0": "asl20",
+    "Apache-2.0": "asl20",
+    "Apache License": "asl20",
+    "Apache License (2.0)": "asl20",
+    "Apache License 2.0": "asl20",
+    "Apache License, Version 2.0": "asl20",
+    "Apache License Version 2.0": "asl20",
+    "Apache Software License": "asl20",
+    "Apache Software License 2.0": "asl20",
+    "BSD license": " # lookup BSD license being used: bsd0, bsd2, bsd3, or bsdOriginal ",
+    "BSD": " # lookup BSD license being used: bsd0, bsd2, bsd3, or bsdOriginal ",
+    "BSD-3": "bsd3",
+    "BSD 3-clause": "bsd3",
+    "BSD 3-Clause License": "bsd3",
+    "GNU GPL": "gpl1",
+    "GNU LGPL": "lgpl2Plus",
+    "GNU GPLv2 or any later version": "gpl2Plus",
+    "GNU General Public License (GPL)": "gpl1",
+    "GNU General Public License v2 or later (GPLv2+)": "gpl2Plus",
+    "GPL": "gpl1",
+    "GPLv2 or later": "gpl2Plus",
+    "GPLv2": "gpl2",
+    "GPLv2+": "gpl2Plus",
+    "GPLv3": "gpl3",
+    "GPL v3": "gpl3",
+    "GPLv3+": "gpl3Plus",
+    "ISC": "isc",
+    "ISC License": "isc",
+    "LGPL": "lgpl2Plus",
+    "LGPLv2+": "lgpl2Plus",
+    "LGPLv2.1 or later": "lgpl21Plus",
+    "LGPLv3": "lgpl3",
+    "LGPLv3+": "lgpl3Plus",
+    "License :: OSI Approved :: MIT License": "mit",
+    "MIT": "mit",
+    "MIT License": "mit",
+    "The MIT License: http://www.opensource.org/licenses/mit-license.php": "mit",
+    "Mozilla Public License 2.0 (MPL 2.0)": "mpl20",
+    "MPL": "mpl10",
+    "MPL2": "mpl20",
+    "MPL 2.0": "mpl20",
+    "New BSD": "bsd3",
+    "New BSD License": "bsd3",
+    "PSF License": "psfl",
+    "PSF": "psfl",
+    "Python Software Foundation License": "psfl",
+    "Python style": "psfl",
+    "Public Domain": "publicDomain",
+    "Two-clause BSD license": "bsd2",
+    "Unlicense": "unlicense",
+    "ZPL 2.1": "zpl21",
+    "ZPL": "zpl21",
+    "Zope Public License": "zpl21",
+}
+
+# lowercase license -> nix license, built once instead of on every call
+LICENSE_NIX_MAP = {
+    name.lower(): nix_attr
+    for name, nix_attr in CASE_SENSITIVE_LICENSE_NIX_MAP.items()
+}
 
 
 def format_license(license):
@@ -63,69 +215,4 @@ def format_license(license):
                pass
        sorted([(k, v) for k, v in licenses.items()], key=lambda t: -t[1])
     """
-    case_sensitive_license_nix_map = {
-        "3-clause BSD": "bsd3",
-        "AGPL": "agpl3",
-        "Apache": "asl20",
-        "Apache 2": "asl20",
-        "Apache2": "asl20",
-        "Apache-2": "asl20",
-        "Apache 2.0": "asl20",
-        "Apache-2.0": "asl20",
-        "Apache License": "asl20",
-        "Apache License (2.0)": "asl20",
-        "Apache License 2.0": "asl20",
-        "Apache License, Version 2.0": "asl20",
-        "Apache License Version 2.0": "asl20",
-        "Apache Software License": "asl20",
-        "Apache Software License 2.0": "asl20",
-        "BSD license": " # lookup BSD license being used: bsd0, bsd2, bsd3, or bsdOriginal ",
-        "BSD": " # lookup BSD license being used: bsd0, bsd2, bsd3, or bsdOriginal ",
-        "BSD-3": "bsd3",
-        "BSD 3-clause": "bsd3",
-        "BSD 3-Clause License": "bsd3",
-        "GNU GPL": "gpl1",
-        "GNU LGPL": "lgpl2Plus",
-        "GNU GPLv2 or any later version": "gpl2Plus",
-        "GNU General Public License (GPL)": "gpl1",
-        "GNU General Public License v2 or later (GPLv2+)": "gpl2Plus",
-        "GPL": "gpl1",
-        "GPLv2 or later": "gpl2Plus",
-        "GPLv2": "gpl2",
-        "GPLv2+": "gpl2Plus",
-        "GPLv3": "gpl3",
-        "GPL v3": "gpl3",
-        "GPLv3+": "gpl3Plus",
-        "ISC": "isc",
-        "ISC License": "isc",
-        "LGPL": "lgpl2Plus",
-        "LGPLv2+": "lgpl2Plus",
-        "LGPLv2.1 or later": "lgpl21Plus",
-        "LGPLv3": "lgpl3",
-        "LGPLv3+": "lgpl3Plus",
-        "License :: OSI Approved :: MIT License": "mit",
-        "MIT": "mit",
-        "MIT License": "mit",
-        "The MIT License: http://www.opensource.org/licenses/mit-license.php": "mit",
-        "Mozilla Public License 2.0 (MPL 2.0)": "mpl20",
-        "MPL": "mpl10",
-        "MPL2": "mpl20",
-        "MPL 2.0": "mpl20",
-        "New BSD": "bsd3",
-        "New BSD License": "bsd3",
-        "PSF License": "psfl",
-        "PSF": "psfl",
-        "Python Software Foundation License": "psfl",
-        "Python style": "psfl",
-        "Public Domain": "publicDomain",
-        "Two-clause BSD license": "bsd2",
-        "Unlicense": "unlicense",
-        "ZPL 2.1": "zpl21",
-        "ZPL": "zpl21",
-        "Zope Public License": "zpl21",
-    }
-    license_nix_map = {
-        name.lower(): nix_attr
-        for name, nix_attr in case_sensitive_license_nix_map.items()
-    }
-    return license_nix_map.get(license.lower())
+    return LICENSE_NIX_MAP.get(license.lower())
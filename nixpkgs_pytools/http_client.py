@@ -0,0 +1,317 @@
+try:
+    import http.client as httplib
+    from urllib.parse import urljoin, urlsplit
+    from urllib.request import getproxies, proxy_bypass
+except ImportError:
+    import httplib
+    from urlparse import urljoin, urlsplit
+    from urllib import getproxies, proxy_bypass
+
+import logging
+import socket
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger('http')
+
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+REDIRECT_STATUS_CODES = {301, 302, 303, 307, 308}
+USER_AGENT = "nixpkgs-pytools"
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+class HTTPError(Exception):
+    def __init__(self, url, code, reason=""):
+        self.url = url
+        self.code = code
+        self.reason = reason
+        super(HTTPError, self).__init__(
+            "HTTP Error {code}: {reason} ({url})".format(code=code, reason=reason, url=url)
+        )
+
+
+class Response(object):
+    """Response of an HTTP request
+
+    The body is read lazily from the underlying connection. Closing the
+    response (or using it as a context manager) hands the connection
+    back to the pool for reuse when the body was completely read.
+    """
+
+    def __init__(self, url, status, reason, headers, body, release=None):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = body
+        self._release = release
+
+    def read(self, amt=None):
+        # type: (Optional[int]) -> bytes
+        if amt is None:
+            content = self._body.read()
+            self.close()
+            return content
+        return self._body.read(amt)
+
+    def iter_content(self, chunk_size=1024 * 1024):
+        # type: (int) -> Iterator[bytes]
+        while True:
+            chunk = self._body.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release(self._body)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PooledTransport(object):
+    """Transport keeping idle keep-alive connections per (scheme, host, port)
+
+    Any object with a `request(method, url, headers, timeout)` method
+    returning a `Response` may be used as a transport by `HTTPClient`.
+    """
+
+    def __init__(self, max_idle_per_host=8):
+        self.max_idle_per_host = max_idle_per_host
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, key):
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = queue.LifoQueue(maxsize=self.max_idle_per_host)
+            return self._pools[key]
+
+    def _new_connection(self, scheme, host, port, timeout):
+        proxy = getproxies().get(scheme)
+        connection_class = httplib.HTTPSConnection if scheme == "https" else httplib.HTTPConnection
+        if proxy and not proxy_bypass(host):
+            proxy_url = urlsplit(proxy)
+            if proxy_url.scheme == "https":
+                connection_class = httplib.HTTPSConnection
+            connection = connection_class(proxy_url.hostname, proxy_url.port, timeout=timeout)
+            connection.set_tunnel(host, port)
+            return connection
+        return connection_class(host, port, timeout=timeout)
+
+    def request(self, method, url, headers, timeout):
+        split_url = urlsplit(url)
+        scheme = split_url.scheme
+        if scheme not in {"http", "https"}:
+            raise ValueError("unsupported url scheme {scheme}: {url}".format(scheme=scheme, url=url))
+        host = split_url.hostname
+        port = split_url.port or (443 if scheme == "https" else 80)
+        path = split_url.path or "/"
+        if split_url.query:
+            path += "?" + split_url.query
+
+        key = (scheme, host, port)
+        pool = self._pool(key)
+        try:
+            connection, reused = pool.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self._new_connection(scheme, host, port, timeout), False
+
+        try:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if reused:
+                # server closed the idle keep-alive connection
+                log.debug("retrying request on stale connection to {host}".format(host=host))
+                return self.request(method, url, headers, timeout)
+            raise
+
+        def release(body):
+            if body.isclosed() and not response.will_close:
+                try:
+                    pool.put_nowait(connection)
+                    return
+                except queue.Full:
+                    pass
+            connection.close()
+
+        if method == "HEAD":
+            response.read()
+
+        return Response(url, response.status, response.reason, response.msg, response, release)
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+class HostRewriteTransport(object):
+    """Transport sending requests for some urls to another base url
+
+    For example ``{"https://pypi.org": "http://localhost:8000"}`` to
+    replay pypi from a local stand-in server.
+    """
+
+    def __init__(self, mapping, transport=None):
+        self.mapping = mapping
+        self.transport = transport or PooledTransport()
+
+    def request(self, method, url, headers, timeout):
+        for prefix, replacement in self.mapping.items():
+            if url.startswith(prefix):
+                url = replacement + url[len(prefix):]
+                break
+        return self.transport.request(method, url, headers, timeout)
+
+
+class HTTPClient(object):
+    """HTTP client with connection pooling, timeouts, retries and redirects
+
+    Requests failing with a connection error or one of
+    RETRY_STATUS_CODES are retried up to `retries` times waiting
+    `backoff_factor * 2 ** attempt` seconds (or the Retry-After header)
+    between attempts. Status codes >= 400 raise `HTTPError`.
+    """
+
+    def __init__(
+        self,
+        transport=None,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR,
+        max_redirects=5,
+    ):
+        self.transport = transport or PooledTransport()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_redirects = max_redirects
+
+    def request(self, method, url, headers=None, timeout=None, retries=None):
+        # type: (str, str, Optional[Dict[str, str]], Optional[float], Optional[int]) -> Response
+        request_headers = {"User-Agent": USER_AGENT}
+        request_headers.update(headers or {})
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+
+        for _ in range(self.max_redirects + 1):
+            response = self._request_with_retries(method, url, request_headers, timeout, retries)
+            if response.status not in REDIRECT_STATUS_CODES:
+                break
+
+            location = response.headers.get("Location")
+            response.read()
+            if location is None:
+                raise HTTPError(url, response.status, "redirect without location")
+            url = urljoin(url, location)
+            if response.status == 303 and method != "HEAD":
+                method = "GET"
+        else:
+            raise HTTPError(url, response.status, "too many redirects")
+
+        if response.status >= 400:
+            response.close()
+            raise HTTPError(url, response.status, response.reason)
+        return response
+
+    def _request_with_retries(self, method, url, headers, timeout, retries):
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.request(method, url, headers, timeout)
+            except (httplib.HTTPException, socket.error) as e:
+                if attempt >= retries:
+                    raise
+                delay = self.backoff_factor * 2 ** attempt
+                log.info("request to {url} failed ({e}) retrying in {delay}s".format(url=url, e=e, delay=delay))
+            else:
+                if response.status not in RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                delay = _retry_after(response) or self.backoff_factor * 2 ** attempt
+                response.read()
+                log.info("request to {url} returned {status} retrying in {delay}s".format(
+                    url=url, status=response.status, delay=delay))
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_default_client():
+    # type: () -> HTTPClient
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
+
+
+def set_default_client(client):
+    # type: (Optional[HTTPClient]) -> None
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+
+def add_http_arguments(parser):
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="timeout in seconds of network requests",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="number of times to retry failed network requests",
+    )
+    parser.add_argument(
+        "--no-homepage-probe",
+        action="store_true",
+        help="Rewrite http homepages to https without checking that the host supports https",
+    )
+
+
+def client_from_arguments(args):
+    # type: (argparse.Namespace) -> HTTPClient
+    return HTTPClient(timeout=args.timeout, retries=args.retries)
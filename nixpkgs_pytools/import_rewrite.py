@@ -1,43 +1,654 @@
-from rope.refactor.rename import Rename
-from rope.base.project import Project
+"""Rename imported modules in the python files of a project
 
+All renames are applied in one pass over the project. Files are first
+searched textually for the old module names so that only files that
+can reference them are analyzed, and the remaining files are split
+between worker processes.
+
+There are two engines. `rope` builds rope's project model. `ast`
+rewrites one file at a time from its syntax tree with a scope
+analysis of the names bound by imports, only the renamed names are
+replaced so the rest of the file is kept byte for byte.
+
+rope is only imported by the rope engine, it is slow to import.
+"""
 import argparse
+import ast
+import collections
+import concurrent.futures
+import difflib
+import functools
+import hashlib
+import io
+import json
 import tempfile
+import tokenize
+import re
 import sys
 import os
 import shutil
 
+from .cache import DEFAULT_MAX_SIZE, Cache
+
+
+ENGINES = ['rope', 'ast']
+
+# increment when the output of an engine changes to invalidate cached rewrites
+REWRITE_VERSION = 1
+
+RewriteResult = collections.namedtuple('RewriteResult', ['path', 'original', 'content'])
+
+# tokens that do not matter when reading import statements
+_IGNORED_TOKENS = {
+    tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER
+}
 
-def rename_module(project, old_module, new_module):
+
+def rename_module(project, old_module, new_module, resources=None):
+    """Rename `old_module` in `resources` (default all files of the project)
+
+    Returns the paths of the changed files relative to the project.
+    """
+    from rope.refactor.rename import Rename
+
+    tempdir = tempfile.mkdtemp()
     try:
-        tempdir = tempfile.mkdtemp()
         os.makedirs(os.path.join(tempdir, old_module))
         open(os.path.join(tempdir, old_module, '__init__.py'), 'a').close()
         sys.path.append(tempdir)
 
         resource = project.find_module(old_module)
-        changes = Rename(project, resource).get_changes(new_module)
+        changes = Rename(project, resource).get_changes(new_module, resources=resources)
         changes.do()
+        return [
+            changed.path for changed in changes.get_changed_resources()
+            if changed.project is project and changed.path != resource.path
+        ]
     finally:
+        if tempdir in sys.path:
+            sys.path.remove(tempdir)
         shutil.rmtree(tempdir, ignore_errors=True)
 
-def rename_modules(project_path, module_mapper):
+
+def find_python_files(project_path):
+    """Paths of the python files of a project relative to it"""
+    for root, directories, filenames in os.walk(project_path):
+        directories[:] = sorted(d for d in directories if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                yield os.path.relpath(os.path.join(root, filename), project_path)
+
+
+def rename_files(project_path, module_mapper, files):
+    """Apply all renames to `files`, a list of (path, referenced modules)
+
+    Runs in a worker process with its own rope project.
+    """
+    from rope.base.project import Project
+
     project = Project(project_path, ropefolder=None)
+    changed = set()
+    try:
+        for old_module, new_module in module_mapper:
+            resources = [project.get_resource(path) for path, modules in files if old_module in modules]
+            if resources:
+                changed.update(rename_module(project, old_module, new_module, resources))
+    finally:
+        project.close()
+    return changed
+
+
+class _Scope(object):
+    def __init__(self, kind, parent=None):
+        self.kind = kind  # module, function, class or comprehension
+        self.parent = parent
+        self.bound = set()
+        self.imported = set()  # names bound by `import <old module>`
+        self.globals = set()
+        self.nonlocals = set()
+
+    @property
+    def module(self):
+        scope = self
+        while scope.parent is not None:
+            scope = scope.parent
+        return scope
+
+    def resolve(self, name):
+        """Scope that binds name, None for builtins"""
+        scope = self
+        while scope is not None:
+            if name in scope.globals:
+                return scope.module
+            # class bodies are not visible from their methods
+            if (scope is self or scope.kind != 'class') and name in scope.bound and name not in scope.nonlocals:
+                return scope
+            scope = scope.parent
+        return None
+
+
+class _ImportVisitor(ast.NodeVisitor):
+    """Collect the scopes of a module and the nodes that may reference old modules"""
+
+    def __init__(self, old_modules):
+        self.old_modules = old_modules
+        self.top_level_modules = {module for module in old_modules if '.' not in module}
+        self.scope = _Scope('module')
+        self.names = []  # (ast.Name, scope)
+        self.statements = []  # (ast.Import | ast.ImportFrom | ast.Global, scope)
+
+    @staticmethod
+    def _matches_module(module, old):
+        return module == old or module.startswith(old + '.')
+
+    def _matches(self, module):
+        return any(self._matches_module(module, old) for old in self.old_modules)
+
+    # NodeVisitor looks up the method by name for every node and visits
+    # the expression contexts, both dominate the time on large files
+    _methods = {}
+
+    def visit(self, node):
+        try:
+            method = self._methods[node.__class__][0]
+        except KeyError:
+            cls = node.__class__
+            method = getattr(_ImportVisitor, 'visit_' + cls.__name__, None)
+            self._methods[cls] = method, tuple(field for field in cls._fields if field != 'ctx')
+        if method is not None:
+            return method(self, node)
+        self.generic_visit(node)
+
+    def generic_visit(self, node):
+        for field in self._methods[node.__class__][1]:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.visit(value)
+
+    def visit_Constant(self, node):
+        pass
+
+    def _visit_scope(self, kind, nodes):
+        self.scope = _Scope(kind, self.scope)
+        try:
+            for node in nodes:
+                self.visit(node)
+        finally:
+            self.scope = self.scope.parent
+
+    def _visit_all(self, nodes):
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    @staticmethod
+    def _arguments(args):
+        arguments = getattr(args, 'posonlyargs', []) + args.args + args.kwonlyargs
+        return arguments + [arg for arg in (args.vararg, args.kwarg) if arg is not None]
+
+    def visit_FunctionDef(self, node):
+        # decorators, defaults and annotations are evaluated in the enclosing scope
+        arguments = self._arguments(node.args)
+        self._visit_all(
+            node.decorator_list + node.args.defaults + node.args.kw_defaults
+            + [arg.annotation for arg in arguments] + [node.returns]
+        )
+        self.scope.bound.add(node.name)
+        self.scope = _Scope('function', self.scope)
+        try:
+            self.scope.bound.update(arg.arg for arg in arguments)
+            self._visit_all(node.body)
+        finally:
+            self.scope = self.scope.parent
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visit_all(node.args.defaults + node.args.kw_defaults)
+        self.scope = _Scope('function', self.scope)
+        try:
+            self.scope.bound.update(arg.arg for arg in self._arguments(node.args))
+            self.visit(node.body)
+        finally:
+            self.scope = self.scope.parent
+
+    def visit_ClassDef(self, node):
+        self._visit_all(node.decorator_list + node.bases + node.keywords)
+        self.scope.bound.add(node.name)
+        self._visit_scope('class', node.body)
+
+    def _visit_comprehension(self, node, elements):
+        # the first iterable is evaluated in the enclosing scope
+        self.visit(node.generators[0].iter)
+        nodes = []
+        for i, generator in enumerate(node.generators):
+            nodes.append(generator.target)
+            if i > 0:
+                nodes.append(generator.iter)
+            nodes.extend(generator.ifs)
+        self._visit_scope('comprehension', nodes + elements)
+
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, [node.elt])
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visit_comprehension(node, [node.key, node.value])
+
+    def visit_NamedExpr(self, node):
+        scope = self.scope
+        while scope.kind == 'comprehension':
+            scope = scope.parent
+        scope.bound.add(node.target.id)
+        self.visit(node.value)
+        if node.target.id in self.top_level_modules:
+            self.names.append((node.target, scope))
+
+    def visit_Name(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self.scope.bound.add(node.id)
+        if node.id in self.top_level_modules:
+            self.names.append((node, self.scope))
+
+    def visit_Import(self, node):
+        matches = False
+        for alias in node.names:
+            if alias.asname:
+                self.scope.bound.add(alias.asname)
+            else:
+                dotted = [old for old in self.old_modules if '.' in old and self._matches_module(alias.name, old)]
+                if dotted:
+                    # the statement binds the top-level package, not the module
+                    raise ValueError(
+                        'cannot rename "{old}" in "import {module}" which binds "{name}", '
+                        'import it with "as" or "from" instead'.format(
+                            old=dotted[0], module=alias.name, name=alias.name.split('.')[0])
+                    )
+                name = alias.name.split('.')[0]
+                self.scope.bound.add(name)
+                if name in self.top_level_modules:
+                    self.scope.imported.add(name)
+            matches = matches or self._matches(alias.name)
+        if matches:
+            self.statements.append((node, self.scope))
+
+    def visit_ImportFrom(self, node):
+        self.scope.bound.update(alias.asname or alias.name for alias in node.names if alias.name != '*')
+        if not node.level and self._matches(node.module):
+            self.statements.append((node, self.scope))
+
+    def visit_Global(self, node):
+        self.scope.globals.update(node.names)
+        if self.top_level_modules.intersection(node.names):
+            self.statements.append((node, self.scope))
+
+    def visit_Nonlocal(self, node):
+        self.scope.nonlocals.update(node.names)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.scope.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchAs(self, node):
+        if node.name:
+            self.scope.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchStar(self, node):
+        if node.name:
+            self.scope.bound.add(node.name)
+
+    def visit_MatchMapping(self, node):
+        if node.rest:
+            self.scope.bound.add(node.rest)
+        self.generic_visit(node)
+
+
+def _line_starts(source):
+    starts = [0]
+    starts.extend(match.end() for match in re.finditer(r'\r\n|\r|\n', source))
+    return starts
+
+
+def _offset(source, line_starts, lineno, col_offset):
+    """Offset in source of an ast position whose column is in utf-8 bytes"""
+    start = line_starts[lineno - 1]
+    line = source[start:start + col_offset]
+    if not line.isascii():
+        line = line.encode('utf-8')[:col_offset].decode('utf-8', 'ignore')
+    return start + len(line)
+
+
+def _statement_tokens(source, line_starts, lineno, start):
+    """Tokens of the simple statement at offset `start` of line `lineno`
+
+    Node end positions only exist from python 3.8, the statement ends at
+    the first newline or semicolon instead. Token positions are relative
+    to `start`.
+    """
+    def lines():
+        for i in range(lineno - 1, len(line_starts)):
+            end = line_starts[i + 1] if i + 1 < len(line_starts) else len(source)
+            yield source[max(start, line_starts[i]):end]
+
+    tokens = []
+    for token in tokenize.generate_tokens(functools.partial(next, lines(), '')):
+        if token.type in (tokenize.NEWLINE, tokenize.ENDMARKER) or (token.type == tokenize.OP and token.string == ';'):
+            break
+        if token.type not in _IGNORED_TOKENS:
+            tokens.append(token)
+    return tokens
+
+
+def _dotted_name(tokens, i):
+    names = [tokens[i]]
+    while i + 2 < len(tokens) and tokens[i + 1].string == '.' and tokens[i + 2].type == tokenize.NAME:
+        names.append(tokens[i + 2])
+        i += 2
+    return names, i + 1
+
+
+def _import_module_names(node, tokens):
+    """Name tokens of the dotted module names of an import statement"""
+    if isinstance(node, ast.ImportFrom):
+        yield _dotted_name(tokens, 1)[0]
+        return
+    i = 1
+    while i < len(tokens):
+        names, i = _dotted_name(tokens, i)
+        yield names
+        while i < len(tokens) and tokens[i].string != ',':
+            i += 1
+        i += 1
+
+
+def rewrite_source(source, module_mapper):
+    """Rename modules in python source, returns the new source
+
+    Renames the modules in `import` and absolute `from ... import`
+    statements and the names bound by `import <module>` wherever they
+    are not shadowed. Raises SyntaxError when source does not parse and
+    ValueError for `import a.b` of a renamed dotted module `a.b`, the
+    statement binds `a` so its references cannot be renamed.
+    """
+    renames = dict(module_mapper)
+    # longest modules first so that `a.b` is renamed before `a`
+    old_modules = sorted(renames, key=lambda module: -module.count('.'))
+    visitor = _ImportVisitor(old_modules)
+    try:
+        tree = ast.parse(source)
+    except ValueError as e:
+        # null bytes in the source
+        raise SyntaxError(str(e))
+    visitor.visit(tree)
+    if not visitor.names and not visitor.statements:
+        return source
+
+    line_starts = _line_starts(source)
+    edits = []
+    for node, scope in visitor.names:
+        binding = scope.resolve(node.id)
+        if binding is not None and node.id in binding.imported:
+            start = _offset(source, line_starts, node.lineno, node.col_offset)
+            edits.append((start, start + len(node.id), renames[node.id]))
+
+    for node, scope in visitor.statements:
+        start = _offset(source, line_starts, node.lineno, node.col_offset)
+        tokens = _statement_tokens(source, line_starts, node.lineno, start)
+
+        def position(point, start=start, lineno=node.lineno):
+            row, col = point
+            return start + col if row == 1 else line_starts[lineno + row - 2] + col
+
+        if isinstance(node, ast.Global):
+            module = scope.module
+            for token in tokens[1:]:
+                if token.string in renames and token.string in module.imported:
+                    edits.append((position(token.start), position(token.end), renames[token.string]))
+            continue
+
+        for names in _import_module_names(node, tokens):
+            parts = [name.string for name in names]
+            for old_module in old_modules:
+                count = old_module.count('.') + 1
+                if parts[:count] == old_module.split('.'):
+                    edits.append((position(names[0].start), position(names[count - 1].end), renames[old_module]))
+                    break
+
+    for start, end, replacement in sorted(set(edits), reverse=True):
+        source = source[:start] + replacement + source[end:]
+    return source
+
+
+def rewrite_content(content, module_mapper):
+    """Rename modules in the content of a python file, None when it does not change
+
+    The file is decoded with its declared encoding and encoded with it
+    again. Files that do not parse do not change.
+    """
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(content).readline)
+    try:
+        source = content.decode(encoding)
+        new_source = rewrite_source(source, module_mapper)
+    except (SyntaxError, UnicodeDecodeError):
+        return None
+    if new_source == source:
+        return None
+    return new_source.encode(encoding)
+
+
+def rewrite_file(filename, module_mapper):
+    """Rename modules in a python file, returns whether it changed"""
+    with open(filename, 'rb') as f:
+        content = rewrite_content(f.read(), module_mapper)
+    if content is None:
+        return False
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return True
+
+
+def _rewrite_path(project_path, module_mapper, path):
+    with open(os.path.join(project_path, path), 'rb') as f:
+        content = f.read()
+    try:
+        return path, rewrite_content(content, module_mapper)
+    except ValueError as e:
+        raise ValueError('{path}: {e}'.format(path=path, e=e))
+
+
+def _ast_rewrites(project_path, module_mapper, paths, jobs):
+    """(path, new content or None) of each path, one file at a time"""
+    rewrite = functools.partial(_rewrite_path, project_path, module_mapper)
+    if jobs == 1 or len(paths) == 1:
+        for result in map(rewrite, paths):
+            yield result
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(rewrite, paths, chunksize=16):
+            yield result
+
+
+def _rope_rewrites(project_path, module_mapper, files, jobs, dry_run):
+    """(path, new content or None) of each file, rewritten in place unless `dry_run`
+
+    For a dry run rope works on a temporary copy of the files.
+    """
+    tempdir = tempfile.mkdtemp() if dry_run else None
+    try:
+        directory = project_path
+        if dry_run:
+            directory = os.path.join(tempdir, 'project')
+            for path, _ in files:
+                os.makedirs(os.path.dirname(os.path.join(directory, path)), exist_ok=True)
+                shutil.copy2(os.path.join(project_path, path), os.path.join(directory, path))
+
+        chunks = [files[i::jobs] for i in range(min(jobs, len(files)))]
+        if len(chunks) == 1:
+            changed = rename_files(directory, module_mapper, files)
+        else:
+            changed = set()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+                futures = [executor.submit(rename_files, directory, module_mapper, chunk) for chunk in chunks]
+                for future in futures:
+                    changed.update(future.result())
+
+        for path, _ in files:
+            if path in changed:
+                with open(os.path.join(directory, path), 'rb') as f:
+                    yield path, f.read()
+            else:
+                yield path, None
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+
+def rewrite_key(module_mapper, engine):
+    """Cache key of the renames of an engine"""
+    key = [REWRITE_VERSION, engine, sorted(list(mapping) for mapping in module_mapper)]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def rewrite_modules(project_path, module_mapper, jobs=None, engine='rope', cache=None, dry_run=False):
+    """Rename modules in all python files of the project with `engine`
+
+    Yields a RewriteResult for every file that changes. With a `cache`
+    the result of every file is stored by the digest of its content and
+    files whose size and mtime did not change since the last run are
+    not read at all. With `dry_run` no file is written.
+    """
+    if engine not in ENGINES:
+        raise ValueError('unknown import rewrite engine "{engine}"'.format(engine=engine))
+    module_mapper = [tuple(mapping) for mapping in module_mapper]
+    if not module_mapper:
+        return
+    jobs = jobs or os.cpu_count() or 1
+    key = rewrite_key(module_mapper, engine)
+    previous = cache.get_rewrite_state(key, project_path) if cache is not None else {}
+    state = {}  # files that need no rewrite
+
+    # modules are only referenced by files that import them
+    regex = re.compile(r'\b(?:import|from)\b(?:[^\n;#\\]|\\\r?\n)*?\b({modules})\b'.format(
+        modules='|'.join(re.escape(old_module) for old_module, _ in module_mapper)
+    ).encode())
+
+    def stat(path):
+        stat = os.stat(os.path.join(project_path, path))
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def prefilter(path):
+        current = stat(path)
+        if previous.get(path) == current:
+            return path, current, None, None
+        with open(os.path.join(project_path, path), 'rb') as f:
+            content = f.read()
+        modules = {match.decode() for match in regex.findall(content)}
+        return path, current, modules, hashlib.sha256(content).hexdigest() if modules else None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        candidates = list(executor.map(prefilter, find_python_files(project_path)))
+
+    def result(path, content):
+        filename = os.path.join(project_path, path)
+        with open(filename, 'rb') as f:
+            original = f.read()
+        if not dry_run and original != content:
+            with open(filename, 'wb') as f:
+                f.write(content)
+            state[path] = stat(path)
+        return RewriteResult(path, original, content)
+
+    pending = []
+    for path, current, modules, sha256 in candidates:
+        cached = cache.get_rewrite(key, sha256) if cache is not None and modules else None
+        if not modules or (cached is not None and not cached[0]):
+            state[path] = current
+        elif cached is not None:
+            yield result(path, cached[1])
+        else:
+            pending.append((path, modules, sha256))
+
+    if pending:
+        digests = {path: sha256 for path, _, sha256 in pending}
+        if engine == 'ast':
+            rewrites = _ast_rewrites(project_path, module_mapper, [path for path, _, _ in pending], jobs)
+        else:
+            # rope rewrites in place, keep the originals for the results
+            originals = {}
+            for path, _, _ in pending:
+                with open(os.path.join(project_path, path), 'rb') as f:
+                    originals[path] = f.read()
+            rewrites = _rope_rewrites(
+                project_path, module_mapper, [(path, modules) for path, modules, _ in pending], jobs, dry_run
+            )
+        for path, content in rewrites:
+            if cache is not None:
+                cache.put_rewrite(key, digests[path], content)
+            if content is None:
+                state[path] = stat(path)
+            elif engine == 'ast' or dry_run:
+                yield result(path, content)
+            else:
+                state[path] = stat(path)
+                yield RewriteResult(path, originals.pop(path), content)
+
+    if cache is not None:
+        cache.put_rewrite_state(key, project_path, state)
+
+
+def rename_modules(project_path, module_mapper, jobs=None, engine='rope', cache=None, dry_run=False):
+    """Rename modules in all python files of the project with `engine`
+
+    Returns the sorted paths of the changed files relative to the project.
+    """
+    return sorted(
+        result.path for result in rewrite_modules(project_path, module_mapper, jobs, engine, cache, dry_run)
+    )
+
 
-    for old_module, new_module in module_mapper:
-        rename_module(project, old_module, new_module)
+def print_diff(results):
+    for result in results:
+        sys.stdout.write(''.join(difflib.unified_diff(
+            result.original.decode('utf-8', 'replace').splitlines(True),
+            result.content.decode('utf-8', 'replace').splitlines(True),
+            'a/' + result.path,
+            'b/' + result.path,
+        )))
 
 
 def cli(args):
     parser = argparse.ArgumentParser()
     parser.add_argument('--path', help='path to refactor imports', required=True)
     parser.add_argument('--replace', help='module import to replace', nargs=2, action='append')
-    return parser.parse_args()
+    parser.add_argument('-j', '--jobs', type=int, help='number of worker processes (default number of cpus)')
+    parser.add_argument(
+        '--engine', choices=ENGINES, default='rope',
+        help='rope or the faster ast based rewriter for renaming top-level modules (default rope)'
+    )
+    parser.add_argument('--dry-run', action='store_true', help='Print the diff of the rewrites, do not write files')
+    parser.add_argument('--cache-dir', help='directory to cache rewrites in to speed up repeated runs (default no cache)')
+    parser.add_argument(
+        '--cache-max-size', type=int, default=DEFAULT_MAX_SIZE,
+        help='maximum size of the cache in bytes, least recently used entries are evicted'
+    )
+    return parser.parse_args(args)
 
 
 def main():
     args = cli(sys.argv[1:])
-    rename_modules(args.path, args.replace or [])
+    # nix builds run this without a writable home, so caching is opt-in
+    cache = Cache(args.cache_dir, args.cache_max_size) if args.cache_dir else None
+    if args.dry_run:
+        print_diff(rewrite_modules(args.path, args.replace or [], args.jobs, args.engine, cache, dry_run=True))
+    else:
+        rename_modules(args.path, args.replace or [], args.jobs, args.engine, cache)
 
 
 if __name__ == "__main__":
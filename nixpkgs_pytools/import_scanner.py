@@ -0,0 +1,304 @@
+"""Scan the imports of the python files of a package
+
+The imports of each file are cached by the sha256 of its content and
+files that are not cached are parsed in a pool of processes once
+there are enough of them to amortize starting the processes. Top
+level import names are mapped to distribution names with an index of
+the `top_level.txt` and RECORD files of the installed distributions.
+"""
+import ast
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:
+    try:
+        import importlib_metadata
+    except ImportError:
+        importlib_metadata = None
+
+from .cache import get_default_cache
+
+
+# increment when the result of `parse_imports` changes to invalidate the cache
+SCANNER_VERSION = 1
+
+# uncached files needed before parsing them in a process pool
+PARALLEL_THRESHOLD = 200
+CHUNK_SIZE = 32
+
+# directories never containing code of the package
+IGNORED_DIRECTORIES = {"__pycache__", ".git", ".hg", ".tox", ".eggs", "build", "dist"}
+
+# import names which differ from the name of the distribution providing them
+KNOWN_IMPORT_NAMES = {
+    "attr": "attrs",
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python",
+    "dateutil": "python-dateutil",
+    "dns": "dnspython",
+    "git": "GitPython",
+    "jwt": "PyJWT",
+    "magic": "python-magic",
+    "MySQLdb": "mysqlclient",
+    "OpenSSL": "pyOpenSSL",
+    "PIL": "Pillow",
+    "pkg_resources": "setuptools",
+    "serial": "pyserial",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "yaml": "PyYAML",
+    "zmq": "pyzmq",
+}
+
+# `from x import y` and `import x, y` statements at the start of a line
+_IMPORT_REGEX = re.compile(
+    br"^[ \t]*(?:from[ \t]+([A-Za-z_]\w*)[\w.]*[ \t]+import|import[ \t]+([\w.]+(?:[ \t]*,[ \t]*[\w.]+)*))",
+    re.MULTILINE,
+)
+
+_distribution_index = None
+_distribution_index_lock = threading.Lock()
+
+
+class ImportVisitor(ast.NodeVisitor):
+    """Collect absolute top level imports
+
+    Imports inside of `try: ... except ImportError:` and `if
+    TYPE_CHECKING:` blocks are optional.
+    """
+
+    def __init__(self):
+        self.imports = set()
+        self.optional_imports = set()
+        self._optional_depth = 0
+
+    def _add(self, name):
+        if self._optional_depth:
+            self.optional_imports.add(name)
+        else:
+            self.imports.add(name)
+
+    def visit_Import(self, node):
+        for name in node.names:
+            self._add(name.name.split(".")[0])
+
+    def visit_ImportFrom(self, node):
+        if node.level or node.module is None:  # relative import
+            return
+        self._add(node.module.split(".")[0])
+
+    def _visit_optional(self, nodes):
+        self._optional_depth += 1
+        for child in nodes:
+            self.visit(child)
+        self._optional_depth -= 1
+
+    def visit_Try(self, node):
+        if any(_catches_import_error(handler.type) for handler in node.handlers):
+            self._visit_optional(node.body)
+        else:
+            for child in node.body:
+                self.visit(child)
+        for child in node.handlers + node.orelse + node.finalbody:
+            self.visit(child)
+
+    visit_TryExcept = visit_Try  # python 2
+
+    def visit_If(self, node):
+        test = node.test
+        name = getattr(test, "id", None) or getattr(test, "attr", None)
+        if name == "TYPE_CHECKING":
+            self._visit_optional(node.body)
+            for child in node.orelse:
+                self.visit(child)
+        else:
+            self.generic_visit(node)
+
+
+def _catches_import_error(node):
+    if node is None:  # bare except
+        return True
+    if isinstance(node, ast.Tuple):
+        return any(_catches_import_error(element) for element in node.elts)
+    name = getattr(node, "id", None) or getattr(node, "attr", None)
+    return name in {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+
+def parse_imports(source):
+    # type: (bytes) -> Dict[str, List[str]]
+    """Top level names of the required and optional imports of python source
+
+    Files without the word import are not parsed and files which are
+    not valid python for this interpreter (e.g. python 2 only) fall
+    back to matching import statements with a regular expression.
+    """
+    if b"import" not in source:
+        return {"imports": [], "optional": []}
+
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        imports = set()
+        for from_name, import_names in _IMPORT_REGEX.findall(source):
+            if from_name:
+                imports.add(from_name.decode())
+            for name in import_names.split(b","):
+                if name.strip():
+                    imports.add(name.strip().split(b".")[0].decode())
+        return {"imports": sorted(imports), "optional": []}
+
+    visitor = ImportVisitor()
+    visitor.visit(tree)
+    return {
+        "imports": sorted(visitor.imports),
+        "optional": sorted(visitor.optional_imports - visitor.imports),
+    }
+
+
+def find_python_files(directory):
+    # type: (str) -> List[str]
+    """Python files in directory relative to directory (walked once)"""
+    filenames = []
+    for root, directories, files in os.walk(directory):
+        directories[:] = sorted(d for d in directories if d not in IGNORED_DIRECTORIES)
+        for filename in sorted(files):
+            if filename.endswith(".py"):
+                filenames.append(os.path.relpath(os.path.join(root, filename), directory))
+    return filenames
+
+
+def scan_imports(directory, workers=None, cache=None):
+    # type: (str, Optional[int], Optional[Cache]) -> Dict[str, Dict[str, List[str]]]
+    """Imports of every python file in directory keyed by relative filename
+
+    Uses the default cache if `cache` is not given. At most `workers`
+    processes parse the files (default number of cpus).
+    """
+    cache = cache or get_default_cache()
+
+    results = {}
+    uncached = []
+    for filename in find_python_files(directory):
+        with open(os.path.join(directory, filename), "rb") as f:
+            source = f.read()
+        sha256 = hashlib.sha256(source).hexdigest()
+        imports = cache.get_imports(sha256, SCANNER_VERSION) if cache else None
+        if imports is None:
+            uncached.append((filename, sha256, source))
+        else:
+            results[filename] = imports
+
+    sources = [source for _, _, source in uncached]
+    workers = workers or multiprocessing.cpu_count()
+    if len(uncached) >= PARALLEL_THRESHOLD and workers > 1:
+        parsed = _parse_imports_parallel(sources, workers)
+    else:
+        parsed = [parse_imports(source) for source in sources]
+
+    for (filename, sha256, _), imports in zip(uncached, parsed):
+        results[filename] = imports
+        if cache:
+            cache.put_imports(sha256, SCANNER_VERSION, imports)
+    if cache and uncached:
+        cache.evict()
+    return results
+
+
+def _parse_imports_parallel(sources, workers):
+    from concurrent.futures import ProcessPoolExecutor
+
+    methods = multiprocessing.get_all_start_methods()
+    # forking a process with running threads is unsafe
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(parse_imports, sources, chunksize=CHUNK_SIZE))
+
+
+def _top_level_names(distribution):
+    top_level = distribution.read_text("top_level.txt")
+    if top_level:
+        return {name.strip() for name in top_level.splitlines() if name.strip()}
+
+    names = set()
+    for path in distribution.files or []:
+        parts = path.parts
+        if len(parts) > 1 and not parts[0].endswith((".dist-info", ".egg-info", ".data")) and parts[0] not in {"..", "__pycache__"}:
+            names.add(parts[0])
+        elif len(parts) == 1 and parts[0].endswith(".py"):
+            names.add(parts[0][:-len(".py")])
+    return names
+
+
+def build_distribution_index():
+    # type: () -> Dict[str, str]
+    """Map of top level import names to distribution names
+
+    Built from the `top_level.txt` (setuptools) or RECORD of the
+    installed distributions with `KNOWN_IMPORT_NAMES` taking
+    precedence.
+    """
+    index = {}
+    if importlib_metadata is not None:
+        for distribution in importlib_metadata.distributions():
+            name = distribution.metadata["Name"]
+            if not name:
+                continue
+            try:
+                top_level_names = _top_level_names(distribution)
+            except (IOError, OSError, ValueError):
+                continue
+            for top_level_name in top_level_names:
+                index.setdefault(top_level_name, name)
+    index.update(KNOWN_IMPORT_NAMES)
+    return index
+
+
+def get_distribution_index():
+    # type: () -> Dict[str, str]
+    global _distribution_index
+    with _distribution_index_lock:
+        if _distribution_index is None:
+            _distribution_index = build_distribution_index()
+        return _distribution_index
+
+
+def distribution_name(import_name):
+    # type: (str) -> str
+    """Distribution providing a top level import name (defaults to the import name)"""
+    return get_distribution_index().get(import_name, import_name)
+
+
+def local_modules(directory, filenames):
+    # type: (str, List[str]) -> Set[str]
+    """Top level names importable from the package itself
+
+    These are the files and directories at the root and under `src/`
+    and the modules next to scripts and tests outside of packages. A
+    module inside a package, like `example/compat/yaml.py`, is only
+    importable as `example.compat.yaml`.
+    """
+    packages = {os.path.dirname(filename) for filename in filenames if os.path.basename(filename) == "__init__.py"}
+    modules = set()
+    for filename in filenames:
+        parts = filename.split(os.sep)
+        if parts[0] == "src" and len(parts) > 1:
+            parts = parts[1:]
+        modules.add(parts[0][:-len(".py")] if parts[0].endswith(".py") else parts[0])
+        # the directory of a script or test is on sys.path when it runs
+        if os.path.dirname(filename) not in packages:
+            modules.add(parts[-1][:-len(".py")])
+
+    for root in [directory, os.path.join(directory, "src")]:
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            top_level_filename = os.path.join(root, name, "top_level.txt")
+            if name.endswith(".egg-info") and os.path.isfile(top_level_filename):
+                with open(top_level_filename) as f:
+                    modules.update(line.strip() for line in f if line.strip())
+    return modules
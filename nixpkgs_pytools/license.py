@@ -0,0 +1,263 @@
+"""Map the license of a pypi package to nixpkgs licenses
+
+The license is determined from, in order, the PEP 639
+`license_expression`, the `License ::` trove classifiers and the free
+text `license` field. The free text is first looked up in the table of
+`format_license` and otherwise fuzzily matched against the names and
+identifiers of the SPDX licenses nixpkgs knows. All tables are built
+once when the module is imported.
+"""
+import collections
+import re
+
+from .format import LICENSE_NIX_MAP
+
+
+# SPDX identifier -> (SPDX name, nixpkgs license attribute)
+SPDX_LICENSES = {
+    "0BSD": ("BSD Zero Clause License", "bsd0"),
+    "AFL-2.1": ("Academic Free License v2.1", "afl21"),
+    "AFL-3.0": ("Academic Free License v3.0", "afl3"),
+    "AGPL-3.0-only": ("GNU Affero General Public License v3.0 only", "agpl3Only"),
+    "AGPL-3.0-or-later": ("GNU Affero General Public License v3.0 or later", "agpl3Plus"),
+    "Apache-2.0": ("Apache License 2.0", "asl20"),
+    "Artistic-2.0": ("Artistic License 2.0", "artistic2"),
+    "BSD-1-Clause": ("BSD 1-Clause License", "bsd1"),
+    "BSD-2-Clause": ("BSD 2-Clause Simplified License", "bsd2"),
+    "BSD-3-Clause": ("BSD 3-Clause New or Revised License", "bsd3"),
+    "BSD-4-Clause": ("BSD 4-Clause Original or Old License", "bsdOriginal"),
+    "BSL-1.0": ("Boost Software License 1.0", "boost"),
+    "CC0-1.0": ("Creative Commons Zero v1.0 Universal", "cc0"),
+    "CC-BY-4.0": ("Creative Commons Attribution 4.0 International", "cc-by-40"),
+    "CC-BY-SA-4.0": ("Creative Commons Attribution Share Alike 4.0 International", "cc-by-sa-40"),
+    "CDDL-1.0": ("Common Development and Distribution License 1.0", "cddl"),
+    "CECILL-2.1": ("CeCILL Free Software License Agreement v2.1", "cecill21"),
+    "EPL-1.0": ("Eclipse Public License 1.0", "epl10"),
+    "EPL-2.0": ("Eclipse Public License 2.0", "epl20"),
+    "EUPL-1.2": ("European Union Public License 1.2", "eupl12"),
+    "GPL-1.0-or-later": ("GNU General Public License v1.0 or later", "gpl1Plus"),
+    "GPL-2.0-only": ("GNU General Public License v2.0 only", "gpl2Only"),
+    "GPL-2.0-or-later": ("GNU General Public License v2.0 or later", "gpl2Plus"),
+    "GPL-3.0-only": ("GNU General Public License v3.0 only", "gpl3Only"),
+    "GPL-3.0-or-later": ("GNU General Public License v3.0 or later", "gpl3Plus"),
+    "HPND": ("Historical Permission Notice and Disclaimer", "hpnd"),
+    "ISC": ("ISC License", "isc"),
+    "LGPL-2.0-only": ("GNU Library General Public License v2 only", "lgpl2Only"),
+    "LGPL-2.0-or-later": ("GNU Library General Public License v2 or later", "lgpl2Plus"),
+    "LGPL-2.1-only": ("GNU Lesser General Public License v2.1 only", "lgpl21Only"),
+    "LGPL-2.1-or-later": ("GNU Lesser General Public License v2.1 or later", "lgpl21Plus"),
+    "LGPL-3.0-only": ("GNU Lesser General Public License v3.0 only", "lgpl3Only"),
+    "LGPL-3.0-or-later": ("GNU Lesser General Public License v3.0 or later", "lgpl3Plus"),
+    "MIT": ("MIT License", "mit"),
+    "MIT-0": ("MIT No Attribution", "mit0"),
+    "MPL-1.0": ("Mozilla Public License 1.0", "mpl10"),
+    "MPL-1.1": ("Mozilla Public License 1.1", "mpl11"),
+    "MPL-2.0": ("Mozilla Public License 2.0", "mpl20"),
+    "NCSA": ("University of Illinois NCSA Open Source License", "ncsa"),
+    "OFL-1.1": ("SIL Open Font License 1.1", "ofl"),
+    "OpenSSL": ("OpenSSL License", "openssl"),
+    "PostgreSQL": ("PostgreSQL License", "postgresql"),
+    "PSF-2.0": ("Python Software Foundation License 2.0", "psfl"),
+    "Python-2.0": ("Python License 2.0", "psfl"),
+    "Unlicense": ("The Unlicense", "unlicense"),
+    "UPL-1.0": ("Universal Permissive License v1.0", "upl"),
+    "W3C": ("W3C Software Notice and License", "w3c"),
+    "WTFPL": ("Do What The F*ck You Want To Public License", "wtfpl"),
+    "X11": ("X11 License", "x11"),
+    "Zlib": ("zlib License", "zlib"),
+    "ZPL-2.1": ("Zope Public License 2.1", "zpl21"),
+}
+
+# deprecated SPDX identifiers still common on pypi
+DEPRECATED_SPDX_IDENTIFIERS = {
+    "AGPL-3.0": "AGPL-3.0-only",
+    "GPL-2.0": "GPL-2.0-only",
+    "GPL-2.0+": "GPL-2.0-or-later",
+    "GPL-3.0": "GPL-3.0-only",
+    "GPL-3.0+": "GPL-3.0-or-later",
+    "LGPL-2.0": "LGPL-2.0-only",
+    "LGPL-2.0+": "LGPL-2.0-or-later",
+    "LGPL-2.1": "LGPL-2.1-only",
+    "LGPL-2.1+": "LGPL-2.1-or-later",
+    "LGPL-3.0": "LGPL-3.0-only",
+    "LGPL-3.0+": "LGPL-3.0-or-later",
+}
+
+# `License ::` trove classifier -> nixpkgs license attribute
+CLASSIFIER_LICENSES = {
+    "License :: CC0 1.0 Universal (CC0 1.0) Public Domain Dedication": "cc0",
+    "License :: OSI Approved :: Academic Free License (AFL)": "afl21",
+    "License :: OSI Approved :: Apache Software License": "asl20",
+    "License :: OSI Approved :: Artistic License": "artistic2",
+    "License :: OSI Approved :: Boost Software License 1.0 (BSL-1.0)": "boost",
+    "License :: OSI Approved :: BSD License": None,  # which BSD license is unknown
+    "License :: OSI Approved :: Common Development and Distribution License 1.0 (CDDL-1.0)": "cddl",
+    "License :: OSI Approved :: Eclipse Public License 1.0 (EPL-1.0)": "epl10",
+    "License :: OSI Approved :: Eclipse Public License 2.0 (EPL-2.0)": "epl20",
+    "License :: OSI Approved :: European Union Public Licence 1.2 (EUPL 1.2)": "eupl12",
+    "License :: OSI Approved :: GNU Affero General Public License v3": "agpl3Only",
+    "License :: OSI Approved :: GNU Affero General Public License v3 or later (AGPLv3+)": "agpl3Plus",
+    "License :: OSI Approved :: GNU General Public License (GPL)": "gpl1Plus",
+    "License :: OSI Approved :: GNU General Public License v2 (GPLv2)": "gpl2Only",
+    "License :: OSI Approved :: GNU General Public License v2 or later (GPLv2+)": "gpl2Plus",
+    "License :: OSI Approved :: GNU General Public License v3 (GPLv3)": "gpl3Only",
+    "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)": "gpl3Plus",
+    "License :: OSI Approved :: GNU Lesser General Public License v2 (LGPLv2)": "lgpl2Only",
+    "License :: OSI Approved :: GNU Lesser General Public License v2 or later (LGPLv2+)": "lgpl2Plus",
+    "License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)": "lgpl3Only",
+    "License :: OSI Approved :: GNU Lesser General Public License v3 or later (LGPLv3+)": "lgpl3Plus",
+    "License :: OSI Approved :: GNU Library or Lesser General Public License (LGPL)": "lgpl2Plus",
+    "License :: OSI Approved :: ISC License (ISCL)": "isc",
+    "License :: OSI Approved :: MIT License": "mit",
+    "License :: OSI Approved :: MIT No Attribution License (MIT-0)": "mit0",
+    "License :: OSI Approved :: Mozilla Public License 1.0 (MPL)": "mpl10",
+    "License :: OSI Approved :: Mozilla Public License 1.1 (MPL 1.1)": "mpl11",
+    "License :: OSI Approved :: Mozilla Public License 2.0 (MPL 2.0)": "mpl20",
+    "License :: OSI Approved :: PostgreSQL License": "postgresql",
+    "License :: OSI Approved :: Python Software Foundation License": "psfl",
+    "License :: OSI Approved :: The Unlicense (Unlicense)": "unlicense",
+    "License :: OSI Approved :: Universal Permissive License (UPL)": "upl",
+    "License :: OSI Approved :: University of Illinois/NCSA Open Source License": "ncsa",
+    "License :: OSI Approved :: zlib/libpng License": "zlib",
+    "License :: OSI Approved :: Zope Public License": "zpl21",
+    "License :: Public Domain": "publicDomain",
+}
+
+# fuzzy matches below this score are not used
+MIN_FUZZY_SCORE = 0.6
+
+# words that do not tell licenses apart
+STOP_WORDS = {"license", "licence", "the", "version", "v", "public", "software", "open", "source", "agreement"}
+
+LicenseMatch = collections.namedtuple("LicenseMatch", ["license", "confidence", "source"])
+
+
+def _tokens(text):
+    # type: (str) -> FrozenSet[str]
+    text = text.lower()
+    text = re.sub(r"v(?=\d)", " ", text)  # gplv2 -> gpl 2
+    text = re.sub(r"(\d)\.0\b", r"\1", text)  # 2.0 -> 2
+    text = text.replace("+", " or later ")
+    return frozenset(token for token in re.findall(r"[a-z]+|\d+(?:\.\d+)*", text) if token not in STOP_WORDS)
+
+
+_SPDX_IDENTIFIERS = {identifier.lower(): identifier for identifier in SPDX_LICENSES}
+_SPDX_IDENTIFIERS.update({identifier.lower(): canonical for identifier, canonical in DEPRECATED_SPDX_IDENTIFIERS.items()})
+
+# (tokens, nixpkgs license) of every known name of a license
+_FUZZY_TABLE = [
+    (_tokens(text), nix_license)
+    for identifier, (name, nix_license) in SPDX_LICENSES.items()
+    for text in (identifier, name)
+] + [
+    (_tokens(classifier.rsplit("::", 1)[-1]), nix_license)
+    for classifier, nix_license in CLASSIFIER_LICENSES.items()
+    if nix_license is not None
+] + [
+    (_tokens(text), nix_license)
+    for text, nix_license in LICENSE_NIX_MAP.items()
+    if re.match(r"^\w+$", nix_license)
+]
+
+# inverted index token -> entries of _FUZZY_TABLE containing it
+_FUZZY_INDEX = collections.defaultdict(list)
+for _entry in _FUZZY_TABLE:
+    for _token in _entry[0]:
+        _FUZZY_INDEX[_token].append(_entry)
+
+
+def classify_license(info):
+    # type: (Dict) -> Optional[LicenseMatch]
+    """Determine the nixpkgs license from the `info` of the pypi json api
+
+    `license` of the result is a nixpkgs license attribute or a list
+    of them when the package has multiple licenses. `confidence` is
+    between 0 and 1.
+    """
+    expression = info.get("license_expression")
+    if expression:
+        licenses = spdx_expression_licenses(expression)
+        if licenses:
+            return LicenseMatch(_single(licenses), 1.0, "license_expression")
+
+    classifier_licenses = []
+    for classifier in info.get("classifiers") or []:
+        nix_license = CLASSIFIER_LICENSES.get(classifier)
+        if nix_license and nix_license not in classifier_licenses:
+            classifier_licenses.append(nix_license)
+    if classifier_licenses:
+        return LicenseMatch(_single(classifier_licenses), 0.9, "classifiers")
+
+    text = (info.get("license") or "").strip()
+    if not text or text.upper() == "UNKNOWN":
+        return None
+    # some packages put the whole license text in the field
+    text = text.splitlines()[0].strip()
+
+    nix_license = LICENSE_NIX_MAP.get(text.lower())
+    if nix_license is not None:
+        return LicenseMatch(nix_license, 0.9, "license")
+
+    licenses = spdx_expression_licenses(text)
+    if licenses:
+        return LicenseMatch(_single(licenses), 0.9, "license")
+
+    nix_license, score = fuzzy_match(text)
+    if nix_license is not None:
+        return LicenseMatch(nix_license, round(0.8 * score, 2), "license")
+    return None
+
+
+def spdx_expression_licenses(expression):
+    # type: (str) -> Optional[List[str]]
+    """nixpkgs licenses of an SPDX expression or None if it is not one
+
+    `AND`, `OR` and `WITH` exceptions are flattened into a list since
+    nixpkgs lists all licenses of a package regardless.
+    """
+    licenses = []
+    for token in re.split(r"\s+|[()]", expression.strip()):
+        if not token or token.upper() in ("AND", "OR"):
+            continue
+        if token.upper() == "WITH":
+            licenses.append(None)  # the next token is an exception
+            continue
+        if licenses and licenses[-1] is None:
+            licenses.pop()
+            continue
+        identifier = _SPDX_IDENTIFIERS.get(token.lower())
+        if identifier is None and token.endswith("+"):
+            identifier = _SPDX_IDENTIFIERS.get(token[:-1].lower() + "-or-later")
+        if identifier is None:
+            return None
+        nix_license = SPDX_LICENSES[identifier][1]
+        if nix_license not in licenses:
+            licenses.append(nix_license)
+    return licenses or None
+
+
+def fuzzy_match(text):
+    # type: (str) -> Tuple[Optional[str], float]
+    """Most similar known license name by jaccard similarity of their words
+
+    Names with different version numbers never match.
+    """
+    tokens = _tokens(text)
+    numbers = {token for token in tokens if token[0].isdigit()}
+    best, best_score = None, 0.0
+    for entry_tokens, nix_license in {entry for token in tokens for entry in _FUZZY_INDEX[token]}:
+        entry_numbers = {token for token in entry_tokens if token[0].isdigit()}
+        if numbers != entry_numbers and (numbers and entry_numbers):
+            continue
+        score = len(tokens & entry_tokens) / float(len(tokens | entry_tokens))
+        if numbers != entry_numbers:
+            score *= 0.8
+        if score > best_score or (score == best_score and best is not None and nix_license < best):
+            best, best_score = nix_license, score
+    if best_score < MIN_FUZZY_SCORE:
+        return None, best_score
+    return best, best_score
+
+
+def _single(licenses):
+    return licenses[0] if len(licenses) == 1 else licenses
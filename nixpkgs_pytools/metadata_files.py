@@ -0,0 +1,314 @@
+"""Determine dependencies from declarative packaging metadata
+
+These files are read without executing any code from the package:
+
+ - pyproject.toml: PEP 621 `[project]`, PEP 518 `[build-system]`,
+   `[tool.poetry]` and `[tool.flit.metadata]`
+ - setup.cfg: `[options]` and `[options.extras_require]`
+ - PKG-INFO `Requires-Dist` and `*.egg-info/requires.txt`
+
+Each function returns None when the file does not exist or does not
+declare the package dependencies.
+"""
+import glob
+import logging
+import os
+import re
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser
+
+from email.parser import HeaderParser
+
+from .requirement import TEST_EXTRAS, InvalidRequirement, marker_extras, parse_requirement
+
+try:
+    import tomllib as toml
+except ImportError:
+    try:
+        import tomli as toml
+    except ImportError:
+        toml = None
+
+log = logging.getLogger("metadata")
+
+# provided by buildPythonPackage
+IMPLICIT_BUILD_REQUIREMENTS = {"setuptools", "wheel"}
+
+
+def _empty_dependencies():
+    return {
+        "extraInputs": [],
+        "buildInputs": [],
+        "checkInputs": [],
+        "propagatedBuildInputs": [],
+    }
+
+
+def _requirement_name(requirement):
+    return re.split(r"[\s<>=!~;\[(]", requirement.strip(), 1)[0].lower()
+
+
+def _build_requirements(requirements):
+    return [
+        requirement for requirement in requirements
+        if _requirement_name(requirement) not in IMPLICIT_BUILD_REQUIREMENTS
+    ]
+
+
+def read_pyproject(directory):
+    # type: (str) -> Optional[Dict]
+    filename = os.path.join(directory, "pyproject.toml")
+    if not os.path.isfile(filename):
+        return None
+    if toml is None:
+        log.warning("cannot parse {}: install tomli to read pyproject.toml".format(filename))
+        return None
+    with open(filename, "rb") as f:
+        try:
+            return toml.load(f)
+        except ValueError:
+            return None
+
+
+def determine_dependencies_from_pyproject(directory):
+    """Dependencies from the PEP 621 [project], poetry or flit tables of pyproject.toml"""
+    pyproject = read_pyproject(directory)
+    if pyproject is None:
+        return None
+
+    build_requires = pyproject.get("build-system", {}).get("requires", [])
+    tool = pyproject.get("tool", {})
+    project = pyproject.get("project", {})
+    if "dependencies" in project or (project and "dependencies" not in project.get("dynamic", [])):
+        dependencies = _dependencies_from_pep621(project)
+    elif "poetry" in tool:
+        dependencies = _dependencies_from_poetry(tool["poetry"])
+    elif "flit" in tool and "metadata" in tool["flit"]:
+        dependencies = _dependencies_from_flit(tool["flit"]["metadata"])
+    else:
+        return None
+
+    dependencies["buildInputs"] = _build_requirements(build_requires) + dependencies["buildInputs"]
+    return dependencies
+
+
+def _dependencies_from_pep621(project):
+    dependencies = _empty_dependencies()
+    dependencies["propagatedBuildInputs"] = list(project.get("dependencies", []))
+    for extra, requirements in project.get("optional-dependencies", {}).items():
+        for requirement in requirements:
+            if extra in TEST_EXTRAS:
+                dependencies["checkInputs"].append(requirement)
+            else:
+                dependencies["extraInputs"].append("{p} # {k}".format(p=requirement, k=extra))
+    return dependencies
+
+
+def _dependencies_from_poetry(poetry):
+    dependencies = _empty_dependencies()
+
+    optional = {}
+    for name, constraint in poetry.get("dependencies", {}).items():
+        if name.lower() == "python":
+            continue
+        requirement = poetry_requirement(name, constraint)
+        if isinstance(constraint, dict) and constraint.get("optional"):
+            optional[name.lower()] = requirement
+        else:
+            dependencies["propagatedBuildInputs"].append(requirement)
+
+    for extra, names in poetry.get("extras", {}).items():
+        for name in names:
+            requirement = optional.get(name.lower(), name)
+            dependencies["extraInputs"].append("{p} # {k}".format(p=requirement, k=extra))
+
+    check_tables = [poetry.get("dev-dependencies", {})]
+    for group_name, group in poetry.get("group", {}).items():
+        if group_name in {"dev", "test", "tests"}:
+            check_tables.append(group.get("dependencies", {}))
+    for table in check_tables:
+        for name, constraint in table.items():
+            dependencies["checkInputs"].append(poetry_requirement(name, constraint))
+    return dependencies
+
+
+def _bump_version(parts, index):
+    parts = parts[:index + 1]
+    parts[index] = str(int(parts[index]) + 1)
+    return ".".join(parts)
+
+
+def poetry_requirement(name, constraint):
+    # type: (str, Union[str, Dict, List]) -> str
+    """Convert a poetry dependency constraint to a PEP 508 requirement"""
+    if isinstance(constraint, list):
+        constraint = constraint[0] if constraint else "*"
+    if isinstance(constraint, dict):
+        constraint = constraint.get("version", "*")
+
+    constraint = constraint.strip()
+    if constraint in {"", "*"}:
+        return name
+
+    try:
+        if constraint.startswith("^"):
+            parts = constraint[1:].strip().split(".")
+            index = next((i for i, part in enumerate(parts) if part != "0"), len(parts) - 1)
+            return "{name}>={version},<{upper}".format(
+                name=name, version=".".join(parts), upper=_bump_version(parts, index)
+            )
+        if constraint.startswith("~") and not constraint.startswith("~="):
+            parts = constraint[1:].strip().split(".")
+            index = 0 if len(parts) == 1 else 1
+            return "{name}>={version},<{upper}".format(
+                name=name, version=".".join(parts), upper=_bump_version(parts, index)
+            )
+    except ValueError:
+        return name
+
+    if constraint[0].isdigit():
+        return "{name}=={version}".format(name=name, version=constraint)
+    return "{name}{constraint}".format(name=name, constraint=constraint.replace(" ", ""))
+
+
+def _dependencies_from_flit(metadata):
+    dependencies = _empty_dependencies()
+    dependencies["propagatedBuildInputs"] = list(metadata.get("requires", []))
+    dependencies["checkInputs"] = list(metadata.get("dev-requires", []))
+    for extra, requirements in metadata.get("requires-extra", {}).items():
+        for requirement in requirements:
+            if extra in TEST_EXTRAS:
+                dependencies["checkInputs"].append(requirement)
+            else:
+                dependencies["extraInputs"].append("{p} # {k}".format(p=requirement, k=extra))
+    return dependencies
+
+
+def _setup_cfg_list(directory, value):
+    value = value.strip()
+    if value.startswith("file:"):
+        requirements = []
+        for filename in value[len("file:"):].split(","):
+            filename = os.path.join(directory, filename.strip())
+            if os.path.isfile(filename):
+                with open(filename) as f:
+                    requirements.extend(_setup_cfg_list(directory, f.read()))
+        return requirements
+
+    return [
+        requirement.split(" #", 1)[0].strip()
+        for requirement in value.splitlines()
+        if requirement.strip() and not requirement.strip().startswith(("#", "-"))
+    ]
+
+
+def determine_dependencies_from_setup_cfg(directory):
+    """Dependencies from the [options] of a declarative setup.cfg"""
+    filename = os.path.join(directory, "setup.cfg")
+    if not os.path.isfile(filename):
+        return None
+
+    config = ConfigParser(interpolation=None)
+    try:
+        config.read(filename)
+    except Exception:
+        return None
+    if not config.has_option("options", "install_requires"):
+        return None
+
+    def option(name):
+        if not config.has_option("options", name):
+            return []
+        return _setup_cfg_list(directory, config.get("options", name))
+
+    dependencies = _empty_dependencies()
+    dependencies["propagatedBuildInputs"] = option("install_requires")
+    dependencies["buildInputs"] = option("setup_requires")
+    dependencies["checkInputs"] = option("tests_require")
+    if config.has_section("options.extras_require"):
+        for extra, value in config.items("options.extras_require"):
+            for requirement in _setup_cfg_list(directory, value):
+                if extra in TEST_EXTRAS:
+                    dependencies["checkInputs"].append(requirement)
+                else:
+                    dependencies["extraInputs"].append("{p} # {k}".format(p=requirement, k=extra))
+    return dependencies
+
+
+def determine_dependencies_from_pkg_info(directory):
+    """Dependencies from *.egg-info/requires.txt or PKG-INFO Requires-Dist
+
+    *.egg-info is written by setuptools and always authoritative, while
+    PKG-INFO is only authoritative when it lists Requires-Dist or is a
+    metadata version 2.2+ file that does not mark them as dynamic.
+    """
+    egg_info_directories = sorted(glob.glob(os.path.join(directory, "*.egg-info"))) + sorted(
+        glob.glob(os.path.join(directory, "src", "*.egg-info"))
+    )
+    if egg_info_directories:
+        # setuptools omits requires.txt for packages without dependencies
+        filename = os.path.join(egg_info_directories[0], "requires.txt")
+        if not os.path.isfile(filename):
+            return _empty_dependencies()
+        with open(filename) as f:
+            return _dependencies_from_requires_txt(f.read())
+
+    filename = os.path.join(directory, "PKG-INFO")
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, encoding="utf-8", errors="replace") as f:
+        pkg_info = HeaderParser().parse(f)
+
+    requires_dist = pkg_info.get_all("Requires-Dist") or []
+    metadata_version = tuple(int(part) for part in re.findall(r"\d+", pkg_info.get("Metadata-Version", "1.0"))[:2])
+    dynamic = {field.lower() for field in pkg_info.get_all("Dynamic") or []}
+    if not requires_dist and (metadata_version < (2, 2) or "requires-dist" in dynamic):
+        return None
+
+    return dependencies_from_requires_dist(requires_dist)
+
+
+def dependencies_from_requires_dist(requires_dist):
+    """Split Requires-Dist by their `extra == "..."` marker"""
+    dependencies = _empty_dependencies()
+    for requirement in requires_dist:
+        try:
+            extras = marker_extras(parse_requirement(requirement).marker)
+        except InvalidRequirement:
+            extras = []
+        if not extras:
+            dependencies["propagatedBuildInputs"].append(requirement)
+        elif TEST_EXTRAS.intersection(extras):
+            dependencies["checkInputs"].append(requirement)
+        else:
+            dependencies["extraInputs"].append(
+                "{p} # {k}".format(p=requirement.split(";", 1)[0].strip(), k=", ".join(extras))
+            )
+    return dependencies
+
+
+def _dependencies_from_requires_txt(content):
+    dependencies = _empty_dependencies()
+    extra, marker = None, None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            extra, _, marker = line[1:-1].partition(":")
+            extra, marker = extra or None, marker or None
+            continue
+
+        requirement = line
+        if marker:
+            requirement = "{requirement}; {marker}".format(requirement=requirement, marker=marker)
+        if extra in TEST_EXTRAS:
+            dependencies["checkInputs"].append(requirement)
+        elif extra:
+            dependencies["extraInputs"].append("{p} # {k}".format(p=requirement, k=extra))
+        else:
+            dependencies["propagatedBuildInputs"].append(requirement)
+    return dependencies
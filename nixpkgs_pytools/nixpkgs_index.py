@@ -0,0 +1,286 @@
+"""Index of the python packages of a nixpkgs checkout
+
+Maps normalized pypi names to nixpkgs python attributes and their
+current version. Names come from the attributes of
+`pkgs/top-level/python-packages.nix` (as listed by its
+`PythonPackagesIndex`), the `pname` of the derivations in
+`pkgs/development/python-modules` and `pkgs/top-level/python-aliases.nix`.
+
+The index is a sqlite database in the cache. Parsed derivations are
+kept together with the size and mtime of their `default.nix` so that
+refreshing the index after the checkout changed only parses the
+derivations that changed. Lookups are a single b-tree search.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+from .format import format_normalized_package_name
+from .python_packages import get_python_packages_index
+
+# increment when the schema or the parsing of files changes
+INDEX_VERSION = 1
+
+CALL_PACKAGE_REGEX = re.compile(
+    r"^  ([A-Za-z_][A-Za-z0-9_'-]*)\s*=\s*callPackage\s+\.\./development/python-modules/([A-Za-z0-9._+-]+)",
+    re.MULTILINE,
+)
+ALIAS_REGEX = re.compile(r"^  ([A-Za-z_][A-Za-z0-9_'-]*)\s*=\s*([A-Za-z_][A-Za-z0-9_'-]*)\s*;", re.MULTILINE)
+PNAME_REGEX = re.compile(r'\bpname\s*=\s*"([^"$]+)"\s*;')
+VERSION_REGEX = re.compile(r'\bversion\s*=\s*"([^"$]+)"\s*;')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS modules (
+    directory TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    pname TEXT,
+    version TEXT
+);
+CREATE TABLE IF NOT EXISTS names (
+    name TEXT PRIMARY KEY,
+    attribute TEXT NOT NULL,
+    version TEXT
+) WITHOUT ROWID;
+"""
+
+_default_index = None
+
+
+def get_default_nixpkgs_index():
+    # type: () -> Optional[NixpkgsIndex]
+    return _default_index
+
+
+def set_default_nixpkgs_index(index):
+    # type: (Optional[NixpkgsIndex]) -> None
+    global _default_index
+    _default_index = index
+
+
+def nixpkgs_index_from_arguments(args, cache):
+    # type: (argparse.Namespace, Optional[Cache]) -> Optional[NixpkgsIndex]
+    if args.nixpkgs_root is None:
+        return None
+    return NixpkgsIndex(args.nixpkgs_root, os.path.join(cache.directory, "nixpkgs") if cache else None)
+
+
+class NixpkgsIndex(object):
+    """Normalized pypi name -> (nixpkgs attribute, version)
+
+    The index is refreshed from the checkout on the first lookup and
+    on `refresh`, which `NixpkgsTransaction.commit` calls after writing
+    to the checkout. Without a `cache_directory` it is kept in memory.
+    """
+
+    def __init__(self, nixpkgs_root, cache_directory=None):
+        self.nixpkgs_root = os.path.abspath(nixpkgs_root)
+        self.cache_directory = cache_directory
+        self._lock = threading.Lock()
+        self._connection = None
+        self._refreshed = False
+        self._fingerprint = None
+
+    @property
+    def database_filename(self):
+        if self.cache_directory is None:
+            return ":memory:"
+        key = hashlib.sha256(self.nixpkgs_root.encode()).hexdigest()
+        return os.path.join(self.cache_directory, "{key}.sqlite".format(key=key))
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        if self.cache_directory is not None and not os.path.isdir(self.cache_directory):
+            os.makedirs(self.cache_directory, exist_ok=True)
+        connection = sqlite3.connect(self.database_filename, check_same_thread=False)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            connection.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS modules; DROP TABLE IF EXISTS names;")
+            connection.execute("PRAGMA user_version = {version}".format(version=INDEX_VERSION))
+        connection.executescript(SCHEMA)
+        self._connection = connection
+        return connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+                self._refreshed = False
+
+    def refresh(self):
+        """Update the index with the changes of the checkout
+
+        Only derivations whose `default.nix` changed size or mtime are
+        parsed again. The names are rebuilt whenever anything changed.
+        """
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        connection = self._connect()
+        with connection:
+            changed = self._refresh_modules(connection)
+            changed = self._refresh_file(connection, self.python_packages_filename) or changed
+            changed = self._refresh_file(connection, self.python_aliases_filename) or changed
+            if changed:
+                self._rebuild_names(connection)
+                self._fingerprint = None
+        self._refreshed = True
+
+    @property
+    def python_packages_filename(self):
+        return os.path.join(self.nixpkgs_root, "pkgs", "top-level", "python-packages.nix")
+
+    @property
+    def python_aliases_filename(self):
+        return os.path.join(self.nixpkgs_root, "pkgs", "top-level", "python-aliases.nix")
+
+    @property
+    def python_modules_directory(self):
+        return os.path.join(self.nixpkgs_root, "pkgs", "development", "python-modules")
+
+    def _refresh_file(self, connection, filename):
+        stat = _stat(filename)
+        row = connection.execute("SELECT size, mtime FROM files WHERE path = ?", (filename,)).fetchone()
+        if row == stat:
+            return False
+        if stat is None:
+            connection.execute("DELETE FROM files WHERE path = ?", (filename,))
+        else:
+            connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (filename,) + stat)
+        return True
+
+    def _refresh_modules(self, connection):
+        indexed = {
+            directory: (size, mtime)
+            for directory, size, mtime in connection.execute("SELECT directory, size, mtime FROM modules")
+        }
+        changed = False
+        try:
+            entries = list(os.scandir(self.python_modules_directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            stat = _stat(os.path.join(entry.path, "default.nix"))
+            if stat is None:
+                continue
+            if indexed.pop(entry.name, None) == stat:
+                continue
+            with open(os.path.join(entry.path, "default.nix")) as f:
+                pname, version = parse_derivation(f.read())
+            connection.execute(
+                "INSERT OR REPLACE INTO modules VALUES (?, ?, ?, ?, ?)", (entry.name,) + stat + (pname, version)
+            )
+            changed = True
+        # derivations that were removed
+        for directory in indexed:
+            connection.execute("DELETE FROM modules WHERE directory = ?", (directory,))
+            changed = True
+        return changed
+
+    def _rebuild_names(self, connection):
+        modules = {
+            directory: (pname, version)
+            for directory, pname, version in connection.execute("SELECT directory, pname, version FROM modules")
+        }
+        python_packages = _read(self.python_packages_filename)
+        python_aliases = _read(self.python_aliases_filename)
+
+        # attribute names take precedence over pnames over aliases
+        names = {}
+        versions = {}
+        call_packages = CALL_PACKAGE_REGEX.findall(python_packages)
+        for attribute, directory in call_packages:
+            versions[attribute] = modules.get(directory, (None, None))[1]
+        for attribute in self._python_packages_attributes():
+            names.setdefault(format_normalized_package_name(attribute), attribute)
+        for attribute, directory in call_packages:
+            pname = modules.get(directory, (None, None))[0]
+            if pname:
+                names.setdefault(format_normalized_package_name(pname), attribute)
+        for alias, attribute in ALIAS_REGEX.findall(python_aliases):
+            if attribute in versions or format_normalized_package_name(attribute) in names:
+                names.setdefault(format_normalized_package_name(alias), attribute)
+
+        connection.execute("DELETE FROM names")
+        connection.executemany(
+            "INSERT INTO names VALUES (?, ?, ?)",
+            ((name, attribute, versions.get(attribute)) for name, attribute in names.items()),
+        )
+
+    def _python_packages_attributes(self):
+        if not os.path.isfile(self.python_packages_filename):
+            return []
+        return get_python_packages_index(self.nixpkgs_root).attributes()
+
+    def lookup(self, package_name):
+        # type: (str) -> Optional[Tuple[str, Optional[str]]]
+        """(attribute, version) of a pypi package in nixpkgs or None"""
+        with self._lock:
+            if not self._refreshed:
+                self._refresh()
+            row = self._connection.execute(
+                "SELECT attribute, version FROM names WHERE name = ?",
+                (format_normalized_package_name(package_name),),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def attribute(self, package_name):
+        # type: (str) -> Optional[str]
+        row = self.lookup(package_name)
+        return row[0] if row else None
+
+    def __contains__(self, package_name):
+        return self.lookup(package_name) is not None
+
+    def fingerprint(self):
+        # type: () -> str
+        """Digest of the indexed names, changes whenever a lookup may change"""
+        with self._lock:
+            if not self._refreshed:
+                self._refresh()
+            if self._fingerprint is None:
+                digest = hashlib.sha256()
+                for row in self._connection.execute("SELECT name, attribute, version FROM names ORDER BY name"):
+                    digest.update("\0".join(value or "" for value in row).encode() + b"\n")
+                self._fingerprint = digest.hexdigest()
+            return self._fingerprint
+
+    def __len__(self):
+        with self._lock:
+            if not self._refreshed:
+                self._refresh()
+            return self._connection.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+
+
+def parse_derivation(content):
+    # type: (str) -> Tuple[Optional[str], Optional[str]]
+    """(pname, version) of a python-modules derivation, None when not literal"""
+    pname = PNAME_REGEX.search(content)
+    version = VERSION_REGEX.search(content)
+    return (pname.group(1) if pname else None, version.group(1) if version else None)
+
+
+def _stat(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def _read(filename):
+    try:
+        with open(filename) as f:
+            return f.read()
+    except (IOError, OSError):
+        return ""
@@ -1,10 +1,15 @@
+import collections
+import difflib
 import os
-import re
-import string
 
 from .format import format_normalized_package_name
+from .nixpkgs_index import get_default_nixpkgs_index
+from .python_packages import get_python_packages_index
+from .tracing import traced
+from .utils import atomic_write, temporary_file
 
 
+@traced("write", "filename")
 def write_nix_file(content, filename, force=False):
     directory = os.path.dirname(filename)
     if directory:
@@ -18,72 +23,160 @@ def write_nix_file(content, filename, force=False):
         f.write(content)
 
 
-def write_nixpkgs_package(content, package_name, nixpkgs_root, force=False):
-    # check if is nixpkgs directory
+def check_nixpkgs_root(nixpkgs_root):
     if not (
         {"default.nix", "doc", "lib", "maintainers", "README.md", "nixos", "pkgs"}
         <= set(os.listdir(nixpkgs_root))
     ):
         raise ValueError("directory {nixpkgs_root} is not a nixpkgs root directory".format(nixpkgs_root=nixpkgs_root))
 
+
+def nixpkgs_package_filename(package_name, nixpkgs_root):
     normalized_package_name = format_normalized_package_name(package_name)
-    python_modules_directory = os.path.join(
-        nixpkgs_root, "pkgs", "development", "python-modules"
-    )
-    package_directory = os.path.join(python_modules_directory, normalized_package_name)
-    python_packages_filename = os.path.join(
-        nixpkgs_root, "pkgs", "top-level", "python-packages.nix"
+    return os.path.join(
+        nixpkgs_root, "pkgs", "development", "python-modules", normalized_package_name, "default.nix"
     )
-    package_regex = "\n[ ]+([A-Za-z0-9\-_]+)\s+=\s+callPackage"
-    inserted_text = "\n  {normalized_package_name} = callPackage ../development/python-modules/{normalized_package_name} {{ }};\n".format(normalized_package_name=normalized_package_name)
 
-    # adhoc method of getting all python packages
-    normalized_package_names = {
-        format_normalized_package_name(_) for _ in os.listdir(python_modules_directory)
-    }
 
-    # check that package does not already exist
-    if normalized_package_name in normalized_package_names and not force:
-        raise ValueError(
-            'cannot overrite existing package derivation {package_directory} without force "-f" option'.format(package_directory=package_directory)
-        )
+class NixpkgsTransaction(object):
+    """Write several packages into a nixpkgs checkout all or nothing
 
-    # write file to pkgs/development/python-modules/<package_name>/default.nix
-    write_nix_file(content, os.path.join(package_directory, "default.nix"), force)
+    Derivations are only staged by `add`. `commit` writes all
+    derivations and the single merged edit of python-packages.nix to
+    temporary files next to their destinations, fsyncs them and then
+    renames them into place. When anything fails the files already
+    renamed are restored and new directories are removed.
+    """
 
-    # now insert package in `pkgs/top-level/python-packages.nix`
-    # this doesn't capture all package names but it doesn't need
-    # to in order to find a place to insert a package name
-    with open(python_packages_filename) as f:
-        python_packages_content = f.read()
+    def __init__(self, nixpkgs_root, force=False):
+        check_nixpkgs_root(nixpkgs_root)
+        self.nixpkgs_root = nixpkgs_root
+        self.force = force
+        self._derivations = collections.OrderedDict()
 
-    content_offset = python_packages_content.find("phonenumbers = callPackage")
+    def add(self, content, package_name):
+        # type: (str, str) -> str
+        """Stage pkgs/development/python-modules/<package_name>/default.nix"""
+        filename = nixpkgs_package_filename(package_name, self.nixpkgs_root)
+        package_directory = os.path.dirname(filename)
 
-    for i, match in enumerate(
-        re.finditer(package_regex, python_packages_content[content_offset:])
-    ):
-        python_packages_package_name = format_normalized_package_name(match.group(1))
-
-        # ensure that package is put in a reasonable place
-        # that first letter of package is at most one letter away
-        left_letter_index = string.ascii_lowercase.find(normalized_package_name[0])
-        right_letter_index = string.ascii_lowercase.find(
-            python_packages_package_name[0]
-        )
-        letter_distance = abs(left_letter_index - right_letter_index)
-
-        if (
-            normalized_package_name < python_packages_package_name
-            and letter_distance <= 1
+        if filename in self._derivations:
+            raise ValueError("package {package_name} was already added".format(package_name=package_name))
+
+        # check that package does not already exist
+        if not self.force and (
+            os.path.isdir(package_directory) or package_name in get_python_packages_index(self.nixpkgs_root)
         ):
-            print("inserting package before {package} in python-modules.nix".format(package=match.group(1)))
-            insertion_location = content_offset + match.start()
+            raise ValueError(
+                'cannot overrite existing package derivation {package_directory} without force "-f" option'.format(package_directory=package_directory)
+            )
+
+        self._derivations[filename] = (package_name, content.encode())
+        return filename
+
+    @traced("commit")
+    def commit(self):
+        # type: () -> str
+        """Write all staged packages, returns the unified diff of the changes"""
+        index = get_python_packages_index(self.nixpkgs_root)
+        pending = index.prepare_insert(package_name for package_name, _ in self._derivations.values())
+
+        changes = [(filename, content) for filename, (_, content) in self._derivations.items()]
+        if pending.names:
+            changes.append((index.filename, pending.content))
+        originals = {filename: _read_original(filename) for filename, _ in changes}
+        originals[index.filename] = pending.original
+
+        _commit_files(changes, originals)
+        if pending.names:
+            index.apply(pending)
+            for name in pending.names:
+                print("inserting package {package} in python-packages.nix".format(package=name))
+        self._derivations.clear()
+
+        # the written packages are now in nixpkgs
+        nixpkgs_index = get_default_nixpkgs_index()
+        if nixpkgs_index is not None and nixpkgs_index.nixpkgs_root == os.path.abspath(self.nixpkgs_root):
+            nixpkgs_index.refresh()
+        return "".join(_unified_diff(filename, originals[filename], content, self.nixpkgs_root) for filename, content in changes)
 
-            with open(python_packages_filename, "w") as f:
-                f.write(
-                    python_packages_content[:insertion_location]
-                    + inserted_text
-                    + python_packages_content[insertion_location:]
-                )
 
-            break
+def write_nixpkgs_package(content, package_name, nixpkgs_root, force=False):
+    transaction = NixpkgsTransaction(nixpkgs_root, force)
+    filename = transaction.add(content, package_name)
+    transaction.commit()
+    return filename
+
+
+def _read_original(filename):
+    try:
+        with open(filename, "rb") as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _commit_files(changes, originals):
+    created_directories = []
+    staged = []  # (temporary filename, filename)
+    committed = []
+    try:
+        for filename, content in changes:
+            directory = os.path.dirname(filename)
+            missing = []
+            while not os.path.isdir(directory):
+                missing.append(directory)
+                directory = os.path.dirname(directory)
+            for directory in reversed(missing):
+                os.mkdir(directory)
+                created_directories.append(directory)
+
+            fd, temporary_filename = temporary_file(filename)
+            staged.append((temporary_filename, filename))
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+
+        for temporary_filename, filename in staged:
+            os.replace(temporary_filename, filename)
+            committed.append(filename)
+    except Exception:
+        for temporary_filename, filename in staged:
+            if filename not in committed and os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+        for filename in committed:
+            if originals[filename] is None:
+                os.remove(filename)
+            else:
+                atomic_write(filename, originals[filename])
+        for directory in reversed(created_directories):
+            os.rmdir(directory)
+        raise
+
+    # one fsync per directory instead of one per file
+    for directory in sorted({os.path.dirname(filename) for filename in committed}):
+        _fsync_directory(directory)
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _unified_diff(filename, original, content, nixpkgs_root):
+    relative_filename = os.path.relpath(filename, nixpkgs_root)
+    return "".join(difflib.unified_diff(
+        (original or b"").decode().splitlines(True),
+        content.decode().splitlines(True),
+        "a/" + relative_filename if original is not None else "/dev/null",
+        "b/" + relative_filename,
+    ))
@@ -1,39 +1,77 @@
+import hashlib
 import json
 import argparse
-import subprocess
-import re
 import sys
-import os
-from distutils.dir_util import copy_tree
-import tempfile
-import textwrap
-from string import punctuation
 from getpass import getuser
 
-import jinja2
-
 from .format import (
     format_description,
-    format_homepage,
-    format_license,
+    format_homepage_async,
     format_normalized_package_name,
+    get_probe_homepages,
+    set_probe_homepages,
+)
+from .cache import (
+    add_cache_arguments,
+    cache_from_arguments,
+    get_default_cache,
+    set_default_cache,
+)
+from .dependency import (
+    add_dependency_arguments,
+    determine_package_dependencies,
+    get_python_version,
+    get_scan_imports,
+    set_python_version,
+    set_scan_imports,
 )
-from .dependency import determine_package_dependencies
 from .download import download_package_json
+from .http_client import add_http_arguments, client_from_arguments, set_default_client
+from .license import classify_license
+from .sandbox import add_sandbox_arguments, sandbox_from_arguments, set_default_sandbox
+from .template import (
+    DEFAULT_TEMPLATE,
+    add_template_arguments,
+    environment_arguments_from_arguments,
+    render_template,
+    set_default_environment_arguments,
+)
 from .utils import determine_filename_extension
+from .nixpkgs_index import get_default_nixpkgs_index, nixpkgs_index_from_arguments, set_default_nixpkgs_index
 from .output import write_nix_file, write_nixpkgs_package
+from .tracing import add_trace_arguments, profile, set_default_tracer, span, traced, tracer_from_arguments
+
+# increment when the metadata determined for a package changes
+METADATA_VERSION = 2
 
 
 def main():
     args = cli(sys.argv)
-    content = initialize_package(
-        args.package,
-        args.version,
-        args.filename,
-        args.force,
-        args.stdout,
-        args.nixpkgs_root,
-    )
+    set_default_cache(cache_from_arguments(args))
+    set_default_environment_arguments(*environment_arguments_from_arguments(args, get_default_cache()))
+    set_default_client(client_from_arguments(args))
+    set_scan_imports(args.scan_imports)
+    set_python_version(args.python_version)
+    set_probe_homepages(not args.no_homepage_probe)
+    set_default_nixpkgs_index(nixpkgs_index_from_arguments(args, get_default_cache()))
+    sandbox = sandbox_from_arguments(args, workers=1)
+    set_default_sandbox(sandbox)
+    tracer = tracer_from_arguments(args)
+    set_default_tracer(tracer)
+    try:
+        content = initialize_package(
+            args.package,
+            args.version,
+            args.filename,
+            args.force,
+            args.stdout,
+            args.nixpkgs_root,
+        )
+    finally:
+        if sandbox is not None:
+            sandbox.close()
+        if tracer is not None and tracer.filename:
+            tracer.write()
 
 
 def cli(arguments):
@@ -57,6 +95,12 @@ def cli(arguments):
         action="store_true",
         help="Force creation of file, overwriting when it already exists",
     )
+    add_cache_arguments(parser)
+    add_http_arguments(parser)
+    add_sandbox_arguments(parser)
+    add_dependency_arguments(parser)
+    add_template_arguments(parser)
+    add_trace_arguments(parser)
     args = parser.parse_args()
     print('Fetching package="{package}" version="{version}"'.format(package=args.package, version=args.version or "stable"))
     return args
@@ -65,16 +109,17 @@ def cli(arguments):
 def initialize_package(
     package_name, version, filename, force=False, to_stdout=False, nixpkgs_root=None
 ):
-    data = download_package_json(package_name)
-    metadata = package_json_to_metadata(data, package_name, version)
-    content = metadata_to_nix(metadata)
-    if to_stdout:
-        print(content)
-    elif nixpkgs_root is not None:
-        write_nixpkgs_package(content, package_name, nixpkgs_root, force)
-    else:
-        write_nix_file(content, filename, force)
-        print('Package "{package_name}" succesfully written to "{filename}"'.format(package_name=package_name, filename=filename))
+    with profile(package_name), span("package", package=package_name):
+        data = download_package_json(package_name, version=version)
+        metadata = package_json_to_metadata(data, package_name, version)
+        content = metadata_to_nix(metadata)
+        if to_stdout:
+            print(content)
+        elif nixpkgs_root is not None:
+            write_nixpkgs_package(content, package_name, nixpkgs_root, force)
+        else:
+            write_nix_file(content, filename, force)
+            print('Package "{package_name}" succesfully written to "{filename}"'.format(package_name=package_name, filename=filename))
 
 
 def determine_check_phase(metadata):
@@ -101,10 +146,24 @@ def package_json_to_metadata(package_json, package_name, package_version):
             "no source distribution (sdist) found for {package_name}:{package_version}".format(package_name=package_name, package_version=package_version)
         )
 
-    try:
-        lic = format_license(package_json["info"]["license"])
-    except:
-        lic = None
+    cache = get_default_cache()
+    offline = cache is not None and cache.offline
+
+    key = metadata_cache_key()
+    if cache is not None:
+        metadata = cache.get_metadata(
+            package_json["info"]["name"], package_version, package_release_json["digests"]["sha256"], key
+        )
+        if metadata is not None:
+            return metadata
+
+    # probe the homepage while the sdist is downloaded and analyzed
+    homepage = format_homepage_async(
+        package_json["info"]["home_page"], probe=get_probe_homepages() and not offline, cache=cache
+    )
+
+    with span("license"):
+        license_match = classify_license(package_json["info"])
     metadata = {
         "pname": format_normalized_package_name(package_json["info"]["name"]),
         "downloadname": package_json["info"]["name"],
@@ -118,93 +177,45 @@ def package_json_to_metadata(package_json, package_name, package_version):
             package_version,
         ),
         "description": format_description(package_json["info"]["summary"]),
-        "homepage": format_homepage(package_json["info"]["home_page"]),
+        "homepage": None,
         "maintainer": getuser(),
-        "resolved_license": lic,
+        "resolved_license": license_match.license if license_match else None,
+        "license_confidence": license_match.confidence if license_match else None,
         "license": package_json["info"]["license"],
     }
 
-    metadata.update(determine_package_dependencies(package_json, metadata["url"]))
+    with span("dependencies"):
+        metadata.update(
+            determine_package_dependencies(package_json, metadata["url"], metadata["sha256"])
+        )
     metadata["checkPhase"] = determine_check_phase(metadata)
+    with span("wait for homepage"):
+        metadata["homepage"] = homepage.result()
+
+    if cache is not None:
+        cache.put_metadata(package_json["info"]["name"], package_version, metadata["sha256"], key, metadata)
     return metadata
 
 
+def metadata_cache_key():
+    # type: () -> str
+    """Digest of the settings the metadata of a package depends on"""
+    nixpkgs_index = get_default_nixpkgs_index()
+    settings = [
+        METADATA_VERSION,
+        get_python_version(),
+        get_scan_imports(),
+        # cached metadata holds attributes looked up in the index
+        nixpkgs_index.fingerprint() if nixpkgs_index is not None else None,
+        getuser(),
+        get_probe_homepages(),
+    ]
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16]
+
+
+@traced("render")
 def metadata_to_nix(metadata):
-    template = jinja2.Template(
-        textwrap.dedent(
-            """\
-        { lib
-        , buildPythonPackage
-        , fetchPypi
-        {% for p in (metadata.buildInputs + metadata.checkInputs + metadata.propagatedBuildInputs) %}, {{ p }}
-        {% endfor %}}:
-
-        buildPythonPackage rec {
-          pname = "{{ metadata.pname }}";
-          version = "{{ metadata.version }}";
-        {% if metadata.python_version %}
-          disabled = ; # requires python version {{ metadata.python_version }}
-        {% endif %}
-          src = fetchPypi {
-        {%- if metadata.pname != metadata.downloadname %}
-            pname = "{{ metadata.downloadname }}";
-            inherit version;
-        {%- else %}
-            inherit pname version;
-        {%- endif %}
-        {%- if metadata.extension != "tar.gz" %}
-            extension = "{{ metadata.extension }}";
-        {%- endif %}
-            sha256 = "{{ metadata["sha256"] }}";
-          };
-        {% if metadata.packageConditions %}
-          # # Package conditions to handle
-          # # might have to sed setup.py and egg.info in patchPhase
-          # # sed -i "s/<package>.../<package>/"
-        {%- for condition in metadata.packageConditions %}
-          # {{ condition -}}
-        {% endfor %}{% endif %}{% if metadata.extraInputs %}
-          # # Extra packages (may not be necessary)
-        {%- for p in metadata.extraInputs %}
-          # {{ p -}}
-        {% endfor %}{% endif %}
-        {%- if metadata.buildInputs %}
-          buildInputs = [
-        {%- for p in metadata.buildInputs %}
-            {{ p -}}
-        {% endfor %}
-          ];
-        {% endif %}
-        {%- if metadata.checkInputs %}
-          checkInputs = [
-        {%- for p in metadata.checkInputs %}
-            {{ p -}}
-        {% endfor %}
-          ];
-        {% endif %}
-        {%- if metadata.propagatedBuildInputs %}
-          propagatedBuildInputs = [
-        {%- for p in metadata.propagatedBuildInputs %}
-            {{ p -}}
-        {% endfor %}
-          ];
-        {% endif %}
-        {%- if metadata.checkPhase %}
-          checkPhase = ''
-            {{metadata.checkPhase|indent(width=6)}}
-          '';
-        {% endif %}
-          meta = with lib; {
-            description = "{{ metadata.description }}";
-            homepage = "{{ metadata.homepage }}";
-{% if metadata.resolved_license %}            license = licenses.{{ metadata.resolved_license }};{% else %}            # license = licenses."{{ metadata.license }}"; # unable to map license to nix license format{% endif %}
-            # maintainers = [ maintainers.{{ metadata.maintainer }} ];
-          };
-        }
-    """
-        )
-    )
-    return template.render(metadata=metadata)
+    return render_template(DEFAULT_TEMPLATE, metadata=metadata)
 
 
 if __name__ == "__main__":
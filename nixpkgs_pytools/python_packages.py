@@ -0,0 +1,272 @@
+"""Index of the attributes of `pkgs/top-level/python-packages.nix`
+
+The file has tens of thousands of lines so instead of scanning it for
+every package a sorted table of its top level attribute names and the
+byte offsets of their lines is built once. The table is persisted in
+the cache and reused as long as the size and mtime (or sha256) of the
+file did not change.
+"""
+import bisect
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+
+from .cache import get_default_cache
+from .format import format_normalized_package_name
+from .utils import atomic_write
+
+
+# increment when the format of the persisted index changes
+INDEX_VERSION = 1
+
+# top level attributes of `self: super: with self; { ... }` are indented by two spaces
+ATTRIBUTE_REGEX = re.compile(br"^  ([A-Za-z_][A-Za-z0-9_'-]*)\s*=", re.MULTILINE)
+
+PYTHON_MODULE_ATTRIBUTE = "  {name} = callPackage ../development/python-modules/{name} {{ }};\n\n"
+
+PendingInsertion = collections.namedtuple(
+    "PendingInsertion", ["names", "original", "content", "entries"]
+)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def python_packages_filename(nixpkgs_root):
+    return os.path.join(nixpkgs_root, "pkgs", "top-level", "python-packages.nix")
+
+
+def get_python_packages_index(nixpkgs_root):
+    # type: (str) -> PythonPackagesIndex
+    """Index of python-packages.nix shared by all writers of a nixpkgs checkout"""
+    filename = os.path.abspath(python_packages_filename(nixpkgs_root))
+    with _indexes_lock:
+        if filename not in _indexes:
+            cache = get_default_cache()
+            cache_directory = os.path.join(cache.directory, "nixpkgs") if cache else None
+            _indexes[filename] = PythonPackagesIndex(filename, cache_directory)
+        return _indexes[filename]
+
+
+class PythonPackagesIndex(object):
+    """Sorted table of (normalized attribute name, byte offset, attribute name)
+
+    Offsets point to the start of the line defining the attribute.
+    `insert` adds any number of attributes in a single pass and a
+    single atomic write of the file, updating the table in place.
+    """
+
+    def __init__(self, filename, cache_directory=None):
+        self.filename = filename
+        self.cache_directory = cache_directory
+        self._entries = None
+        self._offsets = None
+        self._stat = None
+        self._lock = threading.Lock()
+
+    @property
+    def index_filename(self):
+        if self.cache_directory is None:
+            return None
+        key = hashlib.sha256(os.path.abspath(self.filename).encode()).hexdigest()
+        return os.path.join(self.cache_directory, key + ".json")
+
+    def _load(self):
+        stat = os.stat(self.filename)
+        if self._entries is not None and self._stat == (stat.st_size, stat.st_mtime):
+            return
+        self._offsets = None
+
+        persisted = self._read_persisted()
+        if persisted is not None and (persisted["size"], persisted["mtime"]) == (stat.st_size, stat.st_mtime):
+            self._entries = [tuple(entry) for entry in persisted["entries"]]
+            self._stat = (stat.st_size, stat.st_mtime)
+            return
+
+        with open(self.filename, "rb") as f:
+            content = f.read()
+        sha256 = hashlib.sha256(content).hexdigest()
+        if persisted is not None and persisted["sha256"] == sha256:
+            # touched but unchanged
+            self._entries = [tuple(entry) for entry in persisted["entries"]]
+        else:
+            self._entries = build_entries(content)
+        self._stat = (stat.st_size, stat.st_mtime)
+        self._persist(sha256)
+
+    def _read_persisted(self):
+        if self.index_filename is None:
+            return None
+        try:
+            with open(self.index_filename) as f:
+                persisted = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if persisted.get("version") != INDEX_VERSION or persisted.get("filename") != os.path.abspath(self.filename):
+            return None
+        return persisted
+
+    def _persist(self, sha256):
+        if self.index_filename is None:
+            return
+        persisted = {
+            "version": INDEX_VERSION,
+            "filename": os.path.abspath(self.filename),
+            "size": self._stat[0],
+            "mtime": self._stat[1],
+            "sha256": sha256,
+            "entries": self._entries,
+        }
+        atomic_write(self.index_filename, json.dumps(persisted).encode())
+
+    def __contains__(self, package_name):
+        with self._lock:
+            self._load()
+            normalized_package_name = format_normalized_package_name(package_name)
+            i = bisect.bisect_left(self._entries, (normalized_package_name,))
+            return i < len(self._entries) and self._entries[i][0] == normalized_package_name
+
+    def attributes(self):
+        # type: () -> List[str]
+        with self._lock:
+            self._load()
+            return [attribute for _, _, attribute in self._entries]
+
+    def insertion_offset(self, package_name):
+        # type: (str) -> int
+        """Offset to insert a new attribute at keeping the attributes sorted
+
+        The attribute goes before the next larger attribute. At the
+        start of python-packages.nix attributes are not sorted, so when
+        the next larger attribute comes before the next smaller one in
+        the file it goes after the next smaller one instead.
+        """
+        with self._lock:
+            self._load()
+            offset = self._insertion_offset(format_normalized_package_name(package_name))
+            if offset is None:
+                with open(self.filename, "rb") as f:
+                    offset = _end_offset(f.read(), self.filename)
+            return offset
+
+    def _insertion_offset(self, normalized_package_name):
+        if not self._entries:
+            raise ValueError("no attributes found in {filename}".format(filename=self.filename))
+
+        i = bisect.bisect_left(self._entries, (normalized_package_name,))
+        previous_entry = self._entries[i - 1] if i > 0 else None
+        next_entry = self._entries[i] if i < len(self._entries) else None
+        if next_entry is not None and (previous_entry is None or next_entry[1] > previous_entry[1]):
+            return next_entry[1]
+
+        # offset of the attribute following previous_entry in the file
+        if self._offsets is None:
+            self._offsets = sorted(offset for _, offset, _ in self._entries)
+        j = bisect.bisect_right(self._offsets, previous_entry[1])
+        if j < len(self._offsets):
+            return self._offsets[j]
+        # after the last attribute, resolved by `_end_offset`
+        return None
+
+    def prepare_insert(self, package_names):
+        # type: (Iterable[str]) -> PendingInsertion
+        """Content of the file with a callPackage attribute for each package not yet in it
+
+        Nothing is written. Once `content` has been written to the
+        file `apply` updates the table in place.
+        """
+        with self._lock:
+            self._load()
+            insertions = {}
+            for package_name in package_names:
+                name = format_normalized_package_name(package_name)
+                i = bisect.bisect_left(self._entries, (name,))
+                if (i < len(self._entries) and self._entries[i][0] == name) or name in insertions:
+                    continue
+                insertions[name] = self._insertion_offset(name)
+
+            with open(self.filename, "rb") as f:
+                original = f.read()
+            if not insertions:
+                return PendingInsertion([], original, original, self._entries)
+            for name, offset in insertions.items():
+                if offset is None:
+                    insertions[name] = _end_offset(original, self.filename)
+
+            # attributes inserted at the same offset are kept sorted
+            ordered = sorted((offset, name) for name, offset in insertions.items())
+            parts = []
+            inserted = []  # (original offset, length, new entry)
+            previous_offset = 0
+            shift = 0
+            for offset, name in ordered:
+                text = PYTHON_MODULE_ATTRIBUTE.format(name=name).encode()
+                parts.append(original[previous_offset:offset])
+                parts.append(text)
+                inserted.append((offset, len(text), (name, offset + shift, name)))
+                previous_offset = offset
+                shift += len(text)
+            parts.append(original[previous_offset:])
+            content = b"".join(parts)
+            return PendingInsertion(sorted(insertions), original, content, _shift_entries(self._entries, inserted))
+
+    def apply(self, pending):
+        # type: (PendingInsertion) -> None
+        """Update the table after `pending.content` was written to the file"""
+        with self._lock:
+            self._entries = pending.entries
+            self._offsets = None
+            stat = os.stat(self.filename)
+            self._stat = (stat.st_size, stat.st_mtime)
+            self._persist(hashlib.sha256(pending.content).hexdigest())
+
+    def insert(self, package_names):
+        # type: (Iterable[str]) -> List[str]
+        """Add a callPackage attribute for each package not yet in the file
+
+        Reads the file once and writes it once. Returns the normalized
+        names of the added attributes.
+        """
+        pending = self.prepare_insert(package_names)
+        if pending.names:
+            atomic_write(self.filename, pending.content)
+            self.apply(pending)
+        return pending.names
+
+
+def build_entries(content):
+    # type: (bytes) -> List[Tuple[str, int, str]]
+    entries = []
+    for match in ATTRIBUTE_REGEX.finditer(content):
+        attribute = match.group(1).decode()
+        entries.append((format_normalized_package_name(attribute), match.start(), attribute))
+    entries.sort()
+    return entries
+
+
+def _end_offset(content, filename):
+    """Offset of the line closing the attribute set of python-packages.nix"""
+    offset = content.rfind(b"\n}")
+    if offset == -1:
+        raise ValueError("unable to find the end of the attribute set in {filename}".format(filename=filename))
+    return offset + 1
+
+
+def _shift_entries(entries, inserted):
+    """Entries after inserting the (original offset, length, new entry) attributes"""
+    offsets = [offset for offset, _, _ in inserted]
+    shifts = [0]
+    for _, length, _ in inserted:
+        shifts.append(shifts[-1] + length)
+
+    shifted = [
+        # attributes are inserted before the existing attribute at the same offset
+        (name, offset + shifts[bisect.bisect_right(offsets, offset)], attribute)
+        for name, offset, attribute in entries
+    ]
+    shifted.extend(entry for _, _, entry in inserted)
+    shifted.sort()
+    return shifted
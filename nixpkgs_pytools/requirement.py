@@ -0,0 +1,293 @@
+"""PEP 508 dependency specifiers
+
+Requirements like ``requests[security] (>=2.0) ; python_version < "3"``
+are parsed into their name, extras, version specifier and environment
+marker. Markers are evaluated against the python the derivation is
+built for instead of the python running this tool. Parsing is memoized
+since the same requirements show up for many packages.
+"""
+import collections
+import functools
+import re
+import sys
+
+from .format import format_normalized_package_name
+
+
+# the python running this tool, for nix installs the python3 of nixpkgs
+DEFAULT_PYTHON_VERSION = "{0}.{1}.{2}".format(*sys.version_info)
+
+# extras whose requirements are used as checkInputs
+TEST_EXTRAS = {"test", "tests", "testing"}
+
+REQUIREMENT_REGEX = re.compile(
+    r"""^\s*
+    (?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*
+    (?:\[(?P<extras>[^\]]*)\])?\s*
+    (?:
+        @\s*(?P<url>[^\s;]+)\s*
+      | \(?(?P<specifier>(?:[<>=!~]=?|===)\s*[^;()]*?)\)?\s*
+    )?
+    (?:;\s*(?P<marker>.*?))?
+    \s*$""",
+    re.VERBOSE,
+)
+
+MARKER_TOKEN_REGEX = re.compile(
+    r"""\s*(?:
+        (?P<string>'[^']*'|"[^"]*")
+      | (?P<op>===|==|!=|<=|>=|~=|<|>|not\s+in\b|in\b)
+      | (?P<boolean>and\b|or\b)
+      | (?P<paren>[()])
+      | (?P<variable>[a-z_][a-z0-9_.]*)
+    )""",
+    re.VERBOSE,
+)
+
+# https://peps.python.org/pep-0440/#appendix-b-parsing-version-strings-with-regular-expressions
+VERSION_REGEX = re.compile(
+    r"""^\s*v?
+    (?:(?P<epoch>\d+)!)?
+    (?P<release>\d+(?:\.\d+)*)
+    (?:[-_.]?(?P<pre_label>alpha|a|beta|b|preview|pre|rc|c)[-_.]?(?P<pre>\d+)?)?
+    (?:-(?P<post_implicit>\d+)|[-_.]?(?P<post_label>post|rev|r)[-_.]?(?P<post>\d+)?)?
+    (?:[-_.]?(?P<dev_label>dev)[-_.]?(?P<dev>\d+)?)?
+    (?:\+[a-z0-9]+(?:[-_.][a-z0-9]+)*)?
+    \s*$""",
+    re.VERBOSE | re.IGNORECASE,
+)
+
+PRE_RELEASE_LABELS = {"alpha": 0, "a": 0, "beta": 1, "b": 1, "preview": 2, "pre": 2, "rc": 2, "c": 2}
+
+# variables compared as versions instead of strings
+VERSION_VARIABLES = {"python_version", "python_full_version", "implementation_version"}
+
+
+class InvalidRequirement(ValueError):
+    pass
+
+
+Requirement = collections.namedtuple(
+    "Requirement", ["name", "extras", "specifier", "url", "marker", "text"]
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_requirement(text):
+    # type: (str) -> Requirement
+    match = REQUIREMENT_REGEX.match(text)
+    if match is None:
+        raise InvalidRequirement('unable to parse requirement "{text}"'.format(text=text))
+    extras = tuple(
+        sorted(format_normalized_package_name(extra.strip()) for extra in (match.group("extras") or "").split(",") if extra.strip())
+    )
+    specifier = re.sub(r"\s+", "", match.group("specifier") or "") or None
+    marker = match.group("marker")
+    return Requirement(
+        name=format_normalized_package_name(match.group("name")),
+        extras=extras,
+        specifier=specifier,
+        url=match.group("url"),
+        marker=parse_marker(marker) if marker else None,
+        text=text.strip(),
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_marker(text):
+    # type: (str) -> tuple
+    """Parse a marker into a tree of ("and"|"or", left, right) and (op, left, right)
+
+    Leaves are ("variable", name) or ("string", value).
+    """
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = MARKER_TOKEN_REGEX.match(text, position)
+        if match is None or match.end() == position:
+            raise InvalidRequirement('unable to parse marker "{text}"'.format(text=text))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1]
+        elif kind == "op":
+            value = re.sub(r"\s+", " ", value)
+        tokens.append((kind, value))
+        position = match.end()
+        while position < len(text) and text[position].isspace():
+            position += 1
+
+    tree, position = _parse_or(tokens, 0, text)
+    if position != len(tokens):
+        raise InvalidRequirement('unable to parse marker "{text}"'.format(text=text))
+    return tree
+
+
+def _parse_or(tokens, position, text):
+    left, position = _parse_and(tokens, position, text)
+    while position < len(tokens) and tokens[position] == ("boolean", "or"):
+        right, position = _parse_and(tokens, position + 1, text)
+        left = ("or", left, right)
+    return left, position
+
+
+def _parse_and(tokens, position, text):
+    left, position = _parse_expression(tokens, position, text)
+    while position < len(tokens) and tokens[position] == ("boolean", "and"):
+        right, position = _parse_expression(tokens, position + 1, text)
+        left = ("and", left, right)
+    return left, position
+
+
+def _parse_expression(tokens, position, text):
+    if position < len(tokens) and tokens[position] == ("paren", "("):
+        tree, position = _parse_or(tokens, position + 1, text)
+        if position >= len(tokens) or tokens[position] != ("paren", ")"):
+            raise InvalidRequirement('unbalanced parentheses in marker "{text}"'.format(text=text))
+        return tree, position + 1
+
+    if position + 3 > len(tokens):
+        raise InvalidRequirement('unable to parse marker "{text}"'.format(text=text))
+    left, op, right = tokens[position:position + 3]
+    if left[0] not in ("variable", "string") or op[0] != "op" or right[0] not in ("variable", "string"):
+        raise InvalidRequirement('unable to parse marker "{text}"'.format(text=text))
+    return (op[1], left, right), position + 3
+
+
+def marker_environment(python_version=DEFAULT_PYTHON_VERSION, extra=""):
+    # type: (str, str) -> Dict[str, str]
+    """Environment of the python nixpkgs builds the derivation for"""
+    return {
+        "python_version": ".".join(python_version.split(".")[:2]),
+        "python_full_version": python_version,
+        "implementation_version": python_version,
+        "os_name": "posix",
+        "sys_platform": "linux",
+        "platform_system": "Linux",
+        "platform_machine": "x86_64",
+        "platform_release": "",
+        "platform_version": "",
+        "platform_python_implementation": "CPython",
+        "implementation_name": "cpython",
+        "extra": extra,
+    }
+
+
+def evaluate_marker(marker, environment):
+    # type: (tuple, Dict[str, str]) -> bool
+    op, left, right = marker
+    if op == "and":
+        return evaluate_marker(left, environment) and evaluate_marker(right, environment)
+    if op == "or":
+        return evaluate_marker(left, environment) or evaluate_marker(right, environment)
+
+    left_value = _marker_value(left, environment)
+    right_value = _marker_value(right, environment)
+    if "extra" in (left[1], right[1]) and "variable" in (left[0], right[0]):
+        left_value = format_normalized_package_name(left_value)
+        right_value = format_normalized_package_name(right_value)
+    if op == "in":
+        return left_value in right_value
+    if op == "not in":
+        return left_value not in right_value
+    if left[1] in VERSION_VARIABLES or right[1] in VERSION_VARIABLES:
+        return compare_versions(left_value, op, right_value)
+    return _compare(left_value, op, right_value)
+
+
+def marker_extras(marker):
+    # type: (tuple) -> List[str]
+    """Extras a marker refers to via `extra == "..."`"""
+    if marker is None:
+        return []
+    op, left, right = marker
+    if op in ("and", "or"):
+        return marker_extras(left) + marker_extras(right)
+    if op == "==" and left == ("variable", "extra") and right[0] == "string":
+        return [format_normalized_package_name(right[1])]
+    if op == "==" and right == ("variable", "extra") and left[0] == "string":
+        return [format_normalized_package_name(left[1])]
+    return []
+
+
+def compare_versions(left, op, right):
+    # type: (str, str, str) -> bool
+    """Compare versions in PEP 440 order, `~=` and `==` support trailing `.*`"""
+    if op == "===":
+        return left == right
+    if right.endswith(".*") and op in ("==", "!="):
+        prefix = _version_tuple(right[:-2])
+        matches = _padded(_version_tuple(left), prefix)[:len(prefix)] == prefix
+        return matches if op == "==" else not matches
+    if op == "~=":
+        release = _version_tuple(right)
+        prefix = release[:max(len(release) - 1, 1)]
+        return version_key(left) >= version_key(right) and _padded(_version_tuple(left), prefix)[:len(prefix)] == prefix
+    return _compare(version_key(left), op, version_key(right))
+
+
+@functools.lru_cache(maxsize=4096)
+def version_key(version):
+    # type: (str) -> tuple
+    """Sort key of a version in PEP 440 order
+
+    Orders by epoch, release, pre-release, post-release and development
+    release, e.g. 1.0.dev1 < 1.0a1 < 1.0rc2 < 1.0 == 1.0.0 < 1.0.post1.
+    Versions that are not PEP 440 sort before all others by the numbers
+    they contain.
+    """
+    match = VERSION_REGEX.match(version)
+    if match is None:
+        return (-1, _version_tuple(version), (2,), (0,), (1,))
+
+    release = tuple(int(part) for part in match.group("release").split("."))
+    while len(release) > 1 and release[-1] == 0:
+        release = release[:-1]
+    post_number = match.group("post_implicit") or match.group("post")
+    has_post = match.group("post_implicit") is not None or match.group("post_label") is not None
+    if match.group("pre_label"):
+        pre = (1, PRE_RELEASE_LABELS[match.group("pre_label").lower()], int(match.group("pre") or 0))
+    elif match.group("dev_label") and not has_post:
+        # 1.0.dev1 is before 1.0a1
+        pre = (0,)
+    else:
+        pre = (2,)
+    post = (1, int(post_number or 0)) if has_post else (0,)
+    dev = (0, int(match.group("dev") or 0)) if match.group("dev_label") else (1,)
+    return (int(match.group("epoch") or 0), release, pre, post, dev)
+
+
+def _version_tuple(version):
+    return tuple(int(part) for part in re.findall(r"\d+", version.split("+")[0])[:4])
+
+
+def _padded(version, other):
+    return version + (0,) * (len(other) - len(version))
+
+
+def _compare(left, op, right):
+    if op == "==":
+        return left == right
+    if op == "!=":
+        return left != right
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    if op == ">=":
+        return left >= right
+    if op == "===":
+        return left == right
+    raise InvalidRequirement("unsupported marker operator {op}".format(op=op))
+
+
+def _marker_value(token, environment):
+    kind, value = token
+    if kind == "variable":
+        if value not in environment:
+            raise InvalidRequirement("unknown marker variable {value}".format(value=value))
+        return environment[value]
+    return value
@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_MEMORY_LIMIT = 1024 ** 3  # 1 GiB
+DEFAULT_MAX_JOBS_PER_WORKER = 50
+
+_default_sandbox = None
+
+
+def get_default_sandbox():
+    # type: () -> Optional[SetupSandbox]
+    return _default_sandbox
+
+
+def set_default_sandbox(sandbox):
+    # type: (Optional[SetupSandbox]) -> None
+    global _default_sandbox
+    _default_sandbox = sandbox
+
+
+def add_sandbox_arguments(parser):
+    parser.add_argument(
+        "--setup-timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="seconds mocking a setup.py may take before it is killed",
+    )
+    parser.add_argument(
+        "--setup-memory-limit",
+        type=int,
+        default=DEFAULT_MEMORY_LIMIT,
+        help="bytes of memory a process mocking setup.py may use",
+    )
+    parser.add_argument(
+        "--no-sandbox",
+        action="store_true",
+        help="Mock setup.py in this process instead of separate worker processes",
+    )
+
+
+def sandbox_from_arguments(args, workers=1):
+    # type: (argparse.Namespace, int) -> Optional[SetupSandbox]
+    if args.no_sandbox:
+        return None
+    return SetupSandbox(workers, args.setup_timeout, args.setup_memory_limit)
+
+
+def _worker(connection, memory_limit):
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    # setup.py output would interleave with the output of the generator
+    devnull = open(os.devnull, "w")
+    sys.stdout = sys.stderr = devnull
+
+    from .dependency import _determine_dependencies_from_mock_setup
+
+    while True:
+        try:
+            directory = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if directory is None:
+            break
+
+        modules = set(sys.modules)
+        try:
+            dependencies = _determine_dependencies_from_mock_setup(directory)
+            result = ("ok", {
+                key: [str(value) for value in values]
+                for key, values in dependencies.items()
+            })
+        except BaseException as e:
+            result = ("error", "{name}: {e}".format(name=type(e).__name__, e=e))
+        finally:
+            # forget modules imported by setup.py (e.g. the package itself)
+            for name in set(sys.modules) - modules:
+                del sys.modules[name]
+
+        connection.send(result)
+
+
+class _Worker(object):
+    def __init__(self, context, memory_limit):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child_connection, memory_limit))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        self.jobs = 0
+
+    def run(self, directory, timeout):
+        self.jobs += 1
+        try:
+            # the worker may have died while idle
+            self.connection.send(directory)
+        except OSError:
+            raise self._crashed()
+        if not self.connection.poll(timeout):
+            raise ValueError("mocking setup.py timed out after {timeout} seconds".format(timeout=timeout))
+        try:
+            return self.connection.recv()
+        except (EOFError, OSError):
+            raise self._crashed()
+
+    def _crashed(self):
+        self.process.join(1)
+        return ValueError(
+            "process mocking setup.py crashed with exit code {exitcode}".format(exitcode=self.process.exitcode)
+        )
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class SetupSandbox(object):
+    """Pool of worker processes that mock setup.py
+
+    Mocking setup.py executes arbitrary code that changes the working
+    directory and sys.path, may hang, leak memory or crash the
+    interpreter. Each job runs in one of at most `workers` processes
+    with a `memory_limit` (bytes of address space). Jobs taking longer
+    than `timeout` seconds have their worker killed. Workers are reused
+    for up to `max_jobs_per_worker` jobs to amortize interpreter
+    startup.
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        timeout=DEFAULT_TIMEOUT,
+        memory_limit=DEFAULT_MEMORY_LIMIT,
+        max_jobs_per_worker=DEFAULT_MAX_JOBS_PER_WORKER,
+    ):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_jobs_per_worker = max_jobs_per_worker
+        methods = multiprocessing.get_all_start_methods()
+        # forking a process with running threads is unsafe
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def determine_dependencies(self, directory):
+        # type: (str) -> Dict[str, List[str]]
+        """Mock directory/setup.py in a worker, see `determine_dependencies_from_mock_setup`
+
+        Raises ValueError when mocking fails, times out or the worker
+        crashes.
+        """
+        with self._slots:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if worker is not None and not worker.process.is_alive():
+                worker.kill()
+                worker = None
+            if worker is None:
+                worker = _Worker(self._context, self.memory_limit)
+
+            try:
+                status, result = worker.run(os.path.abspath(directory), self.timeout)
+            except ValueError:
+                worker.kill()
+                raise
+
+            if worker.jobs >= self.max_jobs_per_worker:
+                worker.stop()
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+
+        if status == "error":
+            raise ValueError(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
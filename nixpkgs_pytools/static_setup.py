@@ -0,0 +1,578 @@
+"""Determine setup.py dependencies without executing setup.py
+
+setup.py is parsed with `ast` and its top-level statements are
+interpreted by a small evaluator that only understands side effect free
+operations: literals, names, list/str concatenation, comprehensions,
+`os.path` functions, `sys.version_info` checks (for the python version
+the derivation is built for) and reading files within
+the package directory (e.g. ``open("requirements.txt").read()``). Calls
+to any other function whose argument names a requirements*.txt file are
+assumed to parse that requirements file.
+
+Anything else makes the names it touches unknown, including lists and
+dicts passed to functions that are not evaluated, and if the arguments
+of `setup(...)` that are needed depend on unknown names a
+`StaticEvaluationError` is raised so that the caller can fall back to
+mocking setup.py.
+"""
+import ast
+import collections
+import operator
+import os
+import re
+import sys
+
+from .requirement import DEFAULT_PYTHON_VERSION
+
+
+SETUP_KEYWORDS = ("install_requires", "setup_requires", "tests_require", "extras_require")
+
+REQUIREMENTS_FILE_REGEX = re.compile(r"requirements[^/\\]*\.txt$")
+
+
+VersionInfo = collections.namedtuple("VersionInfo", ["major", "minor", "micro", "releaselevel", "serial"])
+
+
+class StaticEvaluationError(ValueError):
+    pass
+
+
+class _Unknown(object):
+    """Value of a name that could not be statically determined"""
+
+    def __repr__(self):
+        return "<unknown>"
+
+
+UNKNOWN = _Unknown()
+
+
+class _Module(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class _File(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read(self):
+        with open(self.filename) as f:
+            return f.read()
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+    def __iter__(self):
+        return iter(self.readlines())
+
+
+class _Path(object):
+    def __init__(self, evaluator, *parts):
+        self._evaluator = evaluator
+        self.path = evaluator.path(os.path.join(*[str(part) for part in parts]))
+
+    @property
+    def parent(self):
+        return _Path(self._evaluator, os.path.dirname(self.path))
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def __truediv__(self, other):
+        return _Path(self._evaluator, self.path, str(other))
+
+    def __str__(self):
+        return self.path
+
+    def joinpath(self, *parts):
+        return _Path(self._evaluator, self.path, *parts)
+
+    def resolve(self):
+        return self
+
+    absolute = resolve
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self, *args, **kwargs):
+        return self._evaluator.open(self.path)
+
+    def read_text(self, *args, **kwargs):
+        return self.open().read()
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mod: operator.mod,
+    ast.BitOr: operator.or_,
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+}
+
+SAFE_METHODS = {
+    str: {
+        "strip", "lstrip", "rstrip", "split", "splitlines", "startswith", "endswith",
+        "lower", "upper", "replace", "join", "format", "partition",
+    },
+    list: {"append", "extend", "insert", "remove", "copy", "index", "count"},
+    tuple: {"index", "count"},
+    dict: {"get", "items", "keys", "values", "copy", "update", "setdefault", "pop"},
+    set: {"add", "update", "union", "intersection", "difference", "issubset", "copy"},
+    _File: {"read", "readlines"},
+    _Path: {"joinpath", "resolve", "absolute", "exists", "open", "read_text"},
+}
+
+SAFE_ATTRIBUTES = {
+    _Path: {"parent", "name"},
+}
+
+# literal nodes of python < 3.8 and the field holding their value
+LEGACY_LITERALS = {"Str": "s", "Bytes": "s", "Num": "n", "NameConstant": "value"}
+
+MUTATING_METHODS = {"append", "extend", "insert", "remove", "update", "setdefault", "pop", "add"}
+
+
+class SetupEvaluator(object):
+    def __init__(self, directory, python_version=DEFAULT_PYTHON_VERSION):
+        self.directory = os.path.realpath(directory)
+        self.setup_filename = os.path.join(self.directory, "setup.py")
+        self.namespace = {
+            "__file__": self.setup_filename,
+            "__name__": "__main__",
+            "True": True,
+            "False": False,
+            "None": None,
+        }
+        self.setup_kwargs = None
+        self.setup_error = None
+        self.functions = {
+            "open": self.open,
+            "io.open": self.open,
+            "codecs.open": self.open,
+            "os.path.join": os.path.join,
+            "os.path.dirname": os.path.dirname,
+            "os.path.basename": os.path.basename,
+            "os.path.abspath": self.path,
+            "os.path.realpath": self.path,
+            "os.path.exists": lambda path: os.path.exists(self.path(path)),
+            "os.path.isfile": lambda path: os.path.isfile(self.path(path)),
+            "os.getcwd": lambda: self.directory,
+            "pathlib.Path": lambda *parts: _Path(self, *parts),
+            "list": list,
+            "tuple": tuple,
+            "set": set,
+            "sorted": sorted,
+            "dict": dict,
+            "str": str,
+            "len": len,
+        }
+        self.modules = {
+            "os": {"path": _Module("os.path"), "getcwd": _Module("os.getcwd")},
+            "sys": {"version_info": python_version_info(python_version), "platform": sys.platform, "argv": ["setup.py"]},
+        }
+
+    # file access is restricted to the package directory
+
+    def path(self, path):
+        path = os.path.realpath(os.path.join(self.directory, path))
+        if not (path == self.directory or path.startswith(self.directory + os.sep)):
+            raise StaticEvaluationError("path {path} is outside of the package".format(path=path))
+        return path
+
+    def open(self, filename, *args, **kwargs):
+        filename = self.path(str(filename))
+        if not os.path.isfile(filename):
+            raise StaticEvaluationError("file {filename} does not exist".format(filename=filename))
+        return _File(filename)
+
+    def requirements_file(self, value):
+        if isinstance(value, _Path):
+            value = value.path
+        if not isinstance(value, str) or not REQUIREMENTS_FILE_REGEX.search(value):
+            return None
+        filename = self.path(value)
+        return filename if os.path.isfile(filename) else None
+
+    # statements
+
+    def evaluate_module(self):
+        try:
+            with open(self.setup_filename) as f:
+                tree = ast.parse(f.read(), self.setup_filename)
+        except (IOError, OSError, SyntaxError, ValueError) as e:
+            raise StaticEvaluationError("unable to parse setup.py: {e}".format(e=e))
+
+        self.execute_statements(tree.body)
+        if self.setup_error is not None:
+            raise self.setup_error
+        if self.setup_kwargs is None:
+            raise StaticEvaluationError("setup(...) call not found in setup.py")
+        return self.setup_kwargs
+
+    def execute_statements(self, statements):
+        for statement in statements:
+            try:
+                self.execute(statement)
+            except Exception:
+                self.forget(statement)
+
+    def execute(self, statement):
+        if isinstance(statement, ast.Import):
+            for alias in statement.names:
+                name = alias.asname or alias.name.split(".")[0]
+                module = alias.name if alias.asname else name
+                self.namespace[name] = _Module(module)
+        elif isinstance(statement, ast.ImportFrom):
+            for alias in statement.names:
+                name = alias.asname or alias.name
+                self.namespace[name] = _Module("{module}.{name}".format(module=statement.module, name=alias.name))
+        elif isinstance(statement, ast.Assign):
+            value = self.evaluate(statement.value)
+            for target in statement.targets:
+                self.assign(target, value)
+        elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+            self.assign(statement.target, self.evaluate(statement.value))
+        elif isinstance(statement, ast.AugAssign):
+            operation = BINARY_OPERATORS.get(type(statement.op))
+            if operation is None or not isinstance(statement.target, ast.Name):
+                raise StaticEvaluationError("unsupported augmented assignment")
+            target_value = self.evaluate(statement.target)
+            value = self.evaluate(statement.value)
+            if isinstance(target_value, list) and isinstance(statement.op, ast.Add):
+                target_value.extend(value)
+            else:
+                self.namespace[statement.target.id] = operation(target_value, value)
+        elif isinstance(statement, ast.Expr):
+            if isinstance(statement.value, ast.Call):
+                self.evaluate_call(statement.value)
+        elif isinstance(statement, ast.If):
+            if self.evaluate(statement.test):
+                self.execute_statements(statement.body)
+            else:
+                self.execute_statements(statement.orelse)
+        elif isinstance(statement, ast.With):
+            for item in statement.items:
+                value = self.evaluate(item.context_expr)
+                if item.optional_vars is not None:
+                    self.assign(item.optional_vars, value)
+            self.execute_statements(statement.body)
+        elif isinstance(statement, ast.Try):
+            # assume no exception is raised, e.g. "from setuptools import setup"
+            self.execute_statements(statement.body)
+            self.execute_statements(statement.orelse)
+            self.execute_statements(statement.finalbody)
+        elif isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            self.namespace[statement.name] = UNKNOWN
+        elif isinstance(statement, (ast.Pass, ast.Assert, ast.Global, ast.Nonlocal)):
+            pass
+        else:
+            raise StaticEvaluationError("unsupported statement {statement}".format(statement=type(statement).__name__))
+
+    def assign(self, target, value):
+        if isinstance(target, ast.Name):
+            self.namespace[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            values = list(value)
+            if len(values) != len(target.elts):
+                raise StaticEvaluationError("unable to unpack assignment")
+            for element, element_value in zip(target.elts, values):
+                self.assign(element, element_value)
+        elif isinstance(target, ast.Subscript):
+            container = self.evaluate(target.value)
+            if not isinstance(container, (list, dict)):
+                raise StaticEvaluationError("unsupported subscript assignment")
+            container[self.evaluate(_subscript_slice(target))] = value
+        else:
+            raise StaticEvaluationError("unsupported assignment")
+
+    def forget(self, statement):
+        """Mark every name a statement may have bound or mutated as unknown"""
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+                self.namespace[node.id] = UNKNOWN
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                self.namespace[node.name] = UNKNOWN
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    self.namespace[alias.asname or alias.name.split(".")[0]] = UNKNOWN
+            elif isinstance(node, ast.Call):
+                self.forget_arguments(node)
+                if isinstance(node.func, ast.Attribute) and node.func.attr in MUTATING_METHODS \
+                        and isinstance(node.func.value, ast.Name):
+                    self.namespace[node.func.value.id] = UNKNOWN
+            elif isinstance(node, (ast.Subscript, ast.Attribute)) and isinstance(node.ctx, ast.Store):
+                if isinstance(node.value, ast.Name):
+                    self.namespace[node.value.id] = UNKNOWN
+
+    def forget_arguments(self, node):
+        """Mark lists, dicts and sets a call may mutate as unknown"""
+        arguments = list(node.args) + [keyword.value for keyword in node.keywords]
+        for argument in arguments:
+            if isinstance(argument, ast.Starred):
+                argument = argument.value
+            if isinstance(argument, ast.Name) and isinstance(self.namespace.get(argument.id), (list, dict, set)):
+                self.namespace[argument.id] = UNKNOWN
+
+    # expressions
+
+    def evaluate(self, node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        elif type(node).__name__ in LEGACY_LITERALS:  # python < 3.8
+            return getattr(node, LEGACY_LITERALS[type(node).__name__])
+        elif isinstance(node, ast.Name):
+            value = self.namespace.get(node.id, UNKNOWN)
+            if value is UNKNOWN:
+                raise StaticEvaluationError("name {name} is unknown".format(name=node.id))
+            return value
+        elif isinstance(node, ast.List):
+            return [self.evaluate(element) for element in node.elts]
+        elif isinstance(node, ast.Tuple):
+            return tuple(self.evaluate(element) for element in node.elts)
+        elif isinstance(node, ast.Set):
+            return {self.evaluate(element) for element in node.elts}
+        elif isinstance(node, ast.Dict):
+            result = {}
+            for key, value in zip(node.keys, node.values):
+                if key is None:
+                    result.update(self.evaluate(value))
+                else:
+                    result[self.evaluate(key)] = self.evaluate(value)
+            return result
+        elif isinstance(node, ast.JoinedStr):
+            return "".join(str(self.evaluate(value)) for value in node.values)
+        elif isinstance(node, ast.FormattedValue):
+            return format(self.evaluate(node.value), self.evaluate(node.format_spec) if node.format_spec else "")
+        elif isinstance(node, ast.BinOp):
+            operation = BINARY_OPERATORS.get(type(node.op))
+            left = self.evaluate(node.left)
+            right = self.evaluate(node.right)
+            if isinstance(node.op, ast.Div) and isinstance(left, _Path):
+                return left / right
+            if operation is None:
+                raise StaticEvaluationError("unsupported operator")
+            return operation(left, right)
+        elif isinstance(node, ast.BoolOp):
+            value = None
+            for element in node.values:
+                value = self.evaluate(element)
+                if isinstance(node.op, ast.And) and not value:
+                    return value
+                if isinstance(node.op, ast.Or) and value:
+                    return value
+            return value
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return not self.evaluate(node.operand)
+        elif isinstance(node, ast.Compare):
+            left = self.evaluate(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.evaluate(comparator)
+                if not COMPARE_OPERATORS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        elif isinstance(node, ast.IfExp):
+            if self.evaluate(node.test):
+                return self.evaluate(node.body)
+            return self.evaluate(node.orelse)
+        elif isinstance(node, ast.Subscript):
+            return self.evaluate(node.value)[self.evaluate(_subscript_slice(node))]
+        elif isinstance(node, ast.Slice):
+            return slice(
+                *[self.evaluate(part) if part is not None else None for part in (node.lower, node.upper, node.step)]
+            )
+        elif isinstance(node, ast.Attribute):
+            return self.attribute(self.evaluate(node.value), node.attr)
+        elif isinstance(node, ast.Call):
+            return self.evaluate_call(node)
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp)):
+            values = self.comprehension(node.generators, node.elt)
+            return set(values) if isinstance(node, ast.SetComp) else values
+        raise StaticEvaluationError("unsupported expression {node}".format(node=type(node).__name__))
+
+    def attribute(self, value, name):
+        if isinstance(value, _Module):
+            attributes = self.modules.get(value.name, {})
+            if name in attributes:
+                return attributes[name]
+            return _Module("{module}.{name}".format(module=value.name, name=name))
+        if isinstance(value, VersionInfo) and name in VersionInfo._fields:
+            return getattr(value, name)
+        if name in SAFE_ATTRIBUTES.get(type(value), set()):
+            return getattr(value, name)
+        raise StaticEvaluationError("unsupported attribute {name}".format(name=name))
+
+    def comprehension(self, generators, element):
+        if len(generators) != 1 or generators[0].is_async:
+            raise StaticEvaluationError("unsupported comprehension")
+        generator = generators[0]
+        saved_namespace = dict(self.namespace)
+        values = []
+        try:
+            for item in self.evaluate(generator.iter):
+                self.assign(generator.target, item)
+                if all(self.evaluate(condition) for condition in generator.ifs):
+                    values.append(self.evaluate(element))
+        finally:
+            self.namespace = saved_namespace
+        return values
+
+    def evaluate_call(self, node):
+        if _is_setup_call(node.func):
+            try:
+                self.setup_kwargs = self.setup_call_kwargs(node)
+            except Exception as e:
+                self.setup_error = StaticEvaluationError(
+                    "unable to evaluate setup(...) arguments: {e}".format(e=e)
+                )
+                raise self.setup_error
+            return None
+
+        arguments = [self.evaluate(arg) for arg in node.args if not isinstance(arg, ast.Starred)]
+        starred = [self.evaluate(arg.value) for arg in node.args if isinstance(arg, ast.Starred)]
+        for value in starred:
+            arguments.extend(value)
+        keywords = {}
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                keywords.update(self.evaluate(keyword.value))
+            else:
+                keywords[keyword.arg] = self.evaluate(keyword.value)
+
+        if isinstance(node.func, ast.Attribute):
+            receiver = self.evaluate(node.func.value)
+            method = node.func.attr
+            if method in SAFE_METHODS.get(type(receiver), set()):
+                return getattr(receiver, method)(*arguments, **keywords)
+            if isinstance(receiver, _Module):
+                function = self.functions.get("{module}.{name}".format(module=receiver.name, name=method))
+                if function is not None:
+                    return function(*arguments, **keywords)
+        elif isinstance(node.func, ast.Name):
+            function = self.namespace.get(node.func.id, self.functions.get(node.func.id))
+            if isinstance(function, _Module):
+                function = self.functions.get(function.name)
+            if callable(function):
+                return function(*arguments, **keywords)
+
+        # unknown or user defined function, it may mutate its arguments
+        self.forget_arguments(node)
+
+        # unknown function called with a requirements file, most
+        # likely a helper that reads requirements
+        for argument in arguments:
+            filename = self.requirements_file(argument)
+            if filename is not None:
+                return read_requirements_file(filename)
+
+        raise StaticEvaluationError("unsupported function call")
+
+    def setup_call_kwargs(self, node):
+        kwargs = {}
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                value = self.evaluate(keyword.value)
+                if not isinstance(value, dict):
+                    raise StaticEvaluationError("setup(**kwargs) is not a dict")
+                kwargs.update({key: value[key] for key in SETUP_KEYWORDS if key in value})
+            elif keyword.arg in SETUP_KEYWORDS:
+                kwargs[keyword.arg] = self.evaluate(keyword.value)
+        return kwargs
+
+
+def python_version_info(python_version):
+    # type: (str) -> VersionInfo
+    """sys.version_info of a python version, e.g. 3.7 or 3.7.4"""
+    parts = [int(part) for part in re.findall(r"\d+", python_version)[:3]]
+    parts += [0] * (3 - len(parts))
+    return VersionInfo(parts[0], parts[1], parts[2], "final", 0)
+
+
+def _subscript_slice(node):
+    if type(node.slice).__name__ == "Index":  # python < 3.9
+        return node.slice.value
+    return node.slice
+
+
+def _is_setup_call(func):
+    if isinstance(func, ast.Name):
+        return func.id == "setup"
+    return isinstance(func, ast.Attribute) and func.attr == "setup" and isinstance(func.value, ast.Name) \
+        and func.value.id in {"setuptools", "core", "distutils"}
+
+
+def read_requirements_file(filename, seen=None):
+    # type: (str, Optional[Set[str]]) -> List[str]
+    """Requirements listed in a requirements file following "-r" includes"""
+    seen = seen or set()
+    if filename in seen:
+        return []
+    seen.add(filename)
+
+    requirements = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split(" #", 1)[0].strip()
+            if line.startswith("-r ") or line.startswith("--requirement "):
+                include = os.path.join(os.path.dirname(filename), line.split(None, 1)[1])
+                if os.path.isfile(include):
+                    requirements.extend(read_requirements_file(include, seen))
+            elif line and not line.startswith("#") and not line.startswith("-"):
+                requirements.append(line)
+    return requirements
+
+
+def _requirement_list(value):
+    if isinstance(value, str):
+        value = value.splitlines()
+    if not isinstance(value, (list, tuple, set)):
+        raise StaticEvaluationError("requirements are not a list: {value}".format(value=value))
+
+    requirements = []
+    for requirement in value:
+        if not isinstance(requirement, str):
+            raise StaticEvaluationError("requirement is not a string: {requirement}".format(requirement=requirement))
+        requirement = requirement.split(" #", 1)[0].strip()
+        if requirement and not requirement.startswith("#") and not requirement.startswith("-"):
+            requirements.append(requirement)
+    return requirements
+
+
+def determine_dependencies_from_static_setup(directory, python_version=DEFAULT_PYTHON_VERSION):
+    """Statically evaluate the setup(...) call of directory/setup.py
+
+    Returns the same dependencies as `determine_dependencies_from_mock_setup`
+    or raises StaticEvaluationError when setup.py is too dynamic.
+    `sys.version_info` is the one of `python_version`.
+    """
+    kwargs = SetupEvaluator(directory, python_version).evaluate_module()
+
+    extras_require = kwargs.get("extras_require", {})
+    if not isinstance(extras_require, dict):
+        raise StaticEvaluationError("extras_require is not a dict")
+
+    extraInputs = []
+    for k, v in extras_require.items():
+        for p in _requirement_list(v):
+            extraInputs.append("{p} # {k}".format(p=p, k=k))
+    return {
+        "extraInputs": extraInputs,
+        "buildInputs": _requirement_list(kwargs.get("setup_requires", [])),
+        "checkInputs": _requirement_list(kwargs.get("tests_require", [])),
+        "propagatedBuildInputs": _requirement_list(kwargs.get("install_requires", [])),
+    }
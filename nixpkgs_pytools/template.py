@@ -0,0 +1,109 @@
+"""Jinja2 environment rendering the nix derivations
+
+Templates are loaded from a user supplied template directory before
+the templates shipped with nixpkgs-pytools so sites can customize the
+output by providing their own `default.nix.j2`. The environment is
+created once and never reloads templates so each template is compiled
+once per process. With a `bytecode_cache_directory` the compiled
+templates are also reused across processes.
+
+The default environment is only created by the first render, command
+line tools set its arguments. jinja2 is imported when an environment is
+created so that runs which render nothing never import it.
+"""
+import os
+import threading
+
+
+DEFAULT_TEMPLATE = "default.nix.j2"
+
+_default_environment = None
+_default_environment_arguments = (None, None)  # (template directory, bytecode cache directory)
+_default_environment_lock = threading.Lock()
+
+
+def create_environment(template_directory=None, bytecode_cache_directory=None):
+    # type: (Optional[str], Optional[str]) -> jinja2.Environment
+    import jinja2
+
+    loaders = [jinja2.PackageLoader("nixpkgs_pytools", "templates")]
+    if template_directory is not None:
+        _check_template_directory(template_directory)
+        loaders.insert(0, jinja2.FileSystemLoader(template_directory))
+
+    bytecode_cache = None
+    if bytecode_cache_directory is not None:
+        os.makedirs(bytecode_cache_directory, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_directory)
+
+    return jinja2.Environment(
+        loader=jinja2.ChoiceLoader(loaders),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+    )
+
+
+def get_default_environment():
+    # type: () -> jinja2.Environment
+    global _default_environment
+    with _default_environment_lock:
+        if _default_environment is None:
+            _default_environment = create_environment(*_default_environment_arguments)
+        return _default_environment
+
+
+def set_default_environment(environment):
+    # type: (Optional[jinja2.Environment]) -> None
+    global _default_environment
+    _default_environment = environment
+
+
+def set_default_environment_arguments(template_directory=None, bytecode_cache_directory=None):
+    # type: (Optional[str], Optional[str]) -> None
+    """Arguments the default environment is created with on the first render"""
+    global _default_environment, _default_environment_arguments
+    with _default_environment_lock:
+        _default_environment = None
+        _default_environment_arguments = (template_directory, bytecode_cache_directory)
+
+
+def add_template_arguments(parser):
+    parser.add_argument(
+        "--template-dir",
+        help="directory with a {template} overriding the nix derivation template".format(
+            template=DEFAULT_TEMPLATE
+        ),
+    )
+
+
+def environment_arguments_from_arguments(args, cache=None):
+    # type: (argparse.Namespace, Optional[Cache]) -> Tuple[Optional[str], Optional[str]]
+    """(template directory, bytecode cache directory) of the command line arguments
+
+    Compiled templates are stored in the cache (if enabled). A missing
+    template directory is reported without creating the environment.
+    """
+    if args.template_dir is not None:
+        _check_template_directory(args.template_dir)
+    bytecode_cache_directory = None
+    if cache is not None:
+        bytecode_cache_directory = os.path.join(cache.directory, "templates")
+    return args.template_dir, bytecode_cache_directory
+
+
+def environment_from_arguments(args, cache=None):
+    # type: (argparse.Namespace, Optional[Cache]) -> jinja2.Environment
+    """Environment for the command line arguments"""
+    return create_environment(*environment_arguments_from_arguments(args, cache))
+
+
+def _check_template_directory(template_directory):
+    if not os.path.isdir(template_directory):
+        raise ValueError(
+            'template directory "{directory}" does not exist'.format(directory=template_directory)
+        )
+
+
+def render_template(name, **context):
+    # type: (str, Any) -> str
+    return get_default_environment().get_template(name).render(**context)
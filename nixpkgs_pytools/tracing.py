@@ -0,0 +1,179 @@
+"""Timing spans of the stages of generating derivations
+
+Stages are wrapped in `span`, which records them with the default
+tracer. Without a tracer `span` does nothing, so the instrumentation
+costs a function call. Recorded spans are written in the Chrome trace
+event format, which chrome://tracing and https://ui.perfetto.dev show
+as a timeline per thread. In batch runs this shows which packages and
+stages are slow.
+
+With a profile directory, every package also runs under cProfile. Its
+profile is written to `<profile directory>/<package>.prof`.
+"""
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("tracing")
+
+_default_tracer = None
+
+
+def get_default_tracer():
+    # type: () -> Optional[Tracer]
+    return _default_tracer
+
+
+def set_default_tracer(tracer):
+    # type: (Optional[Tracer]) -> None
+    global _default_tracer
+    _default_tracer = tracer
+
+
+def add_trace_arguments(parser):
+    parser.add_argument(
+        "--trace",
+        help="write a Chrome trace (chrome://tracing) of the stages of every package to this file",
+    )
+    parser.add_argument(
+        "--profile-dir", help="directory to write a cProfile profile of every package to"
+    )
+
+
+def tracer_from_arguments(args):
+    # type: (argparse.Namespace) -> Optional[Tracer]
+    if args.trace is None and args.profile_dir is None:
+        return None
+    return Tracer(args.trace, args.profile_dir)
+
+
+class Tracer(object):
+    """Collects timing spans of all threads"""
+
+    def __init__(self, filename=None, profile_directory=None):
+        self.filename = filename
+        self.profile_directory = profile_directory
+        self.events = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": (start - self._start) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self._pid,
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+                self._thread_names[event["tid"]] = threading.current_thread().name
+
+    @contextlib.contextmanager
+    def profile(self, package_name):
+        if self.profile_directory is None:
+            yield
+            return
+
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # only one profiler can be active at a time on python >= 3.12
+            log.warning("not profiling {package_name}: {e}".format(package_name=package_name, e=e))
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_directory, "{package_name}.prof".format(package_name=package_name)))
+
+    def durations(self):
+        # type: () -> Dict[str, float]
+        """Total seconds spent in each stage"""
+        durations = {}
+        with self._lock:
+            for event in self.events:
+                durations[event["name"]] = durations.get(event["name"], 0.0) + event["dur"] / 1e6
+        return durations
+
+    def write(self, filename=None):
+        # type: (Optional[str]) -> None
+        with self._lock:
+            names = [
+                {"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self._thread_names.items()
+            ]
+            trace = {"traceEvents": names + self.events, "displayTimeUnit": "ms"}
+        with open(filename or self.filename, "w") as f:
+            json.dump(trace, f)
+
+
+def span(name, **args):
+    """Time the enclosed stage with the default tracer"""
+    tracer = _default_tracer
+    if tracer is None:
+        return _NULL_CONTEXT
+    return tracer.span(name, **args)
+
+
+def profile(package_name):
+    """Profile the enclosed package with the default tracer"""
+    tracer = _default_tracer
+    if tracer is None:
+        return _NULL_CONTEXT
+    return tracer.profile(package_name)
+
+
+def traced(name, argument=None):
+    """Decorator timing every call of a function as stage `name`
+
+    The value of the parameter `argument`, e.g. the package name, is
+    recorded with the span.
+    """
+    def decorator(function):
+        code = function.__code__
+        position = code.co_varnames[:code.co_argcount].index(argument) if argument else None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _default_tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            span_args = {}
+            if argument:
+                span_args[argument] = args[position] if position < len(args) else kwargs.get(argument)
+            with tracer.span(name, **span_args):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
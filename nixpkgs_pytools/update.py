@@ -0,0 +1,303 @@
+"""Update existing derivations to the latest version on pypi
+
+Instead of generating the derivation again only the `version` and the
+hash of the `fetchPypi` source are rewritten in place. Up to date
+derivations cost a single pypi metadata request and no sdist is ever
+downloaded unless the dependencies of updated packages are checked.
+
+With `--since-last-run` the pypi changelog serial of the previous sweep
+over the same paths is kept in the cache and only derivations of
+packages that changed on pypi since then are checked.
+"""
+import argparse
+import base64
+import binascii
+import collections
+import concurrent.futures
+import hashlib
+import os
+import re
+import sys
+
+from .cache import (
+    add_cache_arguments,
+    cache_from_arguments,
+    get_default_cache,
+    set_default_cache,
+)
+from .dependency import determine_package_dependencies
+from .download import (
+    changed_packages_since,
+    download_package_json,
+    download_simple_json,
+    latest_sdist,
+    pypi_last_serial,
+)
+from .format import format_normalized_package_name
+from .http_client import add_http_arguments, client_from_arguments, set_default_client
+from .nixpkgs_index import PNAME_REGEX, VERSION_REGEX
+from .requirement import compare_versions
+from .utils import atomic_write
+
+
+FETCH_PYPI_REGEX = re.compile(r"\bfetchPypi\s*\{")
+HASH_REGEX = re.compile(r'\b(sha256|hash)\s*=\s*"([^"$]+)"\s*;')
+INPUT_LIST_REGEX = re.compile(r"\b(buildInputs|checkInputs|propagatedBuildInputs)\s*=\s*\[([^\]]*)\]")
+
+UpdateResult = collections.namedtuple(
+    "UpdateResult", ["filename", "pname", "old_version", "new_version", "changed_inputs", "error"]
+)
+
+
+def main():
+    args = cli(sys.argv[1:])
+    set_default_cache(cache_from_arguments(args))
+    set_default_client(client_from_arguments(args))
+
+    paths = args.paths or [os.path.join(args.nixpkgs_root, "pkgs", "development", "python-modules")]
+    filenames = []
+    for path in paths:
+        filenames.extend(find_derivations(path))
+
+    cache = get_default_cache()
+    if args.since_last_run:
+        if cache is None:
+            print("--since-last-run requires the cache")
+            sys.exit(1)
+        key = sweep_key(paths)
+        serial = pypi_last_serial()
+        state = cache.get_changelog_serial(key)
+        if state is not None:
+            changed, _ = changed_packages_since(state["serial"])
+            filenames = changed_derivations(filenames, changed | set(state["pending"]))
+            print("{count} derivations changed on pypi since the last run".format(count=len(filenames)))
+
+    results = update_derivations(filenames, args.jobs, args.dry_run, args.check_inputs, args.simple_index)
+    print_report(results)
+
+    if args.since_last_run:
+        # packages that were not updated have to be checked again next time
+        pending = {
+            format_normalized_package_name(result.pname or result.filename)
+            for result in results
+            if result.error or (args.dry_run and result.new_version)
+        }
+        cache.put_changelog_serial(key, serial, pending)
+    if any(result.error for result in results):
+        sys.exit(1)
+
+
+def cli(arguments):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="default.nix derivations or directories of <package-name>/default.nix derivations to update",
+    )
+    parser.add_argument(
+        "--nixpkgs-root", help="Root directory of nixpkgs, updates all python-modules when no paths are given"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=8,
+        help="number of derivations to check concurrently",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report available updates, do not rewrite derivations"
+    )
+    parser.add_argument(
+        "--check-inputs",
+        action="store_true",
+        help="Determine the dependencies of updated packages and report inputs that changed, inputs are not rewritten",
+    )
+    parser.add_argument(
+        "--simple-index",
+        action="store_true",
+        help="Determine the latest release from the small PEP 691 simple index instead of the json api",
+    )
+    parser.add_argument(
+        "--since-last-run",
+        action="store_true",
+        help="Only check packages that changed on pypi since the last run over the same paths",
+    )
+    add_cache_arguments(parser)
+    add_http_arguments(parser)
+    args = parser.parse_args(arguments)
+    if not args.paths and not args.nixpkgs_root:
+        parser.error("no derivations specified, provide paths or --nixpkgs-root")
+    return args
+
+
+def find_derivations(path):
+    # type: (str) -> List[str]
+    """default.nix of path or of the directories in path"""
+    if os.path.isfile(path):
+        return [path]
+    if os.path.isfile(os.path.join(path, "default.nix")):
+        return [os.path.join(path, "default.nix")]
+    return sorted(
+        os.path.join(entry.path, "default.nix")
+        for entry in os.scandir(path)
+        if entry.is_dir() and os.path.isfile(os.path.join(entry.path, "default.nix"))
+    )
+
+
+def sweep_key(paths):
+    # type: (List[str]) -> str
+    """Key of the changelog serial of a sweep over paths"""
+    paths = sorted(os.path.abspath(path) for path in paths)
+    return hashlib.sha256("\0".join(paths).encode()).hexdigest()
+
+
+def changed_derivations(filenames, changed):
+    # type: (List[str], Set[str]) -> List[str]
+    """Derivations whose normalized pname is in `changed`
+
+    Derivations that cannot be parsed are kept so that they are reported.
+    """
+    selected = []
+    for filename in filenames:
+        try:
+            with open(filename) as f:
+                pname = parse_pypi_source(f.read())[0]
+        except (IOError, OSError, ValueError):
+            selected.append(filename)
+            continue
+        if format_normalized_package_name(pname) in changed:
+            selected.append(filename)
+    return selected
+
+
+def update_derivations(filenames, jobs=8, dry_run=False, check_inputs=False, simple_index=False):
+    # type: (List[str], int, bool, bool, bool) -> List[UpdateResult]
+    """Update the derivations concurrently on at most `jobs` threads"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(
+            lambda filename: update_derivation(filename, dry_run, check_inputs, simple_index), filenames
+        ))
+
+
+def update_derivation(filename, dry_run=False, check_inputs=False, simple_index=False):
+    # type: (str, bool, bool, bool) -> UpdateResult
+    pname, version = None, None
+    try:
+        with open(filename) as f:
+            content = f.read()
+        pname, version, hash_span = parse_pypi_source(content)
+
+        if simple_index:
+            latest_version, release = latest_sdist(download_simple_json(pname), pname)
+        else:
+            package_json = download_package_json(pname)
+            latest_version = package_json["info"]["version"]
+        if not compare_versions(latest_version, ">", version):
+            return UpdateResult(filename, pname, version, None, None, None)
+
+        if not simple_index:
+            release = sdist_release(package_json, latest_version)
+        changed_inputs = None
+        if check_inputs:
+            if simple_index:
+                package_json = download_package_json(pname, version=latest_version)
+            changed_inputs = compare_inputs(content, determine_package_dependencies(
+                package_json, release["url"], release["digests"]["sha256"]
+            ))
+        if not dry_run:
+            content = update_content(content, latest_version, release["digests"]["sha256"], hash_span)
+            atomic_write(filename, content.encode())
+        return UpdateResult(filename, pname, version, latest_version, changed_inputs, None)
+    except Exception as e:
+        return UpdateResult(filename, pname, version, None, None, str(e))
+
+
+def parse_pypi_source(content):
+    # type: (str) -> Tuple[str, str, Tuple[int, int]]
+    """(pname, version, span of the hash of the fetchPypi source)"""
+    fetch_pypi = FETCH_PYPI_REGEX.search(content)
+    if fetch_pypi is None:
+        raise ValueError("source is not fetched with fetchPypi")
+    source_end = _closing_brace(content, fetch_pypi.end())
+
+    # fetchPypi overrides pname when the pypi name differs
+    pname = PNAME_REGEX.search(content, fetch_pypi.end(), source_end) or PNAME_REGEX.search(content)
+    version = VERSION_REGEX.search(content)
+    hash_match = HASH_REGEX.search(content, fetch_pypi.end(), source_end)
+    if pname is None or version is None:
+        raise ValueError("pname and version are not string literals")
+    if hash_match is None:
+        raise ValueError("fetchPypi has no sha256 or hash")
+    return pname.group(1), version.group(1), hash_match.span()
+
+
+def update_content(content, version, sha256, hash_span):
+    # type: (str, str, str, Tuple[int, int]) -> str
+    """Replace the version and the hash, keeping the format of the hash"""
+    start, end = hash_span
+    attribute, old_hash = HASH_REGEX.match(content, start).groups()
+    if old_hash.startswith("sha256-"):
+        new_hash = "sha256-" + base64.b64encode(binascii.unhexlify(sha256)).decode()
+    else:
+        new_hash = sha256
+    content = content[:start] + '{attribute} = "{hash}";'.format(attribute=attribute, hash=new_hash) + content[end:]
+
+    version_match = VERSION_REGEX.search(content)
+    return (
+        content[:version_match.start(1)] + version + content[version_match.end(1):]
+    )
+
+
+def compare_inputs(content, dependencies):
+    # type: (str, Dict[str, List[str]]) -> Dict[str, Tuple[List[str], List[str]]]
+    """(added, removed) inputs of the derivation for each kind of input"""
+    existing = {key: set() for key in ("buildInputs", "checkInputs", "propagatedBuildInputs")}
+    for key, inputs in INPUT_LIST_REGEX.findall(content):
+        existing[key].update(re.findall(r"[A-Za-z_][A-Za-z0-9_'-]*", re.sub(r"#.*", "", inputs)))
+
+    changed = {}
+    for key, inputs in existing.items():
+        determined = set(dependencies.get(key, []))
+        added, removed = sorted(determined - inputs), sorted(inputs - determined)
+        if added or removed:
+            changed[key] = (added, removed)
+    return changed
+
+
+def sdist_release(package_json, version):
+    for release in package_json["releases"].get(version, []):
+        if release["packagetype"] == "sdist":
+            return release
+    raise ValueError("no source distribution (sdist) found for version {version}".format(version=version))
+
+
+def print_report(results):
+    for result in results:
+        if result.error:
+            print("FAILED   {filename}: {error}".format(filename=result.filename, error=result.error))
+        elif result.new_version:
+            print("UPDATED  {pname} {old} -> {new}".format(pname=result.pname, old=result.old_version, new=result.new_version))
+            for key, (added, removed) in sorted((result.changed_inputs or {}).items()):
+                print("         {key}: added {added} removed {removed}".format(
+                    key=key, added=" ".join(added) or "-", removed=" ".join(removed) or "-"))
+
+    updated = sum(1 for result in results if result.new_version)
+    failed = sum(1 for result in results if result.error)
+    print("{updated} updated, {current} up to date, {failed} failed".format(
+        updated=updated, current=len(results) - updated - failed, failed=failed))
+
+
+def _closing_brace(content, position):
+    depth = 1
+    for i in range(position, len(content)):
+        if content[i] == "{":
+            depth += 1
+        elif content[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("unbalanced braces in derivation")
+
+
+if __name__ == "__main__":
+    main()
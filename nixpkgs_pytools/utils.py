@@ -1,11 +1,77 @@
 import os
 import re
+import shutil
+import stat
+import tempfile
 
 
 def determine_filename_extension(filename, package_name, version):
     # type: (str, str, str) -> str
     base_filename = os.path.basename(filename)
-    match = re.match("{package_name}-{version}\.(.+)".format(package_name=package_name, version=version), base_filename)
+    # sdist filenames may use the normalized project name (PEP 625)
+    name_pattern = "[-_.]+".join(re.escape(part) for part in re.split("[-_.]+", package_name))
+    match = re.match("{package_name}-{version}\.(.+)".format(package_name=name_pattern, version=re.escape(version)), base_filename, re.IGNORECASE)
     if match is None:
         raise ValueError("could not determine extension of package: {filename}".format(filename=filename))
     return match.group(1)
+
+
+# prefix of the files written by `atomic_write` before they are moved into place
+TEMPORARY_PREFIX = ".tmp-"
+
+
+def _read_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# the umask can only be read by setting it, read it once before any thread starts
+UMASK = _read_umask()
+
+
+def temporary_file(filename):
+    # type: (str) -> Tuple[int, str]
+    """Temporary file next to filename with the mode filename has or would get
+
+    mkstemp creates files only readable by their owner, files replaced
+    in a nixpkgs checkout have to keep their mode.
+    """
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, temporary_filename = tempfile.mkstemp(dir=directory, prefix=TEMPORARY_PREFIX)
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except OSError:
+        mode = 0o666 & ~UMASK
+    os.fchmod(fd, mode)
+    return fd, temporary_filename
+
+
+def atomic_write(filename, content):
+    # type: (str, bytes) -> None
+    """Replace filename with content, readers see either the old or new file"""
+    fd, temporary_filename = temporary_file(filename)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(temporary_filename, filename)
+    except Exception:
+        os.remove(temporary_filename)
+        raise
+
+
+def atomic_move(source_filename, filename):
+    # type: (str, str) -> None
+    # source may live on another filesystem so first move it next to
+    # the destination and then atomically rename it into place
+    fd, temporary_filename = temporary_file(filename)
+    os.close(fd)
+    try:
+        shutil.move(source_filename, temporary_filename)
+        os.replace(temporary_filename, filename)
+    except Exception:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
@@ -5,17 +5,21 @@ setup(
     description="Tools for removing the tedious nature of creating nixpkgs derivations",
     version="1.3.0",
     packages=["nixpkgs_pytools"],
+    package_data={"nixpkgs_pytools": ["templates/*.j2"]},
     license="MIT",
     long_description=open("README.md").read(),
     long_description_content_type='text/markdown',
     author="Christopher Ostrouchov",
     author_email="chris.ostrouchov@gmail.com",
     url="https://github.com/nix-community/nixpkgs-pytools/",
-    install_requires=["jinja2", "setuptools", "rope"],
+    install_requires=["jinja2", "setuptools", "rope", 'tomli; python_version < "3.11"'],
     tests_require=["pytest"],
+    python_requires=">=3.6",
     entry_points={
         "console_scripts": [
             "python-package-init = nixpkgs_pytools.python_package_init:main",
+            "python-package-batch = nixpkgs_pytools.batch:main",
+            "python-package-update = nixpkgs_pytools.update:main",
             "python-rewrite-imports = nixpkgs_pytools.import_rewrite:main"
         ]
     },
@@ -26,8 +30,6 @@ setup(
         "Development Status :: 3 - Alpha",
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2.7",
-        "Programming Language :: Python :: 3.5",
         "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: Implementation :: CPython",
@@ -6,8 +6,7 @@ pythonPackages.buildPythonPackage {
 
   propagatedBuildInputs = with pythonPackages; [
     jinja2 setuptools rope
-  ] ++ pkgs.stdenv.lib.optionals pythonPackages.isPy27 [ pythonPackages.mock ];
+  ] ++ pkgs.stdenv.lib.optionals (!pythonPackages.pythonAtLeast "3.11") [ pythonPackages.tomli ];
 
-  checkInputs = [ pythonPackages.pytest ]
-    ++ pkgs.stdenv.lib.optionals pythonPackages.isPy3k [ pythonPackages.black ];
+  checkInputs = with pythonPackages; [ pytest black ];
 }
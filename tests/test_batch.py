@@ -0,0 +1,81 @@
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import os
+
+from nixpkgs_pytools.batch import (
+    cli,
+    initialize_packages,
+    parse_package_spec,
+    read_requirements_file,
+)
+
+
+@pytest.mark.parametrize(
+    "spec, expected",
+    [
+        ("flask", ("flask", None)),
+        ("Flask==1.1.1", ("Flask", "1.1.1")),
+        ("zope.interface == 4.6.0", ("zope.interface", "4.6.0")),
+        ("requests[security]==2.22.0", ("requests", "2.22.0")),
+    ],
+)
+def test_parse_package_spec(spec, expected):
+    assert parse_package_spec(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["foo>=2", "foo==1.0,<2", "foo; python_version < '3'", "==1.0"])
+def test_parse_package_spec_rejects_specifiers(spec):
+    with pytest.raises(ValueError):
+        parse_package_spec(spec)
+
+
+def test_cli_invalid_package_spec(tmpdir, capsys):
+    with pytest.raises(SystemExit):
+        cli(["foo>=2"])
+    assert 'unable to parse package "foo>=2"' in capsys.readouterr().err
+
+    filename = str(tmpdir.join("requirements.txt"))
+    with open(filename, "w") as f:
+        f.write("six\nattrs>=19\n")
+    with pytest.raises(SystemExit):
+        cli(["-r", filename])
+    assert "requirements.txt:2: unable to parse" in capsys.readouterr().err
+
+
+def test_read_requirements_file(tmpdir):
+    filename = str(tmpdir.join("requirements.txt"))
+    with open(filename, "w") as f:
+        f.write("# comment\n-e .\nsix\n\ndask==2.3.0  # pinned\n")
+
+    assert read_requirements_file(filename) == [("six", None), ("dask", "2.3.0")]
+
+
+def test_initialize_packages(tmpdir):
+    def package_json_to_metadata(package_json, package_name, version):
+        if package_name == "broken":
+            raise ValueError("no source distribution (sdist) found")
+        return {"pname": package_name, "version": version or "1.0"}
+
+    with mock.patch(
+        "nixpkgs_pytools.batch.download_package_json"
+    ), mock.patch(
+        "nixpkgs_pytools.batch.package_json_to_metadata", package_json_to_metadata
+    ), mock.patch(
+        "nixpkgs_pytools.batch.metadata_to_nix", lambda metadata: metadata["pname"]
+    ):
+        results = initialize_packages(
+            [("six", None), ("broken", None), ("dask", "2.3.0")], str(tmpdir), jobs=2
+        )
+
+    assert [result.package_name for result in results] == ["six", "broken", "dask"]
+    assert [result.version for result in results] == ["1.0", None, "2.3.0"]
+    assert results[1].error == "no source distribution (sdist) found"
+    for result in (results[0], results[2]):
+        assert result.error is None
+        assert open(result.filename).read() == result.package_name
+        assert result.filename == os.path.join(str(tmpdir), result.package_name, "default.nix")
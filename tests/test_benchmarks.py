@@ -0,0 +1,94 @@
+import hashlib
+import io
+import json
+import tarfile
+
+from benchmarks.bench_import_rewrite import run_benchmark as run_import_rewrite_benchmark
+from benchmarks.bench_package_init import STAGES, percentile, run_benchmark
+from benchmarks.bench_startup import ENTRY_POINTS, command_times, eager_lazy_modules, import_times
+
+
+def write_fixtures(tmpdir):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        content = b"[options]\ninstall_requires =\n    six\n"
+        info = tarfile.TarInfo("example-1.0/setup.cfg")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    archive = archive.getvalue()
+
+    url = "https://files.pythonhosted.org/packages/ab/cd/example-1.0.tar.gz"
+    tmpdir.ensure("files/packages/ab/cd/example-1.0.tar.gz").write_binary(archive)
+    release = {
+        "filename": "example-1.0.tar.gz",
+        "packagetype": "sdist",
+        "url": url,
+        "digests": {"sha256": hashlib.sha256(archive).hexdigest()},
+    }
+    package_json = {
+        "info": {
+            "name": "example",
+            "version": "1.0",
+            "summary": "An example",
+            "home_page": "https://example.org",
+            "license": "MIT",
+            "requires_python": None,
+            "requires_dist": None,
+        },
+        "releases": {"1.0": [release]},
+        "urls": [release],
+    }
+    tmpdir.ensure("json/example.json").write(json.dumps(package_json))
+    return str(tmpdir)
+
+
+def test_run_benchmark(tmpdir):
+    fixture_directory = write_fixtures(tmpdir.mkdir("fixtures"))
+    output_directory = tmpdir.mkdir("output")
+
+    summary = run_benchmark(["example", "missing"], fixture_directory, str(output_directory), sandbox=False)
+
+    assert summary["packages"] == 2
+    assert list(summary["failures"]) == ["missing"]
+    assert list(summary["stages"]) == STAGES + ["total"]
+    assert summary["stages"]["download"]["p95"] > 0
+    assert "six" in output_directory.join("example", "default.nix").read()
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile([], 95) == 0.0
+
+
+def test_run_import_rewrite_benchmark(tmpdir):
+    tmpdir.ensure("example.py").write("import numpy\nnumpy.array\n")
+    tmpdir.ensure("other.py").write("import os\n")
+
+    summary = run_import_rewrite_benchmark(str(tmpdir), [("numpy", "mynumpy")])
+
+    assert summary["files"] == 2
+    assert summary["changed"] == {"rope": 1, "ast": 1}
+    assert summary["differences"] == []
+    assert tmpdir.join("example.py").read() == "import numpy\nnumpy.array\n"
+
+
+def test_entry_points_import_heavy_modules_lazily():
+    for module in ENTRY_POINTS:
+        times = import_times(module)
+        assert module in times
+        assert eager_lazy_modules(times) == []
+
+
+def test_commands_import_heavy_modules_lazily():
+    # a failing lookup renders nothing and must not import jinja2
+    for module in ENTRY_POINTS:
+        times = command_times(module)
+        assert module in times
+        assert eager_lazy_modules(times) == []
+
+
+def test_eager_lazy_modules():
+    times = {"jinja2": (1, 2), "jinja2.environment": (1, 1), "rope_like": (1, 1), "json": (1, 1)}
+    assert eager_lazy_modules(times) == ["jinja2", "jinja2.environment"]
@@ -0,0 +1,187 @@
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import hashlib
+import os
+import time
+
+from nixpkgs_pytools.cache import Cache
+from nixpkgs_pytools.download import download_package_json, download_package
+
+
+def test_cache_package_json(tmpdir):
+    cache = Cache(str(tmpdir))
+    assert cache.get_package_json("Flask") is None
+
+    cache.put_package_json("Flask", b'{"info": {}}', etag='"abc"')
+    content, headers, age = cache.get_package_json("flask")
+    assert content == b'{"info": {}}'
+    assert headers["etag"] == '"abc"'
+    assert age >= 0
+
+
+def test_cache_fresh_package_json_skips_network(tmpdir):
+    cache = Cache(str(tmpdir), max_age=3600)
+    cache.put_package_json("six", b'{"info": {"name": "six"}}')
+
+    client = mock.Mock()
+    assert download_package_json("six", cache, client) == {"info": {"name": "six"}}
+    assert not client.get.called
+
+
+def test_cache_offline(tmpdir):
+    cache = Cache(str(tmpdir), offline=True)
+
+    client = mock.Mock()
+    with pytest.raises(ValueError):
+        download_package_json("six", cache, client)
+    with pytest.raises(ValueError):
+        download_package("https://example.org/six-1.0.tar.gz", str(tmpdir), "0" * 64, cache, client)
+    assert not client.get.called
+
+
+def test_cache_sdist_sha256_mismatch(tmpdir):
+    cache = Cache(str(tmpdir.join("cache")))
+    filename = str(tmpdir.join("six-1.0.tar.gz"))
+    with open(filename, "wb") as f:
+        f.write(b"sdist")
+
+    with pytest.raises(ValueError):
+        cache.put_sdist("0" * 64, "six-1.0.tar.gz", filename)
+
+    sha256 = hashlib.sha256(b"sdist").hexdigest()
+    cached_filename = cache.put_sdist(sha256, "six-1.0.tar.gz", filename)
+    assert cache.get_sdist(sha256, "six-1.0.tar.gz") == cached_filename
+    assert not os.path.exists(filename)
+
+
+def test_cache_lru_eviction(tmpdir):
+    cache = Cache(str(tmpdir))
+    for i, package_name in enumerate(["a", "b", "c"]):
+        cache.put_package_json(package_name, b"x" * 100)
+        for filename in cache._json_filenames(package_name):
+            os.utime(filename, (i, i))
+    cache.get_package_json("a")
+
+    cache.max_size = 250
+    cache.evict()
+    assert cache.size() <= 250
+    assert cache.get_package_json("a") is not None
+    assert cache.get_package_json("b") is None
+
+
+def test_cache_evict_lists_entries_only_when_full(tmpdir):
+    cache = Cache(str(tmpdir), max_size=1000)
+    cache.put_package_json("a", b"x" * 100)
+    with mock.patch("os.walk", side_effect=os.walk) as walk:
+        for i in range(3):
+            cache.put_imports("{i:064x}".format(i=i), 1, ["six"])
+            cache.evict()
+        assert walk.call_count == 0
+
+        cache.put_package_json("b", b"x" * 1000)
+        assert walk.call_count > 0
+    assert cache.size() <= 900
+
+
+def test_cache_evict_keeps_indexes_and_templates(tmpdir):
+    index = tmpdir.ensure("nixpkgs", "0" * 64 + ".sqlite")
+    index.write_binary(b"x" * 1000)
+    os.utime(str(index), (0, 0))
+    template = tmpdir.ensure("templates", "__jinja2_x.cache")
+    template.write_binary(b"x" * 1000)
+    os.utime(str(template), (0, 0))
+
+    cache = Cache(str(tmpdir), max_size=150)
+    cache.put_package_json("a", b"x" * 100)
+    cache.put_package_json("b", b"x" * 100)
+
+    assert index.check() and template.check()
+    assert cache.get_package_json("a") is None
+
+
+def test_cache_evict_keeps_downloads_in_progress(tmpdir):
+    cache = Cache(str(tmpdir), max_size=150)
+    downloading = cache.temporary_sdist_filename("a" * 64, "a-1.0.tar.gz")
+    with open(downloading, "wb") as f:
+        f.write(b"x" * 100)
+    os.utime(downloading, (time.time() - 1, time.time() - 1))
+    stale = cache.temporary_sdist_filename("b" * 64, "b-1.0.tar.gz")
+    with open(stale, "wb") as f:
+        f.write(b"x" * 100)
+    os.utime(stale, (0, 0))
+
+    cache.put_package_json("c", b"x" * 100)
+    assert os.path.isfile(downloading)
+    assert not os.path.exists(stale)
+
+
+def test_cache_metadata(tmpdir):
+    cache = Cache(str(tmpdir))
+    assert cache.get_metadata("Flask", "1.0", "0" * 64, "key") is None
+
+    cache.put_metadata("Flask", "1.0", "0" * 64, "key", {"pname": "flask"})
+    assert cache.get_metadata("flask", "1.0", "0" * 64, "key") == {"pname": "flask"}
+    assert cache.get_metadata("flask", "1.0", "0" * 64, "other-key") is None
+    assert Cache(str(tmpdir), refresh=True).get_metadata("flask", "1.0", "0" * 64, "key") is None
+
+    cache.invalidate_metadata("Flask")
+    assert cache.get_metadata("flask", "1.0", "0" * 64, "key") is None
+
+
+def test_cache_package_json_to_metadata(tmpdir, monkeypatch):
+    from nixpkgs_pytools import python_package_init
+    from nixpkgs_pytools.cache import set_default_cache
+
+    package_json = {
+        "info": {
+            "name": "six",
+            "version": "1.0",
+            "requires_python": None,
+            "license": "MIT",
+            "summary": "six",
+            "home_page": "",
+        },
+        "releases": {
+            "1.0": [{
+                "packagetype": "sdist",
+                "digests": {"sha256": "0" * 64},
+                "url": "https://example.org/six-1.0.tar.gz",
+                "filename": "six-1.0.tar.gz",
+            }],
+        },
+    }
+    determine_package_dependencies = mock.Mock(return_value={
+        "buildInputs": [], "checkInputs": [], "propagatedBuildInputs": [],
+    })
+    monkeypatch.setattr(python_package_init, "determine_package_dependencies", determine_package_dependencies)
+    monkeypatch.setattr(python_package_init, "get_probe_homepages", lambda: False)
+    set_default_cache(Cache(str(tmpdir)))
+    try:
+        metadata = python_package_init.package_json_to_metadata(package_json, "six", None)
+        assert python_package_init.package_json_to_metadata(package_json, "six", None) == metadata
+        assert determine_package_dependencies.call_count == 1
+    finally:
+        set_default_cache(None)
+
+
+def test_cache_release_json_is_immutable(tmpdir):
+    cache = Cache(str(tmpdir), max_age=0)
+    cache.put_release_json("Six", "1.0", b'{"info": {"version": "1.0"}, "urls": []}')
+
+    client = mock.Mock()
+    assert download_package_json("six", cache, client, version="1.0") == {
+        "info": {"version": "1.0"}, "releases": {"1.0": []}
+    }
+    assert not client.get.called
+
+
+def test_cache_changelog_serial(tmpdir):
+    cache = Cache(str(tmpdir))
+    assert cache.get_changelog_serial("sweep") is None
+    cache.put_changelog_serial("sweep", 42, {"six", "attrs"})
+    assert cache.get_changelog_serial("sweep") == {"serial": 42, "pending": ["attrs", "six"]}
@@ -0,0 +1,51 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from nixpkgs_pytools.closure import ClosurePackage, resolve_closure, topological_order
+
+
+GRAPH = {
+    "app": ["requests", "six", "Flask"],
+    "requests": ["urllib3", "idna"],
+    "flask": ["click", "six"],
+    "click": [],
+    "urllib3": ["app"],
+    "idna": [],
+}
+
+
+def package_json_to_metadata(package_json, package_name, version):
+    if package_name == "idna":
+        raise ValueError("no source distribution (sdist) found")
+    return {
+        "version": version or "1.0",
+        "buildInputs": [],
+        "propagatedBuildInputs": GRAPH[package_name.lower()],
+    }
+
+
+def test_resolve_closure():
+    with mock.patch("nixpkgs_pytools.closure.download_package_json"):
+        closure = resolve_closure(
+            [("app", "2.0")], package_json_to_metadata, lambda name: name in {"six", "click"}, jobs=3
+        )
+
+    names = [package.package_name for package in closure]
+    assert sorted(names) == ["app", "flask", "idna", "requests", "urllib3"]
+    # dependencies come first except for the app <-> urllib3 cycle
+    assert names.index("flask") < names.index("app")
+    assert names.index("idna") < names.index("requests")
+    packages = {package.package_name: package for package in closure}
+    assert packages["app"].version == "2.0"
+    assert packages["app"].dependencies == ["requests", "flask"]
+    assert packages["idna"].error == "no source distribution (sdist) found"
+
+
+def test_topological_order():
+    def package(*dependencies):
+        return ClosurePackage(None, None, None, list(dependencies), None)
+
+    packages = {"a": package("b", "c"), "b": package("c"), "c": package(), "d": package("e"), "e": package("d")}
+    assert topological_order(["a", "b", "c", "d", "e"], packages) == ["c", "b", "a", "d", "e"]
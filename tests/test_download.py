@@ -0,0 +1,85 @@
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+from nixpkgs_pytools.download import extract_package, stream_to_file
+
+
+SDIST_FILES = {
+    "example-1.0/setup.py": b"from setuptools import setup\nsetup()\n",
+    "example-1.0/README.rst": b"example\n",
+    "example-1.0/PKG-INFO": b"Metadata-Version: 2.1\n",
+    "example-1.0/example/__init__.py": b"",
+    "example-1.0/example.egg-info/requires.txt": b"six\n",
+    "example-1.0/example/data/large.bin": b"\0" * 1024,
+}
+
+
+def write_tar(filename, files):
+    with tarfile.open(filename, "w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+
+def extracted_files(directory):
+    return {
+        os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, "/")
+        for root, _, filenames in os.walk(directory)
+        for filename in filenames
+    }
+
+
+@pytest.mark.parametrize("extension", ["tar.gz", "zip"])
+def test_extract_package(tmpdir, extension):
+    filename = str(tmpdir.join("example-1.0." + extension))
+    if extension == "zip":
+        with zipfile.ZipFile(filename, "w") as archive:
+            for name, content in SDIST_FILES.items():
+                archive.writestr(name, content)
+    else:
+        write_tar(filename, SDIST_FILES)
+
+    directory = str(tmpdir.mkdir("extracted"))
+    assert extract_package(filename, directory) == "example-1.0"
+    assert extracted_files(directory) == set(SDIST_FILES) - {"example-1.0/example/data/large.bin"}
+
+
+def test_extract_package_outside_archive(tmpdir):
+    filename = str(tmpdir.join("example-1.0.tar.gz"))
+    write_tar(filename, {"example-1.0/../../setup.py": b""})
+
+    with pytest.raises(ValueError):
+        extract_package(filename, str(tmpdir.mkdir("extracted")))
+
+
+def test_extract_package_size_limit(tmpdir):
+    filename = str(tmpdir.join("example-1.0.tar.gz"))
+    write_tar(filename, {"example-1.0/setup.py": b"#" * 1024})
+
+    with pytest.raises(ValueError):
+        extract_package(filename, str(tmpdir.mkdir("extracted")), max_extracted_size=1000)
+
+
+def test_stream_to_file_sha256(tmpdir):
+    client = mock.MagicMock()
+    response = client.get.return_value.__enter__.return_value
+    response.iter_content.return_value = [b"sd", b"ist"]
+    filename = str(tmpdir.join("example-1.0.tar.gz"))
+
+    sha256 = hashlib.sha256(b"sdist").hexdigest()
+    assert stream_to_file(client, "https://example.org/example-1.0.tar.gz", filename, sha256) == sha256
+    assert open(filename, "rb").read() == b"sdist"
+
+    with pytest.raises(ValueError):
+        stream_to_file(client, "https://example.org/example-1.0.tar.gz", filename, "0" * 64)
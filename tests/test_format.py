@@ -0,0 +1,56 @@
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from nixpkgs_pytools import format
+from nixpkgs_pytools.cache import Cache
+from nixpkgs_pytools.format import format_homepage, format_homepage_async
+from nixpkgs_pytools.http_client import HTTPError
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mock.Mock()
+    monkeypatch.setattr(format, "get_default_client", lambda: client)
+    monkeypatch.setattr(format, "_https_hosts", {})
+    return client
+
+
+def test_format_homepage(client):
+    assert format_homepage(None) == ""
+    assert format_homepage("UNKNOWN") == ""
+    assert format_homepage("https://example.org") == "https://example.org"
+
+    assert format_homepage("http://example.org/a") == "https://example.org/a"
+    client.head.assert_called_once_with("https://example.org/a", timeout=format.PROBE_TIMEOUT, retries=0)
+    # the host is only probed once
+    assert format_homepage("http://example.org/b") == "https://example.org/b"
+    assert client.head.call_count == 1
+
+    client.head.side_effect = HTTPError("https://example.com", 405)
+    assert format_homepage("http://example.com") == "https://example.com"
+
+    client.head.side_effect = OSError("connection refused")
+    assert format_homepage("http://example.net") == "http://example.net"
+
+
+def test_format_homepage_without_probe(client):
+    assert format_homepage("http://example.org", probe=False) == "https://example.org"
+    assert not client.head.called
+
+
+def test_format_homepage_cache(client, tmpdir, monkeypatch):
+    cache = Cache(str(tmpdir))
+    client.head.side_effect = OSError("connection refused")
+    assert format_homepage_async("http://example.org", cache=cache).result() == "http://example.org"
+
+    monkeypatch.setattr(format, "_https_hosts", {})
+    assert format_homepage("http://example.org/other", probe=False, cache=cache) == "http://example.org/other"
+    assert client.head.call_count == 1
+
+    monkeypatch.setattr(format, "HOMEPAGE_PROBE_TTL", 0)
+    client.head.side_effect = None
+    assert format_homepage("http://example.org", cache=cache) == "https://example.org"
@@ -0,0 +1,98 @@
+import pytest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import threading
+
+from nixpkgs_pytools.http_client import HostRewriteTransport, HTTPClient, HTTPError
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.server.connections.add(self.client_address)
+        if self.path == "/flaky" and self.server.paths.count("/flaky") == 1:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/pypi/six/json")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path in {"/pypi/six/json", "/flaky"}:
+            body = b'{"info": {"name": "six"}}'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.paths = []
+    server.connections = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def local_client(server, **kwargs):
+    transport = HostRewriteTransport(
+        {"https://pypi.org": "http://127.0.0.1:{port}".format(port=server.server_port)}
+    )
+    return HTTPClient(transport=transport, backoff_factor=0, **kwargs)
+
+
+def test_client_keep_alive(server):
+    client = local_client(server)
+    for _ in range(3):
+        assert client.get("https://pypi.org/pypi/six/json").read() == b'{"info": {"name": "six"}}'
+    assert len(server.connections) == 1
+
+
+def test_client_retry(server):
+    client = local_client(server)
+    assert client.get("https://pypi.org/flaky").status == 200
+    assert server.paths == ["/flaky", "/flaky"]
+
+
+def test_client_no_retry(server):
+    client = local_client(server, retries=0)
+    with pytest.raises(HTTPError) as e:
+        client.get("https://pypi.org/flaky")
+    assert e.value.code == 503
+
+
+def test_client_redirect(server):
+    client = local_client(server)
+    response = client.get("https://pypi.org/redirect")
+    assert response.read() == b'{"info": {"name": "six"}}'
+    assert server.paths == ["/redirect", "/pypi/six/json"]
+
+
+def test_client_not_found(server):
+    client = local_client(server)
+    with pytest.raises(HTTPError) as e:
+        client.get("https://pypi.org/pypi/doesnotexist/json")
+    assert e.value.code == 404
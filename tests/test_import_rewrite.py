@@ -42,20 +42,196 @@ def baz():
 dontchange.numpy.asdf = 2
 '''
 
+import ast
 import os
+import sys
 import tempfile
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import pytest
 
-from nixpkgs_pytools.import_rewrite import rename_modules
+from nixpkgs_pytools import import_rewrite
+from nixpkgs_pytools.cache import Cache
+from nixpkgs_pytools.import_rewrite import rename_modules, rewrite_modules, rewrite_source
 
 
-def test_module_rewrite(tmpdir):
+@pytest.mark.parametrize('engine', ['rope', 'ast'])
+def test_module_rewrite(tmpdir, engine):
     filename = str(tmpdir.join('example.py'))
 
     with open(filename, 'w') as f:
         f.write(SOURCE)
 
-    rename_modules(str(tmpdir), [('numpy', 'mynumpy')])
+    rename_modules(str(tmpdir), [('numpy', 'mynumpy')], engine=engine)
 
     assert open(filename).read() == EXPECTED_SOURCE
+
+
+@pytest.mark.parametrize('engine', ['rope', 'ast'])
+def test_module_rewrite_parallel(tmpdir, engine):
+    for name in ['a.py', 'b.py', 'sub/c.py']:
+        tmpdir.ensure(name).write(SOURCE + 'import scipy\nscipy.stats\n')
+    untouched = tmpdir.join('untouched.py')
+    untouched.write('import os\n')
+    os.utime(str(untouched), (0, 0))
+    sys_path = list(sys.path)
+
+    changed = rename_modules(str(tmpdir), [('numpy', 'mynumpy'), ('scipy', 'myscipy')], jobs=2, engine=engine)
+
+    assert changed == ['a.py', 'b.py', os.path.join('sub', 'c.py')]
+    for name in ['a.py', 'b.py', 'sub/c.py']:
+        assert tmpdir.join(name).read() == EXPECTED_SOURCE + 'import myscipy\nmyscipy.stats\n'
+    assert os.stat(str(untouched)).st_mtime == 0
+    assert sys.path == sys_path
+
+
+def test_rewrite_source_scopes():
+    source = (
+        'import os, numpy.random as nr\n'
+        'from numpy import (array,  # comment\n'
+        '    zeros)\n'
+        'from numpy.linalg import norm\n'
+        'from . import numpy as relative\n'
+        'import numpy\n'
+        'class A(numpy.ndarray):\n'
+        '    numpy = 1\n'
+        '    def f(self, a=numpy):\n'
+        '        return numpy.ones(a)\n'
+        'squares = [numpy for numpy in range(3)] + [numpy.e]\n'
+        'identity = lambda numpy: numpy\n'
+        'def g():\n'
+        '    def h():\n'
+        '        nonlocal numpy\n'
+        '        return numpy\n'
+        '    numpy = 2\n'
+        'print(numpy  .  linalg, "numpy")  # numpy\n'
+    )
+    assert rewrite_source(source, [('numpy', 'np2')]) == (
+        'import os, np2.random as nr\n'
+        'from np2 import (array,  # comment\n'
+        '    zeros)\n'
+        'from np2.linalg import norm\n'
+        'from . import numpy as relative\n'
+        'import np2\n'
+        'class A(np2.ndarray):\n'
+        '    numpy = 1\n'
+        '    def f(self, a=numpy):\n'
+        '        return np2.ones(a)\n'
+        'squares = [numpy for numpy in range(3)] + [np2.e]\n'
+        'identity = lambda numpy: numpy\n'
+        'def g():\n'
+        '    def h():\n'
+        '        nonlocal numpy\n'
+        '        return numpy\n'
+        '    numpy = 2\n'
+        'print(np2  .  linalg, "numpy")  # numpy\n'
+    )
+
+
+def test_rewrite_source_dotted_module():
+    source = 'import a.b.c as e\nfrom a.b import d\nimport a.bc\n'
+    assert rewrite_source(source, [('a.b', 'x.y')]) == 'import x.y.c as e\nfrom x.y import d\nimport a.bc\n'
+
+    # `import a.b` binds `a`, renaming the statement would leave `a.b.f` unbound
+    for source in ['import a.b\na.b.f()\n', 'import os, a.b.c\n']:
+        with pytest.raises(ValueError):
+            rewrite_source(source, [('a.b', 'c')])
+
+
+def test_rewrite_modules_dotted_module_fails(tmpdir):
+    tmpdir.ensure('example.py').write('import a.b\na.b.f()\n')
+
+    with pytest.raises(ValueError, match='example.py'):
+        rename_modules(str(tmpdir), [('a.b', 'c')], jobs=1, engine='ast')
+
+    assert tmpdir.join('example.py').read() == 'import a.b\na.b.f()\n'
+
+
+def test_rewrite_source_without_end_positions():
+    # python 3.7 has no end positions on nodes
+    parse = ast.parse
+
+    def parse_without_end_positions(*args, **kwargs):
+        tree = parse(*args, **kwargs)
+        for node in ast.walk(tree):
+            for attribute in ('end_lineno', 'end_col_offset'):
+                if hasattr(node, attribute):
+                    delattr(node, attribute)
+        return tree
+
+    source = (
+        'if x: import a; a.y\n'
+        'from a import (b,  # a\n'
+        '    c); import a as d\n'
+        'import \\\n    a.e\n'
+        'def f():\n'
+        '    global a\n'
+        '    a = 1\n'
+        'import a'
+    )
+    with mock.patch('ast.parse', parse_without_end_positions):
+        assert rewrite_source(source, [('a', 'z')]) == (
+            'if x: import z; z.y\n'
+            'from z import (b,  # a\n'
+            '    c); import z as d\n'
+            'import \\\n    z.e\n'
+            'def f():\n'
+            '    global z\n'
+            '    z = 1\n'
+            'import z'
+        )
+
+
+def test_rewrite_file_keeps_encoding(tmpdir):
+    filename = tmpdir.join('latin.py')
+    filename.write_binary(u'# -*- coding: latin-1 -*-\r\nimport numpy\r\nx = "\xe9"; numpy.x\r\n'.encode('latin-1'))
+
+    rename_modules(str(tmpdir), [('numpy', 'mynumpy')], engine='ast')
+
+    assert filename.read_binary() == u'# -*- coding: latin-1 -*-\r\nimport mynumpy\r\nx = "\xe9"; mynumpy.x\r\n'.encode('latin-1')
+
+
+@pytest.mark.parametrize('engine', ['rope', 'ast'])
+def test_module_rewrite_cache(tmpdir, engine):
+    project = tmpdir.mkdir('project')
+    filename = project.join('example.py')
+    filename.write(SOURCE)
+    project.join('other.py').write('import os\n')
+    cache = Cache(str(tmpdir.join('cache')))
+
+    results = list(rewrite_modules(str(project), [('numpy', 'mynumpy')], engine=engine, cache=cache, dry_run=True))
+    assert [(result.path, result.content.decode()) for result in results] == [('example.py', EXPECTED_SOURCE)]
+    assert filename.read() == SOURCE
+
+    assert rename_modules(str(project), [('numpy', 'mynumpy')], engine=engine, cache=cache) == ['example.py']
+    assert filename.read() == EXPECTED_SOURCE
+
+    # unchanged files are not read again
+    with mock.patch('nixpkgs_pytools.import_rewrite.open', side_effect=AssertionError, create=True):
+        assert rename_modules(str(project), [('numpy', 'mynumpy')], engine=engine, cache=cache) == []
+
+    # the same content is rewritten from the cache
+    filename.write(SOURCE)
+    with mock.patch('nixpkgs_pytools.import_rewrite._rewrite_path') as rewrite_path, \
+            mock.patch('nixpkgs_pytools.import_rewrite.rename_files') as rename_files:
+        assert rename_modules(str(project), [('numpy', 'mynumpy')], engine=engine, cache=cache) == ['example.py']
+    assert not rewrite_path.called and not rename_files.called
+    assert filename.read() == EXPECTED_SOURCE
+
+
+def test_main_without_writable_home(tmpdir, monkeypatch):
+    # nix builds run the rewriter with HOME=/homeless-shelter
+    monkeypatch.setenv('HOME', '/dev/null')
+    monkeypatch.delenv('XDG_CACHE_HOME', raising=False)
+    tmpdir.ensure('example.py').write('import numpy\n')
+    monkeypatch.setattr(sys, 'argv', [
+        'python-rewrite-imports', '--path', str(tmpdir), '--replace', 'numpy', 'mynumpy', '--engine', 'ast', '-j', '1',
+    ])
+
+    import_rewrite.main()
+
+    assert tmpdir.join('example.py').read() == 'import mynumpy\n'
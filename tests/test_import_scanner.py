@@ -0,0 +1,136 @@
+import os
+import textwrap
+
+from nixpkgs_pytools import dependency
+from nixpkgs_pytools import import_scanner
+from nixpkgs_pytools.cache import Cache
+from nixpkgs_pytools.dependency import (
+    determine_dependencies_from_directory,
+    determine_dependencies_from_python_ast,
+)
+from nixpkgs_pytools.import_scanner import parse_imports, scan_imports
+
+
+def write_files(tmpdir, files):
+    for filename, content in files.items():
+        tmpdir.ensure(filename).write(textwrap.dedent(content))
+    return str(tmpdir)
+
+
+def test_parse_imports():
+    source = textwrap.dedent("""
+        import os.path, six
+        from . import utils
+        from .models import Model
+        from requests.adapters import HTTPAdapter
+
+        try:
+            import simplejson as json
+        except ImportError:
+            import json
+
+        if TYPE_CHECKING:
+            import numpy
+    """).encode()
+
+    assert parse_imports(source) == {
+        "imports": ["json", "os", "requests", "six"],
+        "optional": ["numpy", "simplejson"],
+    }
+
+
+def test_parse_imports_python2_fallback():
+    source = b"import urllib2\nfrom yaml import load\nprint 'hello'\n"
+    assert parse_imports(source) == {"imports": ["urllib2", "yaml"], "optional": []}
+
+
+def test_scan_imports_cached(tmpdir, monkeypatch):
+    directory = write_files(tmpdir.mkdir("package"), {
+        "example/__init__.py": "import six\n",
+        "example/core.py": "import six\n",
+    })
+    cache = Cache(str(tmpdir.join("cache")))
+
+    expected = {
+        "example/__init__.py": {"imports": ["six"], "optional": []},
+        "example/core.py": {"imports": ["six"], "optional": []},
+    }
+    assert scan_imports(directory, cache=cache) == expected
+
+    def parse_imports(source):
+        raise AssertionError("cached files are not parsed")
+
+    monkeypatch.setattr(import_scanner, "parse_imports", parse_imports)
+    assert scan_imports(directory, cache=cache) == expected
+
+
+def test_scan_imports_parallel(tmpdir, monkeypatch):
+    monkeypatch.setattr(import_scanner, "PARALLEL_THRESHOLD", 2)
+    directory = write_files(tmpdir, {
+        "a.py": "import six\n",
+        "b.py": "import attr\n",
+        "c.py": "x = 1\n",
+    })
+    imports = scan_imports(directory, workers=2)
+    assert imports["a.py"]["imports"] == ["six"]
+    assert imports["b.py"]["imports"] == ["attr"]
+    assert imports["c.py"]["imports"] == []
+
+
+def test_dependencies_from_python_ast(tmpdir):
+    directory = write_files(tmpdir, {
+        "setup.py": "from setuptools import setup\nimport setuptools_scm\n",
+        "example/__init__.py": "import os\nimport yaml\nfrom example import core\n",
+        "example/core.py": "try:\n    import ujson\nexcept ImportError:\n    ujson = None\n",
+        "tests/test_core.py": "import pytest\nimport yaml\nimport example\n",
+        "docs/conf.py": "import sphinx_rtd_theme\n",
+    })
+
+    assert determine_dependencies_from_python_ast(directory) == {
+        "extraInputs": ["sphinx_rtd_theme # optional", "ujson # optional"],
+        "buildInputs": ["setuptools", "setuptools_scm"],
+        "checkInputs": ["pytest"],
+        "propagatedBuildInputs": ["PyYAML"],
+    }
+
+
+def test_imports_scanned_after_mocking_setup(tmpdir, monkeypatch):
+    monkeypatch.setattr(dependency, "_scan_imports", True)
+    setup_py = (
+        "from setuptools import setup\n"
+        "import os\n"
+        "setup(install_requires=os.environ.get('REQUIRES', 'six').split())\n"
+    )
+    directory = write_files(tmpdir.mkdir("mocked"), {"setup.py": setup_py, "example.py": "import yaml\n"})
+    source, dependencies = determine_dependencies_from_directory(directory)
+    assert source == "setup.py (mocked)"
+    assert dependencies["propagatedBuildInputs"] == ["six"]
+
+    directory = write_files(tmpdir.mkdir("failing"), {
+        "setup.py": "raise RuntimeError('cannot build')\n" + setup_py,
+        "example.py": "import yaml\n",
+    })
+    source, dependencies = determine_dependencies_from_directory(directory)
+    assert source == "imports"
+    assert dependencies["propagatedBuildInputs"] == ["PyYAML"]
+
+
+def test_local_modules(tmpdir):
+    directory = write_files(tmpdir, {
+        "setup.py": "",
+        "src/example/__init__.py": "",
+        "src/example/backends/__init__.py": "",
+        "src/example/backends/redis.py": "import redis\n",
+        "tests/helpers.py": "",
+        "tests/test_redis.py": "import helpers\n",
+    })
+
+    assert import_scanner.local_modules(directory, [
+        "setup.py",
+        os.path.join("src", "example", "__init__.py"),
+        os.path.join("src", "example", "backends", "__init__.py"),
+        os.path.join("src", "example", "backends", "redis.py"),
+        os.path.join("tests", "helpers.py"),
+        os.path.join("tests", "test_redis.py"),
+    ]) == {"setup", "example", "tests", "helpers", "test_redis"}
+    assert determine_dependencies_from_python_ast(directory)["propagatedBuildInputs"] == ["redis"]
@@ -0,0 +1,41 @@
+import pytest
+
+from nixpkgs_pytools.license import classify_license, fuzzy_match, spdx_expression_licenses
+
+
+@pytest.mark.parametrize(
+    "info, license, source",
+    [
+        ({"license_expression": "MIT", "license": "BSD"}, "mit", "license_expression"),
+        ({"license_expression": "(MIT OR Apache-2.0) AND BSD-3-Clause"}, ["mit", "asl20", "bsd3"], "license_expression"),
+        ({"license_expression": "Apache-2.0 WITH LLVM-exception"}, "asl20", "license_expression"),
+        ({"classifiers": ["License :: OSI Approved :: MIT License"], "license": "GPL"}, "mit", "classifiers"),
+        ({"classifiers": ["License :: OSI Approved :: BSD License"], "license": "BSD 3-Clause"}, "bsd3", "license"),
+        ({"license": "Apache License, Version 2.0"}, "asl20", "license"),
+        ({"license": "GPL-2.0+"}, "gpl2Plus", "license"),
+        ({"license": "MIT License\n\nCopyright (c) 2019 ..."}, "mit", "license"),
+    ],
+)
+def test_classify_license(info, license, source):
+    match = classify_license(info)
+    assert (match.license, match.source) == (license, source)
+
+
+def test_classify_unknown_license():
+    assert classify_license({"license": "UNKNOWN"}) is None
+    assert classify_license({"license": "Proprietary"}) is None
+    assert classify_license({}) is None
+
+
+def test_fuzzy_match():
+    license, score = fuzzy_match("Mozilla Public License, v. 2.0")
+    assert license == "mpl20" and score == 1.0
+    # version numbers have to agree
+    assert fuzzy_match("GNU GPL v3")[0] == "gpl3Only"
+    match = classify_license({"license": "GNU GPL v3"})
+    assert match.confidence < 0.8
+
+
+def test_spdx_expression_licenses():
+    assert spdx_expression_licenses("not a license") is None
+    assert spdx_expression_licenses("LGPL-2.1+") == ["lgpl21Plus"]
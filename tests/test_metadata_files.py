@@ -0,0 +1,171 @@
+import pytest
+
+import textwrap
+
+from nixpkgs_pytools import metadata_files
+from nixpkgs_pytools.dependency import determine_dependencies_from_directory
+from nixpkgs_pytools.metadata_files import (
+    determine_dependencies_from_pkg_info,
+    determine_dependencies_from_pyproject,
+    determine_dependencies_from_setup_cfg,
+    poetry_requirement,
+)
+
+requires_toml = pytest.mark.skipif(metadata_files.toml is None, reason="requires tomllib or tomli")
+
+
+def write_files(tmpdir, files):
+    for filename, content in files.items():
+        tmpdir.ensure(filename).write(textwrap.dedent(content))
+    return str(tmpdir)
+
+
+@requires_toml
+def test_pyproject_pep621(tmpdir):
+    directory = write_files(tmpdir, {"pyproject.toml": """
+        [build-system]
+        requires = ["setuptools>=61", "wheel", "setuptools_scm[toml]"]
+
+        [project]
+        name = "example"
+        dependencies = ["six", "click>=7.0"]
+
+        [project.optional-dependencies]
+        test = ["pytest"]
+        yaml = ["pyyaml"]
+    """})
+
+    assert determine_dependencies_from_pyproject(directory) == {
+        "extraInputs": ["pyyaml # yaml"],
+        "buildInputs": ["setuptools_scm[toml]"],
+        "checkInputs": ["pytest"],
+        "propagatedBuildInputs": ["six", "click>=7.0"],
+    }
+
+
+@requires_toml
+def test_pyproject_poetry(tmpdir):
+    directory = write_files(tmpdir, {"pyproject.toml": """
+        [build-system]
+        requires = ["poetry-core"]
+
+        [tool.poetry.dependencies]
+        python = "^3.7"
+        requests = "^2.21"
+        attrs = "~19.3.0"
+        pyyaml = {version = "*", optional = true}
+
+        [tool.poetry.dev-dependencies]
+        pytest = "5.4.1"
+
+        [tool.poetry.extras]
+        yaml = ["pyyaml"]
+    """})
+
+    assert determine_dependencies_from_pyproject(directory) == {
+        "extraInputs": ["pyyaml # yaml"],
+        "buildInputs": ["poetry-core"],
+        "checkInputs": ["pytest==5.4.1"],
+        "propagatedBuildInputs": ["requests>=2.21,<3", "attrs>=19.3.0,<19.4"],
+    }
+
+
+@requires_toml
+def test_pyproject_dynamic_dependencies(tmpdir):
+    directory = write_files(tmpdir, {"pyproject.toml": """
+        [project]
+        name = "example"
+        dynamic = ["dependencies"]
+    """})
+    assert determine_dependencies_from_pyproject(directory) is None
+
+
+@pytest.mark.parametrize(
+    "constraint, requirement",
+    [
+        ("*", "example"),
+        ("^1.2.3", "example>=1.2.3,<2"),
+        ("^0.2.3", "example>=0.2.3,<0.3"),
+        ("~1.2", "example>=1.2,<1.3"),
+        (">=1.0, <2.0", "example>=1.0,<2.0"),
+        ({"version": "1.0", "optional": True}, "example==1.0"),
+    ],
+)
+def test_poetry_requirement(constraint, requirement):
+    assert poetry_requirement("example", constraint) == requirement
+
+
+def test_setup_cfg(tmpdir):
+    directory = write_files(tmpdir, {
+        "setup.cfg": """
+            [metadata]
+            name = example
+
+            [options]
+            install_requires =
+                six
+                requests>=2.0  # http
+            tests_require = file: requirements-test.txt
+
+            [options.extras_require]
+            docs = sphinx
+            testing = hypothesis
+        """,
+        "requirements-test.txt": "pytest\nmock\n",
+    })
+
+    assert determine_dependencies_from_setup_cfg(directory) == {
+        "extraInputs": ["sphinx # docs"],
+        "buildInputs": [],
+        "checkInputs": ["pytest", "mock", "hypothesis"],
+        "propagatedBuildInputs": ["six", "requests>=2.0"],
+    }
+
+
+def test_egg_info_requires_txt(tmpdir):
+    directory = write_files(tmpdir, {
+        "PKG-INFO": "Metadata-Version: 2.1\nName: example\n",
+        "example.egg-info/requires.txt": """
+            six
+
+            [:python_version < "3"]
+            futures
+
+            [yaml]
+            pyyaml
+
+            [test]
+            pytest
+        """,
+    })
+
+    assert determine_dependencies_from_pkg_info(directory) == {
+        "extraInputs": ["pyyaml # yaml"],
+        "buildInputs": [],
+        "checkInputs": ["pytest"],
+        "propagatedBuildInputs": ["six", 'futures; python_version < "3"'],
+    }
+
+
+def test_pyproject_without_toml_parser(tmpdir, monkeypatch, caplog):
+    directory = write_files(tmpdir, {"pyproject.toml": "[project]\ndependencies = ['six']\n"})
+    monkeypatch.setattr(metadata_files, "toml", None)
+
+    assert determine_dependencies_from_pyproject(directory) is None
+    assert "install tomli" in caplog.text
+
+
+def test_pkg_info_without_requires_dist(tmpdir):
+    directory = write_files(tmpdir, {"PKG-INFO": "Metadata-Version: 2.1\nName: example\n"})
+    assert determine_dependencies_from_pkg_info(directory) is None
+
+
+def test_dependency_source_order(tmpdir):
+    directory = write_files(tmpdir, {
+        "setup.cfg": "[options]\ninstall_requires = six\n",
+        "setup.py": "from setuptools import setup\nsetup(install_requires=['attrs'])\n",
+    })
+
+    source, dependencies = determine_dependencies_from_directory(directory)
+    assert source == "setup.cfg"
+    assert dependencies["propagatedBuildInputs"] == ["six"]
@@ -0,0 +1,123 @@
+import pytest
+
+import os
+import textwrap
+
+from nixpkgs_pytools import nixpkgs_index
+from nixpkgs_pytools import python_package_init
+from nixpkgs_pytools.output import write_nixpkgs_package
+from nixpkgs_pytools.dependency import sanitize_dependencies
+from nixpkgs_pytools.nixpkgs_index import NixpkgsIndex, parse_derivation
+
+
+PYTHON_PACKAGES_NIX = textwrap.dedent("""\
+    self: super: with self; {
+
+      pyyaml = callPackage ../development/python-modules/pyyaml { };
+
+      Flask = callPackage ../development/python-modules/flask { };
+
+      pytorch = callPackage ../development/python-modules/pytorch { };
+
+    }
+""")
+
+PYTHON_ALIASES_NIX = textwrap.dedent("""\
+    self: super: {
+      torch = pytorch;
+      missing = nonexistent;
+    }
+""")
+
+
+def derivation(pname, version):
+    return 'buildPythonPackage rec {{\n  pname = "{pname}";\n  version = "{version}";\n}}\n'.format(pname=pname, version=version)
+
+
+@pytest.fixture
+def nixpkgs_root(tmpdir):
+    nixpkgs_root = tmpdir.mkdir("nixpkgs")
+    nixpkgs_root.ensure("pkgs", "top-level", "python-packages.nix").write(PYTHON_PACKAGES_NIX)
+    nixpkgs_root.ensure("pkgs", "top-level", "python-aliases.nix").write(PYTHON_ALIASES_NIX)
+    python_modules = nixpkgs_root.ensure("pkgs", "development", "python-modules", dir=True)
+    python_modules.ensure("pyyaml", "default.nix").write(derivation("PyYAML", "5.1.2"))
+    python_modules.ensure("flask", "default.nix").write(derivation("Flask", "1.1.1"))
+    python_modules.ensure("pytorch", "default.nix").write(derivation("${name}", "1.2.0"))
+    return nixpkgs_root
+
+
+def test_parse_derivation():
+    assert parse_derivation(derivation("PyYAML", "5.1.2")) == ("PyYAML", "5.1.2")
+    assert parse_derivation('pname = "a${b}";') == (None, None)
+
+
+def test_lookup(nixpkgs_root, tmpdir):
+    index = NixpkgsIndex(str(nixpkgs_root), str(tmpdir.join("cache")))
+    assert index.lookup("PyYAML") == ("pyyaml", "5.1.2")
+    assert index.lookup("flask") == ("Flask", "1.1.1")
+    assert index.lookup("torch") == ("pytorch", "1.2.0")
+    assert index.lookup("missing") is None
+    assert "requests" not in index
+    assert len(index) == 4
+
+
+def test_incremental_refresh(nixpkgs_root, tmpdir, monkeypatch):
+    cache_directory = str(tmpdir.join("cache"))
+    NixpkgsIndex(str(nixpkgs_root), cache_directory).refresh()
+
+    parsed = []
+
+    def parse_derivation(content):
+        parsed.append(content)
+        return nixpkgs_index.PNAME_REGEX.search(content).group(1), "5.2"
+
+    monkeypatch.setattr(nixpkgs_index, "parse_derivation", parse_derivation)
+    pyyaml = nixpkgs_root.join("pkgs", "development", "python-modules", "pyyaml", "default.nix")
+    pyyaml.write(derivation("PyYAML", "5.2"))
+    os.utime(str(pyyaml), (0, 0))
+
+    index = NixpkgsIndex(str(nixpkgs_root), cache_directory)
+    assert index.lookup("pyyaml") == ("pyyaml", "5.2")
+    assert index.lookup("flask") == ("Flask", "1.1.1")
+    assert len(parsed) == 1
+
+
+def test_fingerprint(nixpkgs_root, tmpdir, monkeypatch):
+    cache_directory = str(tmpdir.join("cache"))
+    fingerprint = NixpkgsIndex(str(nixpkgs_root), cache_directory).fingerprint()
+    assert NixpkgsIndex(str(nixpkgs_root), cache_directory).fingerprint() == fingerprint
+
+    nixpkgs_root.join("pkgs", "top-level", "python-aliases.nix").write(PYTHON_ALIASES_NIX.replace("torch", "torch2"))
+    index = NixpkgsIndex(str(nixpkgs_root), cache_directory)
+    assert index.fingerprint() != fingerprint
+
+    # the metadata of packages is cached per index state
+    monkeypatch.setattr(python_package_init, "get_default_nixpkgs_index", lambda: index)
+    key = python_package_init.metadata_cache_key()
+    nixpkgs_root.join("pkgs", "development", "python-modules", "flask", "default.nix").write(derivation("Flask", "2.0"))
+    index.refresh()
+    assert python_package_init.metadata_cache_key() != key
+
+
+def test_refresh_after_write(nixpkgs_root, monkeypatch):
+    for filename in ("default.nix", "README.md", "doc/", "lib/", "maintainers/", "nixos/"):
+        nixpkgs_root.ensure(filename.rstrip("/"), dir=filename.endswith("/"))
+    index = NixpkgsIndex(str(nixpkgs_root))
+    monkeypatch.setattr(nixpkgs_index, "_default_index", index)
+    fingerprint = index.fingerprint()
+    assert index.lookup("requests") is None
+
+    write_nixpkgs_package(derivation("requests", "2.22.0"), "requests", str(nixpkgs_root))
+    assert index.lookup("requests") == ("requests", "2.22.0")
+    assert index.fingerprint() != fingerprint
+
+
+def test_sanitize_dependencies(nixpkgs_root, monkeypatch):
+    monkeypatch.setattr(nixpkgs_index, "_default_index", NixpkgsIndex(str(nixpkgs_root)))
+    dependencies = sanitize_dependencies({
+        "extraInputs": [],
+        "buildInputs": [],
+        "checkInputs": [],
+        "propagatedBuildInputs": ["torch>=1.0", "requests"],
+    })
+    assert dependencies["propagatedBuildInputs"] == ["pytorch", "requests"]
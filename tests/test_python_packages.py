@@ -0,0 +1,151 @@
+import pytest
+
+import os
+import stat
+import textwrap
+
+from nixpkgs_pytools import utils
+from nixpkgs_pytools import python_packages
+from nixpkgs_pytools import output
+from nixpkgs_pytools.output import NixpkgsTransaction, write_nixpkgs_package
+from nixpkgs_pytools.python_packages import PythonPackagesIndex, build_entries
+
+
+PYTHON_PACKAGES_NIX = textwrap.dedent("""\
+    { pkgs, stdenv, python }:
+
+    self: super: with self; {
+
+      buildPythonPackage = makeOverridablePythonPackage (callPackage ../development/interpreters/python/mk-python-derivation.nix {
+        inherit toPythonModule;
+      });
+
+      zzz-helper = null;
+
+      attrs = callPackage ../development/python-modules/attrs { };
+
+      flask = callPackage ../development/python-modules/flask { };
+
+      six = callPackage ../development/python-modules/six { };
+
+    }
+""")
+
+
+@pytest.fixture
+def filename(tmpdir):
+    filename = tmpdir.join("python-packages.nix")
+    filename.write(PYTHON_PACKAGES_NIX)
+    return str(filename)
+
+
+def test_insert(filename, tmpdir):
+    index = PythonPackagesIndex(filename, str(tmpdir.join("cache")))
+    assert "Flask" in index
+    assert "requests" not in index
+
+    assert index.insert(["requests", "Jinja2", "aaa", "zope.interface", "six", "requests"]) == [
+        "aaa", "jinja2", "requests", "zope-interface",
+    ]
+
+    with open(filename) as f:
+        content = f.read()
+    attributes = [line.split(" = ")[0].strip() for line in content.splitlines() if "python-modules" in line]
+    assert attributes == ["aaa", "attrs", "flask", "jinja2", "requests", "six", "zope-interface"]
+    # the table is updated in place instead of rebuilt
+    assert index._entries == build_entries(content.encode())
+
+
+def test_insert_keeps_file_mode(filename, tmpdir):
+    os.chmod(filename, 0o644)
+    PythonPackagesIndex(filename, str(tmpdir.join("cache"))).insert(["requests"])
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o644
+
+
+def test_persisted_index(filename, tmpdir, monkeypatch):
+    cache_directory = str(tmpdir.join("cache"))
+    PythonPackagesIndex(filename, cache_directory).insert(["requests"])
+
+    def build_entries(content):
+        raise AssertionError("persisted index is reused")
+
+    monkeypatch.setattr(python_packages, "build_entries", build_entries)
+    assert "requests" in PythonPackagesIndex(filename, cache_directory)
+
+    with open(filename, "a") as f:
+        f.write("\n")
+    with pytest.raises(AssertionError):
+        "requests" in PythonPackagesIndex(filename, cache_directory)
+
+
+@pytest.fixture
+def nixpkgs_root(tmpdir):
+    nixpkgs_root = tmpdir.mkdir("nixpkgs")
+    for name in ["default.nix", "README.md"]:
+        nixpkgs_root.ensure(name)
+    for name in ["doc", "lib", "maintainers", "nixos"]:
+        nixpkgs_root.ensure(name, dir=True)
+    nixpkgs_root.ensure("pkgs", "top-level", "python-packages.nix").write(PYTHON_PACKAGES_NIX)
+    nixpkgs_root.ensure("pkgs", "development", "python-modules", "six", "default.nix")
+    return nixpkgs_root
+
+
+def test_write_nixpkgs_package(nixpkgs_root):
+    write_nixpkgs_package("{ }", "requests", str(nixpkgs_root))
+    assert nixpkgs_root.join("pkgs", "development", "python-modules", "requests", "default.nix").read() == "{ }"
+    assert "  requests = callPackage ../development/python-modules/requests { };\n\n  six =" in \
+        nixpkgs_root.join("pkgs", "top-level", "python-packages.nix").read()
+
+    with pytest.raises(ValueError):
+        write_nixpkgs_package("{ }", "six", str(nixpkgs_root))
+
+
+def test_transaction(nixpkgs_root):
+    transaction = NixpkgsTransaction(str(nixpkgs_root))
+    transaction.add("{ }", "requests")
+    transaction.add("{ }", "aaa")
+    with pytest.raises(ValueError):
+        transaction.add("{ }", "six")
+    # nothing is written before commit
+    assert not nixpkgs_root.join("pkgs", "development", "python-modules", "aaa").check()
+
+    diff = transaction.commit()
+    assert "+++ b/pkgs/development/python-modules/aaa/default.nix" in diff
+    assert "+  requests = callPackage ../development/python-modules/requests { };" in diff
+    assert nixpkgs_root.join("pkgs", "development", "python-modules", "aaa", "default.nix").read() == "{ }"
+    assert "aaa" in output.get_python_packages_index(str(nixpkgs_root))
+
+
+def test_transaction_keeps_file_modes(nixpkgs_root):
+    python_packages_nix = nixpkgs_root.join("pkgs", "top-level", "python-packages.nix")
+    python_packages_nix.chmod(0o664)
+    transaction = NixpkgsTransaction(str(nixpkgs_root))
+    transaction.add("{ }", "requests")
+    transaction.commit()
+
+    # new files get the mode of files created with open
+    default_nix = nixpkgs_root.join("pkgs", "development", "python-modules", "requests", "default.nix")
+    assert stat.S_IMODE(python_packages_nix.stat().mode) == 0o664
+    assert stat.S_IMODE(default_nix.stat().mode) == 0o666 & ~utils.UMASK
+
+
+def test_transaction_rollback(nixpkgs_root, monkeypatch):
+    python_packages_nix = nixpkgs_root.join("pkgs", "top-level", "python-packages.nix")
+    transaction = NixpkgsTransaction(str(nixpkgs_root))
+    transaction.add("{ }", "requests")
+
+    # fail on renaming python-packages.nix, the last file committed
+    replace = output.os.replace
+
+    def failing_replace(source, destination):
+        if destination == str(python_packages_nix):
+            raise OSError("disk full")
+        replace(source, destination)
+
+    monkeypatch.setattr(output.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        transaction.commit()
+
+    assert python_packages_nix.read() == PYTHON_PACKAGES_NIX
+    assert not nixpkgs_root.join("pkgs", "development", "python-modules", "requests").check()
+    assert [f.basename for f in nixpkgs_root.join("pkgs", "top-level").listdir()] == ["python-packages.nix"]
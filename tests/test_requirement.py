@@ -0,0 +1,137 @@
+import pytest
+
+import sys
+
+from nixpkgs_pytools.dependency import sanitize_dependencies
+from nixpkgs_pytools.requirement import (
+    DEFAULT_PYTHON_VERSION,
+    InvalidRequirement,
+    compare_versions,
+    evaluate_marker,
+    marker_environment,
+    marker_extras,
+    parse_marker,
+    parse_requirement,
+    version_key,
+)
+
+
+@pytest.mark.parametrize(
+    "text, name, extras, specifier, url",
+    [
+        ("six", "six", (), None, None),
+        ("zope.interface >= 4.6.0", "zope-interface", (), ">=4.6.0", None),
+        ("requests[security, SOCKS] (>=2.0, <3)", "requests", ("security", "socks"), ">=2.0,<3", None),
+        ("pip @ https://example.com/pip.zip ; os_name == 'posix'", "pip", (), None, "https://example.com/pip.zip"),
+        ('futures; python_version < "3"', "futures", (), None, None),
+    ],
+)
+def test_parse_requirement(text, name, extras, specifier, url):
+    requirement = parse_requirement(text)
+    assert (requirement.name, requirement.extras, requirement.specifier, requirement.url) == (name, extras, specifier, url)
+
+
+def test_parse_invalid():
+    with pytest.raises(InvalidRequirement):
+        parse_requirement("-e .")
+    with pytest.raises(InvalidRequirement):
+        parse_requirement('six; python_version < "3" and')
+
+
+@pytest.mark.parametrize(
+    "marker, expected",
+    [
+        ('python_version < "3"', False),
+        ('python_version >= "3.6" and sys_platform == "linux"', True),
+        ('python_version == "3.7.*" or (os_name == "nt" and extra == "win")', True),
+        ('"linux" in sys_platform', True),
+        ('platform_system not in "Windows Darwin"', True),
+        ('python_full_version ~= "3.6"', True),
+        ('python_full_version ~= "3.6.1"', False),
+        ('python_version > "3.10"', False),
+        ('extra == "Test_Suite"', False),
+    ],
+)
+def test_evaluate_marker(marker, expected):
+    assert evaluate_marker(parse_marker(marker), marker_environment("3.7.4")) is expected
+
+
+def test_marker_extras():
+    assert marker_extras(parse_marker('python_version < "3" and extra == "Test_Suite"')) == ["test-suite"]
+    assert marker_extras(parse_marker('python_version < "3"')) == []
+
+
+def test_compare_versions():
+    assert compare_versions("3.10", ">", "3.9")
+    assert compare_versions("3.7", "==", "3.7.0")
+    assert not compare_versions("3.8", "~=", "3.7.1")
+    assert compare_versions("1.0", ">", "1.0rc2")
+    assert compare_versions("2.0b1", "<", "2.0")
+    assert compare_versions("1.0.post1", ">", "1.0")
+    assert compare_versions("2.0", "~=", "2.0rc1")
+
+
+def test_version_key():
+    versions = ["1.0.post1", "1!0.1", "1.0", "1.0rc2", "1.0a1", "1.0.dev1", "0.9", "1.0.post1.dev2", "1.0b2.post3"]
+    assert sorted(versions, key=version_key) == [
+        "0.9", "1.0.dev1", "1.0a1", "1.0b2.post3", "1.0rc2", "1.0", "1.0.post1.dev2", "1.0.post1", "1!0.1",
+    ]
+    assert version_key("1.0") == version_key("1.0.0") == version_key("v1.0+local")
+    assert version_key("1.0-1") == version_key("1.0.post1")
+    assert version_key("not a version") < version_key("0.1")
+
+
+def test_sanitize_dependencies():
+    dependencies = sanitize_dependencies({
+        "extraInputs": [],
+        "buildInputs": ["setuptools_scm>=1.0"],
+        "checkInputs": ["pytest", "pytest"],
+        "propagatedBuildInputs": [
+            "six",
+            'futures; python_version < "3"',
+            'typing-extensions; python_version < "3.8"',
+            'pyyaml; extra == "yaml"',
+            'mock; extra == "test"',
+        ],
+    }, python_version="3.7")
+
+    assert dependencies == {
+        "packageConditions": ["setuptools_scm>=1.0"],
+        "extraInputs": ["pyyaml # yaml"],
+        "buildInputs": ["setuptools-scm"],
+        "checkInputs": ["pytest", "mock"],
+        "propagatedBuildInputs": ["six", "typing-extensions"],
+    }
+
+
+def test_sanitize_dependencies_extra_markers():
+    dependencies = sanitize_dependencies({
+        "extraInputs": [],
+        "buildInputs": [],
+        "checkInputs": [],
+        "propagatedBuildInputs": [
+            'pyyaml; extra == "yaml" and python_version < "3"',
+            'ujson; python_version >= "3.6" and extra == "fast"',
+            'mock; extra == "test" and python_version < "3.3"',
+            'pytest; (extra == "test" or extra == "dev") and python_version >= "3"',
+        ],
+    }, python_version="3.12")
+
+    assert dependencies["extraInputs"] == ["ujson # fast"]
+    assert dependencies["checkInputs"] == ["pytest"]
+
+
+def test_sanitize_dependencies_keeps_invalid_requirements():
+    dependencies = sanitize_dependencies({
+        "extraInputs": [],
+        "buildInputs": [],
+        "checkInputs": [],
+        "propagatedBuildInputs": ["six", 'requests; python_version <', 'attrs; unknown_variable == "1"'],
+    }, python_version="3.12")
+
+    assert dependencies["packageConditions"] == ['requests; python_version <', 'attrs; unknown_variable == "1"']
+    assert dependencies["propagatedBuildInputs"] == ["six", "requests", "attrs"]
+
+
+def test_default_python_version():
+    assert DEFAULT_PYTHON_VERSION.startswith("{0}.{1}.".format(*sys.version_info))
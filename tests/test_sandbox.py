@@ -0,0 +1,74 @@
+import pytest
+
+import textwrap
+
+from nixpkgs_pytools.sandbox import SetupSandbox
+
+
+def write_setup(tmpdir, name, setup_py):
+    directory = tmpdir.mkdir(name)
+    directory.join("setup.py").write(textwrap.dedent(setup_py))
+    return str(directory)
+
+
+@pytest.fixture
+def sandbox():
+    with SetupSandbox(workers=1, timeout=5) as sandbox:
+        yield sandbox
+
+
+def test_sandbox_mock_setup(tmpdir, sandbox):
+    directory = write_setup(tmpdir, "example", """
+        import os
+        from setuptools import setup
+
+        here = os.path.dirname(__file__)
+        setup(install_requires=["six"], tests_require=("pytest", "mock"))
+    """)
+
+    assert sandbox.determine_dependencies(directory) == {
+        "extraInputs": [],
+        "buildInputs": [],
+        "checkInputs": ["pytest", "mock"],
+        "propagatedBuildInputs": ["six"],
+    }
+    # the worker process is kept for the next job
+    assert len(sandbox._idle) == 1
+
+
+@pytest.mark.parametrize(
+    "setup_py, error",
+    [
+        ("import time\ntime.sleep(60)\n", "timed out"),
+        ("import os\nos._exit(3)\n", "crashed with exit code 3"),
+        ("raise RuntimeError('broken')\n", "RuntimeError: broken"),
+    ],
+)
+def test_sandbox_failures(tmpdir, setup_py, error):
+    with SetupSandbox(workers=1, timeout=1) as sandbox:
+        directory = write_setup(tmpdir, "broken", setup_py)
+        with pytest.raises(ValueError) as e:
+            sandbox.determine_dependencies(directory)
+        assert error in str(e.value)
+
+        # a new worker replaces a killed one
+        directory = write_setup(tmpdir, "working", "from setuptools import setup\nsetup(install_requires=['six'])\n")
+        assert sandbox.determine_dependencies(directory)["propagatedBuildInputs"] == ["six"]
+
+
+def test_sandbox_replaces_dead_idle_worker(tmpdir, sandbox):
+    directory = write_setup(tmpdir, "example", "from setuptools import setup\nsetup(install_requires=['six'])\n")
+    sandbox.determine_dependencies(directory)
+    worker, = sandbox._idle
+    worker.process.kill()
+    worker.process.join()
+
+    assert sandbox.determine_dependencies(directory)["propagatedBuildInputs"] == ["six"]
+    assert sandbox._idle[0] is not worker
+
+    # a worker dying between the check and the job fails the job
+    worker = sandbox._idle[0]
+    worker.process.kill()
+    worker.process.join()
+    with pytest.raises(ValueError, match="crashed with exit code -9"):
+        worker.run(directory, 1)
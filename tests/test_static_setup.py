@@ -0,0 +1,174 @@
+import pytest
+
+import ast
+import textwrap
+
+from nixpkgs_pytools.static_setup import (
+    SetupEvaluator,
+    StaticEvaluationError,
+    determine_dependencies_from_static_setup,
+)
+
+
+def write_package(tmpdir, setup_py, files=None):
+    tmpdir.join("setup.py").write(textwrap.dedent(setup_py))
+    for filename, content in (files or {}).items():
+        tmpdir.join(filename).write(content)
+    return str(tmpdir)
+
+
+def test_static_setup_literals(tmpdir):
+    directory = write_package(tmpdir, """
+        from setuptools import setup, find_packages
+
+        base = ["six", "click>=7.0"]
+        install_requires = base + ["jinja2"]
+        install_requires += ["rope"]
+        install_requires.append("attrs")
+
+        setup(
+            name="example",
+            packages=find_packages(),
+            install_requires=install_requires,
+            setup_requires="setuptools_scm",
+            tests_require=["pytest"],
+            extras_require={"docs": ["sphinx"], "yaml": "pyyaml"},
+        )
+    """)
+
+    assert determine_dependencies_from_static_setup(directory) == {
+        "extraInputs": ["sphinx # docs", "pyyaml # yaml"],
+        "buildInputs": ["setuptools_scm"],
+        "checkInputs": ["pytest"],
+        "propagatedBuildInputs": ["six", "click>=7.0", "jinja2", "rope", "attrs"],
+    }
+
+
+class LegacyLiterals(ast.NodeTransformer):
+    """Replace constants by the literal nodes python < 3.8 parses"""
+
+    nodes = {
+        str: type("Str", (ast.AST,), {"_fields": ("s",)}),
+        bytes: type("Bytes", (ast.AST,), {"_fields": ("s",)}),
+        int: type("Num", (ast.AST,), {"_fields": ("n",)}),
+        float: type("Num", (ast.AST,), {"_fields": ("n",)}),
+        bool: type("NameConstant", (ast.AST,), {"_fields": ("value",)}),
+        type(None): type("NameConstant", (ast.AST,), {"_fields": ("value",)}),
+    }
+
+    def visit_Constant(self, node):
+        return self.nodes[type(node.value)](node.value)
+
+
+def test_static_setup_legacy_literals(tmpdir):
+    expression = ast.parse('{"install_requires": ["six"], "data": b"x", "python": 3.7 < 4, "zip_safe": None}')
+    expression = LegacyLiterals().visit(expression).body[0].value
+    assert type(expression.values[0].elts[0]).__name__ == "Str"
+
+    assert SetupEvaluator(str(tmpdir)).evaluate(expression) == {
+        "install_requires": ["six"], "data": b"x", "python": True, "zip_safe": None,
+    }
+
+
+def test_static_setup_requirements_files(tmpdir):
+    directory = write_package(tmpdir, """
+        import os
+        import sys
+        from setuptools import setup
+
+        here = os.path.abspath(os.path.dirname(__file__))
+
+        def read_requirements(filename):
+            with open(os.path.join(here, filename)) as f:
+                return [line.strip() for line in f]
+
+        with open(os.path.join(here, "requirements.txt")) as f:
+            install_requires = [line for line in f.read().splitlines() if line and not line.startswith("#")]
+
+        if sys.version_info < (3, 0):
+            install_requires.append("futures")
+
+        if __name__ == "__main__":
+            setup(
+                install_requires=install_requires,
+                tests_require=read_requirements("requirements-test.txt"),
+            )
+    """, {
+        "requirements.txt": "# runtime\nsix\nrequests>=2.0\n",
+        "requirements-test.txt": "-r requirements.txt\npytest  # tests\n",
+    })
+
+    dependencies = determine_dependencies_from_static_setup(directory)
+    assert dependencies["propagatedBuildInputs"] == ["six", "requests>=2.0"]
+    assert dependencies["checkInputs"] == ["six", "requests>=2.0", "pytest"]
+
+
+@pytest.mark.parametrize(
+    "setup_py",
+    [
+        # value depends on a loop
+        """
+        from setuptools import setup
+        install_requires = []
+        for name in get_names():
+            install_requires.append(name)
+        setup(install_requires=install_requires)
+        """,
+        # value returned by an arbitrary function
+        """
+        from setuptools import setup
+        import versioneer
+        setup(install_requires=versioneer.get_requirements())
+        """,
+        # setup is called indirectly
+        """
+        from setuptools import setup
+        def main():
+            setup(install_requires=["six"])
+        main()
+        """,
+        # list mutated by a helper function
+        """
+        from setuptools import setup
+        install_requires = ["six"]
+        def add_deps(requirements):
+            requirements.append("attrs")
+        add_deps(install_requires)
+        setup(install_requires=install_requires)
+        """,
+        # list mutated by a helper reading a requirements file
+        """
+        from setuptools import setup
+        install_requires = ["six"]
+        extend_requirements(install_requires, "requirements.txt")
+        setup(install_requires=install_requires)
+        """,
+        # file outside of the package
+        """
+        from setuptools import setup
+        setup(install_requires=open("/etc/passwd").read().splitlines())
+        """,
+    ],
+)
+def test_static_setup_fallback(tmpdir, setup_py):
+    directory = write_package(tmpdir, setup_py, {"requirements.txt": "attrs\n"})
+    with pytest.raises(StaticEvaluationError):
+        determine_dependencies_from_static_setup(directory)
+
+
+def test_static_setup_python_version(tmpdir):
+    directory = write_package(tmpdir, """
+        import sys
+        from setuptools import setup
+        install_requires = ["six"]
+        if sys.version_info < (3, 4):
+            install_requires.append("enum34")
+        if sys.version_info.major == 2:
+            install_requires.append("futures")
+        setup(install_requires=install_requires)
+    """)
+
+    assert determine_dependencies_from_static_setup(directory, "2.7")["propagatedBuildInputs"] == [
+        "six", "enum34", "futures"
+    ]
+    assert determine_dependencies_from_static_setup(directory, "3.7.4")["propagatedBuildInputs"] == ["six"]
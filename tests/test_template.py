@@ -0,0 +1,120 @@
+import pytest
+
+from nixpkgs_pytools import template
+from nixpkgs_pytools.python_package_init import metadata_to_nix
+from nixpkgs_pytools.template import DEFAULT_TEMPLATE, create_environment
+
+
+@pytest.fixture
+def metadata():
+    return {
+        "pname": "example",
+        "downloadname": "Example",
+        "version": "1.0",
+        "python_version": None,
+        "sha256": "0" * 64,
+        "extension": "tar.gz",
+        "description": "An example",
+        "homepage": "https://example.org",
+        "maintainer": "costrouc",
+        "resolved_license": "mit",
+        "license": "MIT",
+        "packageConditions": [],
+        "extraInputs": [],
+        "buildInputs": [],
+        "checkInputs": ["pytest"],
+        "propagatedBuildInputs": ["six"],
+        "checkPhase": "pytest",
+    }
+
+
+# output of the template before it moved to templates/default.nix.j2
+EXPECTED_NIX = "\n".join([
+    "        { lib",
+    "        , buildPythonPackage",
+    "        , fetchPypi",
+    "        , pytest",
+    "        , six",
+    "        }:",
+    "",
+    "        buildPythonPackage rec {",
+    '          pname = "example";',
+    '          version = "1.0";',
+    "        ",
+    "          src = fetchPypi {",
+    '            pname = "Example";',
+    "            inherit version;",
+    '            sha256 = "{sha256}";'.replace("{sha256}", "0" * 64),
+    "          };",
+    "        ",
+    "          checkInputs = [",
+    "            pytest",
+    "          ];",
+    "        ",
+    "          propagatedBuildInputs = [",
+    "            six",
+    "          ];",
+    "        ",
+    "          checkPhase = ''",
+    "            pytest",
+    "      flake8",
+    "          '';",
+    "        ",
+    "          meta = with lib; {",
+    '            description = "An example";',
+    '            homepage = "https://example.org";',
+    "            license = licenses.mit;",
+    "            # maintainers = [ maintainers.costrouc ];",
+    "          };",
+    "        }",
+])
+
+
+def test_metadata_to_nix(metadata):
+    metadata["checkPhase"] = "pytest\nflake8"
+    assert metadata_to_nix(metadata) == EXPECTED_NIX
+
+
+def test_metadata_to_nix_licenses(metadata):
+    metadata.update({"resolved_license": ["mit", "asl20"], "license_confidence": 0.9})
+    assert "\n            license = with licenses; [ mit asl20 ];\n" in metadata_to_nix(metadata)
+
+    metadata.update({"resolved_license": "mpl20", "license_confidence": 0.5, "license": "Mozilla"})
+    assert '\n            license = licenses.mpl20; # guessed from "Mozilla", verify\n' in metadata_to_nix(metadata)
+
+    metadata.update({"license_confidence": 0.0})
+    assert "# guessed" in metadata_to_nix(metadata)
+
+    metadata.update({"license_confidence": None})
+    assert "\n            license = licenses.mpl20;\n" in metadata_to_nix(metadata)
+
+
+def test_template_compiled_once():
+    environment = create_environment()
+    assert environment.get_template(DEFAULT_TEMPLATE) is environment.get_template(DEFAULT_TEMPLATE)
+
+
+def test_template_directory(tmpdir, metadata, monkeypatch):
+    tmpdir.mkdir("templates").join(DEFAULT_TEMPLATE).write("{{ metadata.pname }} {{ metadata.version }}")
+    environment = create_environment(
+        str(tmpdir.join("templates")), bytecode_cache_directory=str(tmpdir.join("bytecode"))
+    )
+    monkeypatch.setattr(template, "_default_environment", environment)
+
+    assert metadata_to_nix(metadata) == "example 1.0"
+    assert len(tmpdir.join("bytecode").listdir()) == 1
+
+    with pytest.raises(ValueError):
+        create_environment(str(tmpdir.join("missing")))
+
+
+def test_default_environment_created_on_first_render(tmpdir, metadata, monkeypatch):
+    tmpdir.mkdir("templates").join(DEFAULT_TEMPLATE).write("{{ metadata.pname }}")
+    monkeypatch.setattr(template, "_default_environment", None)
+    monkeypatch.setattr(template, "_default_environment_arguments", (None, None))
+
+    template.set_default_environment_arguments(str(tmpdir.join("templates")))
+    assert template._default_environment is None
+
+    assert metadata_to_nix(metadata) == "example"
+    assert template._default_environment is not None
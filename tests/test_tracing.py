@@ -0,0 +1,57 @@
+import pytest
+
+import json
+import os
+import threading
+
+from nixpkgs_pytools.tracing import Tracer, set_default_tracer, span, traced, profile
+
+
+@pytest.fixture
+def tracer(tmpdir):
+    tracer = Tracer(str(tmpdir.join("trace.json")), str(tmpdir.join("profiles")))
+    set_default_tracer(tracer)
+    yield tracer
+    set_default_tracer(None)
+
+
+@traced("fetch", "package_name")
+def fetch(package_name, version=None):
+    return package_name
+
+
+def test_span_without_tracer():
+    with span("package", package="six"):
+        pass
+    assert fetch("six") == "six"
+
+
+def test_trace_spans(tracer):
+    with span("package", package="six"):
+        assert fetch("six") == "six"
+    thread = threading.Thread(target=fetch, kwargs={"package_name": "attrs"}, name="worker")
+    thread.start()
+    thread.join()
+
+    events = [event for event in tracer.events]
+    assert [(event["name"], event["args"]) for event in events] == [
+        ("fetch", {"package_name": "six"}),
+        ("package", {"package": "six"}),
+        ("fetch", {"package_name": "attrs"}),
+    ]
+    fetch_event, package_event, _ = events
+    assert package_event["ts"] <= fetch_event["ts"]
+    assert fetch_event["ts"] + fetch_event["dur"] <= package_event["ts"] + package_event["dur"]
+    assert set(tracer.durations()) == {"fetch", "package"}
+
+    tracer.write()
+    with open(tracer.filename) as f:
+        trace = json.load(f)
+    assert all(event["ph"] in ("X", "M") for event in trace["traceEvents"])
+    assert {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": events[2]["tid"], "args": {"name": "worker"}} in trace["traceEvents"]
+
+
+def test_profile(tracer):
+    with profile("six"):
+        fetch("six")
+    assert os.path.isfile(os.path.join(tracer.profile_directory, "six.prof"))
@@ -0,0 +1,150 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import os
+import stat
+import textwrap
+
+from nixpkgs_pytools.update import changed_derivations, compare_inputs, update_derivations
+
+
+DERIVATION = textwrap.dedent("""\
+    { lib, buildPythonPackage, fetchPypi, fetchpatch, six }:
+
+    buildPythonPackage rec {
+      pname = "example";
+      version = "1.0";
+
+      src = fetchPypi {
+        pname = "Example";
+        inherit version;
+        {hash_attribute} = "{hash}";
+      };
+
+      patches = [
+        (fetchpatch {
+          url = "https://example.org/fix.patch";
+          sha256 = "0000000000000000000000000000000000000000000000000000";
+        })
+      ];
+
+      propagatedBuildInputs = [ six ];
+
+      meta = with lib; {
+        homepage = "https://example.org/${version}";
+      };
+    }
+""")
+
+SHA256 = "ab" * 32
+
+
+def package_json(version):
+    return {
+        "info": {"version": version},
+        "releases": {
+            version: [
+                {"packagetype": "bdist_wheel", "digests": {"sha256": "cd" * 32}},
+                {"packagetype": "sdist", "url": "https://example.org/Example.tar.gz", "digests": {"sha256": SHA256}},
+            ],
+        },
+    }
+
+
+def write_derivation(tmpdir, name, hash_attribute="sha256", hash="1" * 52):
+    filename = tmpdir.ensure(name, "default.nix")
+    filename.write(DERIVATION.replace("{hash_attribute}", hash_attribute).replace("{hash}", hash))
+    return str(filename)
+
+
+def test_update_derivations(tmpdir):
+    filenames = [
+        write_derivation(tmpdir, "example"),
+        write_derivation(tmpdir, "sri", "hash", "sha256-AAAA"),
+        write_derivation(tmpdir, "current"),
+    ]
+    download_package_json = mock.Mock(side_effect=[package_json("1.1"), package_json("1.1"), package_json("1.0")])
+    with mock.patch("nixpkgs_pytools.update.download_package_json", download_package_json):
+        results = update_derivations(filenames, jobs=1)
+
+    download_package_json.assert_called_with("Example")
+    assert [result.new_version for result in results] == ["1.1", "1.1", None]
+    assert not any(result.error for result in results)
+
+    content = open(filenames[0]).read()
+    assert 'version = "1.1";' in content
+    assert 'sha256 = "{sha256}";'.format(sha256=SHA256) in content
+    # only the hash of fetchPypi is replaced
+    assert 'sha256 = "0000000000000000000000000000000000000000000000000000";' in content
+    assert content == DERIVATION.replace("{hash_attribute}", "sha256").replace("{hash}", SHA256).replace('"1.0"', '"1.1"')
+    assert 'hash = "sha256-q6urq6urq6urq6urq6urq6urq6urq6urq6urq6urq6s=";' in open(filenames[1]).read()
+    assert open(filenames[2]).read() == DERIVATION.replace("{hash_attribute}", "sha256").replace("{hash}", "1" * 52)
+
+
+def test_update_dry_run(tmpdir):
+    filename = write_derivation(tmpdir, "example")
+    with mock.patch("nixpkgs_pytools.update.download_package_json", return_value=package_json("2.0")):
+        result, = update_derivations([filename], dry_run=True)
+    assert result.new_version == "2.0"
+    assert 'version = "1.0";' in open(filename).read()
+
+
+def test_update_keeps_file_mode(tmpdir):
+    filename = write_derivation(tmpdir, "example")
+    os.chmod(filename, 0o644)
+    with mock.patch("nixpkgs_pytools.update.download_package_json", return_value=package_json("2.0")):
+        result, = update_derivations([filename])
+    assert result.new_version == "2.0"
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o644
+
+
+def test_update_pep440_order(tmpdir):
+    release_candidate = write_derivation(tmpdir, "rc")
+    final = write_derivation(tmpdir, "final")
+    with open(release_candidate) as f:
+        content = f.read()
+    with open(release_candidate, "w") as f:
+        f.write(content.replace('version = "1.0";', 'version = "1.0rc2";'))
+
+    download_package_json = mock.Mock(side_effect=[package_json("1.0"), package_json("1.0b1")])
+    with mock.patch("nixpkgs_pytools.update.download_package_json", download_package_json):
+        results = update_derivations([release_candidate, final], jobs=1, dry_run=True)
+
+    assert [result.new_version for result in results] == ["1.0", None]
+
+
+def test_update_not_fetch_pypi(tmpdir):
+    filename = tmpdir.join("default.nix")
+    filename.write('{ fetchFromGitHub }: { version = "1.0"; src = fetchFromGitHub { sha256 = ""; }; }')
+    result, = update_derivations([str(filename)])
+    assert result.error == "source is not fetched with fetchPypi"
+
+
+def test_compare_inputs():
+    assert compare_inputs(DERIVATION, {"propagatedBuildInputs": ["six", "attrs"], "checkInputs": []}) == {
+        "propagatedBuildInputs": (["attrs"], []),
+    }
+
+
+def test_update_simple_index(tmpdir):
+    filename = write_derivation(tmpdir, "example")
+    simple_json = {"files": [
+        {"filename": "Example-1.1.tar.gz", "url": "https://example.org/Example-1.1.tar.gz", "hashes": {"sha256": SHA256}},
+        {"filename": "Example-1.1-py3-none-any.whl", "url": "", "hashes": {"sha256": "cd" * 32}},
+        {"filename": "Example-2.0rc1.tar.gz", "url": "", "hashes": {"sha256": "cd" * 32}},
+        {"filename": "Example-1.2.tar.gz", "url": "", "hashes": {"sha256": "cd" * 32}, "yanked": "broken"},
+    ]}
+    with mock.patch("nixpkgs_pytools.update.download_simple_json", return_value=simple_json), \
+            mock.patch("nixpkgs_pytools.update.download_package_json") as download_package_json:
+        result, = update_derivations([filename], simple_index=True)
+    assert not download_package_json.called
+    assert result.new_version == "1.1"
+    assert 'sha256 = "{sha256}";'.format(sha256=SHA256) in open(filename).read()
+
+
+def test_changed_derivations(tmpdir):
+    filenames = [write_derivation(tmpdir, "example"), str(tmpdir.ensure("other", "default.nix"))]
+    assert changed_derivations(filenames, {"example"}) == filenames
+    assert changed_derivations(filenames, {"six"}) == filenames[1:]
@@ -0,0 +1,15 @@
+import stat
+
+from nixpkgs_pytools.utils import UMASK, atomic_write
+
+
+def test_atomic_write_keeps_file_mode(tmpdir):
+    existing = tmpdir.join("existing.nix")
+    existing.write("{ }")
+    existing.chmod(0o640)
+    atomic_write(str(existing), b"{ a }")
+    assert stat.S_IMODE(existing.stat().mode) == 0o640
+
+    created = tmpdir.join("created.nix")
+    atomic_write(str(created), b"{ }")
+    assert stat.S_IMODE(created.stat().mode) == 0o666 & ~UMASK